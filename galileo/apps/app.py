@@ -9,6 +9,7 @@ class AppRequest(NamedTuple):
     method: str
     endpoint: str
     kwargs: dict
+    key: str = None
 
 
 class AppClient:
@@ -23,8 +24,14 @@ class AppClient:
         return getattr(self.module, item)
 
     def next_request(self) -> AppRequest:
-        method, endpoint, kwargs = self.module.next_request()
-        return AppRequest(self.name, method, endpoint, kwargs or {})
+        """
+        Returns the next request of the app module, whose ``next_request`` returns a tuple (method, endpoint, kwargs) or
+        (method, endpoint, kwargs, key), where key is the hash key used for consistent-hashing (e.g., an image ID).
+        """
+        request = self.module.next_request()
+        method, endpoint, kwargs = request[:3]
+        key = request[3] if len(request) > 3 else None
+        return AppRequest(self.name, method, endpoint, kwargs or {}, key)
 
 
 class DefaultAppClient(AppClient):
@@ -3,6 +3,8 @@ import json
 import logging
 import re
 import sre_constants
+import threading
+import time
 from collections import Counter
 from typing import List, Optional, Dict, Tuple
 
@@ -11,7 +13,8 @@ from pymq.typing import deep_from_dict
 from redis import Redis
 
 from galileo.worker.api import RegisterWorkerCommand, ClientDescription, CreateClientCommand, ClientConfig, \
-    StartTracingCommand, PauseTracingCommand, SetWorkloadCommand, StopWorkloadCommand
+    StartTracingCommand, PauseTracingCommand, SetWorkloadCommand, StopWorkloadCommand, WorkloadArmedEvent, \
+    StartWorkloadCommand, ClockEstimate
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +45,12 @@ class ClusterController:
     def list_workers_info(self, pattern: str = ''):
         raise NotImplementedError
 
+    def update_worker_clock(self, name: str, estimate: ClockEstimate):
+        raise NotImplementedError
+
+    def get_worker_clock(self, name: str) -> Optional[ClockEstimate]:
+        raise NotImplementedError
+
     def register_client(self, client: ClientDescription):
         raise NotImplementedError
 
@@ -60,7 +69,12 @@ class ClusterController:
     def stop_tracing(self):
         raise NotImplementedError
 
-    def set_workload(self, client_id, ia=None, n: int = None):
+    def set_workload(self, client_id, ia=None, n: int = None, seed: int = None, users: int = None,
+                     start: float = None):
+        raise NotImplementedError
+
+    def sync_workload(self, client_ids: List[str], ia=None, n: int = None, seed: int = None, users: int = None,
+                      start_delay: float = 1., timeout: float = 10.) -> Tuple[float, List[str]]:
         raise NotImplementedError
 
     def stop_workload(self, client_id):
@@ -93,6 +107,7 @@ def pack(n, workers, nr_clients):
 class RedisClusterController(ClusterController):
     worker_key = 'galileo:workers'
     worker_clients_key = 'galileo:worker:%s:clients'
+    worker_clock_key = 'galileo:worker:%s:clock'
     client_key = 'galileo:client:%s'
 
     def __init__(self, rds, eventbus=None) -> None:
@@ -120,7 +135,7 @@ class RedisClusterController(ClusterController):
     def unregister_worker(self, name: str):
         logger.info('unregistering worker %s', name)
         self.rds.srem(self.worker_key, name)
-        self.rds.delete(self.worker_clients_key % name)
+        self.rds.delete(self.worker_clients_key % name, self.worker_clock_key % name)
 
     def list_workers(self, pattern: str = ''):
         workers = self.rds.smembers(self.worker_key)
@@ -141,6 +156,16 @@ class RedisClusterController(ClusterController):
             items.append((worker, data))
         return items
 
+    def update_worker_clock(self, name: str, estimate: ClockEstimate):
+        self.rds.hmset(self.worker_clock_key % name, estimate._asdict())
+
+    def get_worker_clock(self, name: str) -> Optional[ClockEstimate]:
+        data = self.rds.hgetall(self.worker_clock_key % name)
+        if not data:
+            return None
+
+        return ClockEstimate(**{field: float(data[field]) for field in ClockEstimate._fields})
+
     def create_client(self, host: str, cfg: ClientConfig, num=1) -> List[ClientDescription]:
         cmd = CreateClientCommand(host, cfg, num)
         stub = self.eventbus.stub(f'WorkerDaemon.create_client:{host}', timeout=3)
@@ -228,9 +253,69 @@ class RedisClusterController(ClusterController):
     def stop_tracing(self):
         return self.eventbus.publish(PauseTracingCommand())
 
-    def set_workload(self, client_id, ia=None, n: int = None):
-        if ia is None and n is None:
-            raise ValueError('need interarrival or number of messages')
+    def set_workload(self, client_id, ia=None, n: int = None, seed: int = None, users: int = None,
+                     start: float = None):
+        """
+        Sets the workload of a client. By default, the workload is open-loop: requests are sent according to the
+        interarrival ``ia``. If ``users`` is given, the workload is closed-loop: the client runs the given number of
+        virtual users, which send a request, wait for the response and then wait for a think time given by ``ia``.
+        If ``start`` is given, the client starts the workload at that (wall-clock) time.
+        """
+        cmd = self._create_workload_command(client_id, ia, n, seed, users)
+        return self.eventbus.publish(cmd._replace(start=start))
+
+    def sync_workload(self, client_ids: List[str], ia=None, n: int = None, seed: int = None, users: int = None,
+                      start_delay: float = 1., timeout: float = 10.) -> Tuple[float, List[str]]:
+        """
+        Starts the same workload on all given clients at the same time (see ``set_workload`` for the workload
+        parameters). The clients first arm the workload, i.e., prepare it without starting it, and report when they are
+        ready. Once all clients are armed (or the timeout has passed), the controller tells them to start the workload
+        ``start_delay`` seconds later, which gives the start command time to reach all clients. Clients that did not
+        report in time are sent a StopWorkloadCommand, so they do not stay armed, and do not run the workload.
+
+        :param client_ids: the clients
+        :param start_delay: seconds between the start command and the start of the workload
+        :param timeout: seconds to wait for the clients to report that they are armed
+        :return: a tuple (start, armed), where start is the wall-clock time at which the workload starts, and armed the
+                 list of clients that run the workload
+        """
+        client_ids = set(client_ids)
+        armed = set()
+        condition = threading.Condition()
+
+        def on_armed(event: WorkloadArmedEvent):
+            with condition:
+                if event.client_id in client_ids:
+                    armed.add(event.client_id)
+                    condition.notify_all()
+
+        self.eventbus.subscribe(on_armed)
+        try:
+            for client_id in client_ids:
+                cmd = self._create_workload_command(client_id, ia, n, seed, users)
+                self.eventbus.publish(cmd._replace(armed=True))
+
+            with condition:
+                condition.wait_for(lambda: armed >= client_ids, timeout)
+                armed = set(armed)
+        finally:
+            self.eventbus.unsubscribe(on_armed)
+
+        start = time.time() + start_delay
+        self.eventbus.publish(StartWorkloadCommand(sorted(armed), start))
+
+        if armed != client_ids:
+            logger.warning('clients %s did not arm their workload in time', client_ids - armed)
+            for client_id in client_ids - armed:
+                self.stop_workload(client_id)
+
+        return start, sorted(armed)
+
+    @staticmethod
+    def _create_workload_command(client_id, ia=None, n: int = None, seed: int = None,
+                                 users: int = None) -> SetWorkloadCommand:
+        if ia is None and n is None and users is None:
+            raise ValueError('need interarrival, number of messages, or number of users')
 
         dist, params = 'constant', None
 
@@ -239,8 +324,7 @@ class RedisClusterController(ClusterController):
         elif isinstance(ia, tuple):
             dist, params = ia[0], ia[1:]
 
-        cmd = SetWorkloadCommand(client_id, num=n, distribution=dist, parameters=params)
-        return self.eventbus.publish(cmd)
+        return SetWorkloadCommand(client_id, num=n, distribution=dist, parameters=params, seed=seed, users=users)
 
     def stop_workload(self, client_id):
         return self.eventbus.publish(StopWorkloadCommand(client_id))
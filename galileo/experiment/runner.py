@@ -5,9 +5,20 @@ from galileodb.model import ExperimentConfiguration
 
 from galileo.controller import ClusterController
 from galileo.shell.shell import Galileo
+from galileo.worker.random import schedule
+
+start_delay = 2  # seconds between pushing the schedules to the clients and the start of the experiment
 
 
 def run_experiment(ctrl: ClusterController, exp: ExperimentConfiguration):
+    """
+    Runs the experiment by pushing the load schedule of each workload to its clients once. All clients start their
+    schedule at the same wall-clock time and then change their request rates locally at each tick.
+
+    :raises InvalidDistributionException: if the schedule of a workload is invalid, before any client is spawned
+    """
+    validate_experiment(exp)
+
     g = Galileo(ctrl)
     workload_clients = {}
 
@@ -16,16 +27,31 @@ def run_experiment(ctrl: ClusterController, exp: ExperimentConfiguration):
                                              parameters=workload.client_parameters)
 
     ticks = int(math.ceil(exp.duration / exp.interval))
+    start = time.time() + start_delay
+    end = start + exp.duration
 
-    for t in range(ticks):
-        for workload, clients in workload_clients.items():
-            service_rps = workload.ticks[t]
-            clients.rps(service_rps / workload.clients_per_host)
+    futures = list()
+    for workload, clients in workload_clients.items():
+        rates = [service_rps / workload.clients_per_host for service_rps in workload.ticks[:ticks]]
+        pattern = workload.arrival_pattern or 'constant'
+        futures.append(clients.schedule(rates, exp.interval, pattern=pattern, start=start))
 
-        time.sleep(exp.interval)
+    # returns once all clients are done with their schedule, or the experiment duration has passed
+    for future in futures:
+        future.wait(max(0., end - time.time()))
 
     for clients in workload_clients.values():
         clients.rps(0)
 
     for clients in workload_clients.values():
         clients.close()
+
+
+def validate_experiment(exp: ExperimentConfiguration):
+    """
+    Checks the arrival pattern, interval and rates of each workload, which would otherwise only fail in the clients.
+
+    :raises InvalidDistributionException: if the schedule of a workload is invalid
+    """
+    for workload in exp.workloads:
+        schedule(exp.interval, workload.ticks, workload.arrival_pattern or 'constant')
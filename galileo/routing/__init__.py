@@ -1,6 +1,10 @@
 from galileo.routing.balancer import Balancer, WeightedRoundRobinBalancer, StaticLocalhostBalancer, \
-    WeightedRandomBalancer, StaticHostBalancer
+    WeightedRandomBalancer, StaticHostBalancer, LatencyAwareBalancer, \
+    ConsistentHashBalancer
+from galileo.routing.health import HostHealth
+from galileo.routing.session import SessionPool
 from galileo.routing.router import ServiceRequest, Router, StaticRouter, HostRouter, ServiceRouter
+from galileo.routing.timing import RequestTiming
 from galileo.routing.table import RoutingRecord, RoutingTable, RedisRoutingTable, ReadOnlyListeningRedisRoutingTable
 
 __all__ = [
@@ -17,5 +21,10 @@ __all__ = [
     'WeightedRoundRobinBalancer',
     'StaticLocalhostBalancer',
     'WeightedRandomBalancer',
-    'StaticHostBalancer'
+    'StaticHostBalancer',
+    'LatencyAwareBalancer',
+    'ConsistentHashBalancer',
+    'SessionPool',
+    'HostHealth',
+    'RequestTiming'
 ]
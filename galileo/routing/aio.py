@@ -0,0 +1,176 @@
+"""
+asyncio variants of the routers in ``galileo.routing.router``. They require the optional ``aiohttp`` dependency, which
+is why they are not exported by the ``galileo.routing`` package.
+"""
+import abc
+import logging
+import time
+from datetime import timedelta
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from galileo import util
+from galileo.routing.router import Router, ServiceRequest, StaticRouter, DynamicRouter, HostRouter, ServiceRouter
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRouter(Router, abc.ABC):
+    """
+    Base class for routers that perform requests on an asyncio event loop. The ``request`` method is a coroutine that
+    returns a ``requests.Response``, so responses can be handled the same way as those of the synchronous routers.
+    The aiohttp session is created lazily, as it has to be created from within the running event loop.
+
+    Requests with ``stream=True`` are not streamed to the caller. Instead, their body is discarded and its size is
+    stored in the ``body_size`` attribute of the response.
+
+    The phases of requests with a RequestTiming are recorded with aiohttp request tracing. aiohttp does not report the
+    TLS handshake separately, so ``connect`` includes it, and ``tls`` remains 0.
+    """
+
+    def __init__(self, *args, limit: int = 0, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.limit = limit  # maximum number of open connections, 0 means no limit
+        self._session = None
+
+    async def request(self, req: ServiceRequest) -> requests.Response:
+        url = self._get_url(req)
+
+        logger.debug('forwarding request %s %s', req.method, url)
+
+        session = self._require_session()
+        stream = req.kwargs.get('stream', False)
+        kwargs = self._translate_kwargs(req.kwargs)
+
+        if req.timing is not None:
+            kwargs['trace_request_ctx'] = req.timing
+
+        req.sent = util.wall_time()
+        async with session.request(req.method, url, **kwargs) as resp:
+            if stream:
+                # the body is not needed, so it is discarded while it is read, and only its size is kept
+                body_size = 0
+                async for chunk in resp.content.iter_chunked(65536):
+                    body_size += len(chunk)
+                response = self._create_response(resp, b'')
+                response.body_size = body_size
+            else:
+                content = await resp.read()
+                response = self._create_response(resp, content)
+        req.done = req.sent
+        response.elapsed = timedelta(seconds=util.wall_time() - req.sent)
+
+        self._log_response(req, url, response)
+        return response
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _require_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[self._create_trace_config()])
+        return self._session
+
+    @staticmethod
+    def _create_trace_config() -> aiohttp.TraceConfig:
+        # the trace_request_ctx of a request is its RequestTiming (or None if the request is not timed)
+        async def on_request_start(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                ctx.trace_request_ctx._mark = time.monotonic()
+
+        async def on_connection_create_start(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                ctx.connect_start = time.monotonic()
+
+        async def on_connection_create_end(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                ctx.trace_request_ctx.connect = time.monotonic() - ctx.connect_start
+
+        async def on_request_end(session, ctx, params):
+            timing = ctx.trace_request_ctx
+            if timing is not None:
+                timing.ttfb = max(0., time.monotonic() - timing._mark - timing.connect)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    @staticmethod
+    def _translate_kwargs(kwargs: dict) -> dict:
+        """
+        Translates the keyword arguments of a ``requests.request`` call into the equivalent aiohttp arguments.
+        """
+        if not kwargs:
+            return kwargs
+
+        kwargs = dict(kwargs)
+
+        timeout = kwargs.pop('timeout', None)
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+
+        verify = kwargs.pop('verify', None)
+        if verify is False:
+            kwargs['ssl'] = False
+
+        kwargs.pop('stream', None)
+
+        return kwargs
+
+    @staticmethod
+    def _create_response(resp: aiohttp.ClientResponse, content: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = resp.status
+        response.reason = resp.reason
+        response.url = str(resp.url)
+        response.headers = CaseInsensitiveDict(resp.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = content
+        return response
+
+
+class AsyncStaticRouter(AsyncRouter, StaticRouter):
+    """
+    asyncio variant of the StaticRouter.
+    """
+    pass
+
+
+class AsyncDynamicRouter(AsyncRouter, DynamicRouter, abc.ABC):
+    """
+    asyncio variant of the DynamicRouter.
+    """
+
+    async def request(self, req: ServiceRequest) -> requests.Response:
+        then = time.monotonic()
+        try:
+            response = await super().request(req)
+        except Exception:
+            self._report_response(req, then, None)
+            raise
+
+        self._report_response(req, then, response)
+        return response
+
+
+class AsyncHostRouter(AsyncDynamicRouter, HostRouter):
+    """
+    asyncio variant of the HostRouter.
+    """
+    pass
+
+
+class AsyncServiceRouter(AsyncDynamicRouter, ServiceRouter):
+    """
+    asyncio variant of the ServiceRouter.
+    """
+    pass
@@ -1,10 +1,17 @@
 import abc
+import bisect
+import hashlib
+import itertools
+import logging
 import math
 import random
 import threading
 from functools import reduce
+from typing import List, Optional
 
-from galileo.routing.table import RoutingTable
+from galileo.routing.table import RoutingTable, RoutingRecord, CacheInfo
+
+logger = logging.getLogger(__name__)
 
 
 class Balancer(abc.ABC):
@@ -12,6 +19,42 @@ class Balancer(abc.ABC):
     def next_host(self, service=None):
         raise NotImplementedError
 
+    def next_hosts(self, service, k: int) -> List[str]:
+        """
+        Returns the next k hosts for the service at once, e.g., to pre-draw the hosts of a block of requests.
+        """
+        return [self.next_host(service) for _ in range(k)]
+
+    def next_host_for_key(self, service, key):
+        """
+        Returns the next host for a request with the given hash key (see ``ServiceRequest.key``). Balancers that do not
+        route by key ignore it.
+        """
+        return self.next_host(service)
+
+    def on_request(self, service, host):
+        """
+        Called by the router when it sends a request for the service to the host (returned by ``next_host``).
+        """
+        pass
+
+    def on_response(self, service, host, latency: float, ok: bool):
+        """
+        Called by the router when a request sent to the host has completed.
+
+        :param service: the service of the request
+        :param host: the host the request was sent to
+        :param latency: seconds from sending the request until the response was received (or the request failed)
+        :param ok: False if the request failed or the response has a server error status
+        """
+        pass
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        """
+        Returns the CacheInfo of the per-service state of the balancer, or None if it keeps no such state.
+        """
+        return None
+
 
 class StaticHostBalancer(Balancer):
     host: str
@@ -30,78 +73,559 @@ class StaticLocalhostBalancer(StaticHostBalancer):
         super().__init__('localhost')
 
 
-class WeightedRandomBalancer(Balancer):
-    _rtbl: RoutingTable
+def gcd(ls):
+    return reduce(math.gcd, ls)
+
 
-    def __init__(self, rtbl: RoutingTable) -> None:
+class RecordCachingBalancer(Balancer, abc.ABC):
+    """
+    Base class for balancers that compile the routing record of a service into a balancing state (e.g., a schedule),
+    which is kept until the routing table returns a different record for the service. Subclasses implement
+    ``_compile`` and ``_next``.
+
+    The state of a service is evicted when the routing table no longer has a record for it. Whenever a state is
+    (re-)built, the states of services that the routing table no longer lists are evicted as well, and if there are
+    more than ``max_entries`` states, the least recently used ones. ``cache_info`` reports the number of states and
+    evictions.
+    """
+    max_entries: int = 1024
+
+    def __init__(self, rtbl: RoutingTable, max_entries: int = None) -> None:
         super().__init__()
         self._rtbl = rtbl
+        self._states = dict()  # service name -> [record, state, last use]
+        self._lock = threading.Lock()
+        self._clock = itertools.count()
+        self._evictions = 0
+
+        if max_entries is not None:
+            self.max_entries = max_entries
 
     def next_host(self, service=None):
         if not service:
             raise ValueError
 
-        record = self._rtbl.get_routing(service)
-        host = random.choices(record.hosts, record.weights, k=1)[0]
+        return self._next(self._get_state(service))
 
-        return host
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(len(self._states), self.max_entries, self._evictions)
 
+    def _get_state(self, service):
+        try:
+            record = self._rtbl.get_routing(service)
+        except ValueError:
+            # the service was removed from the routing table
+            if service in self._states:
+                with self._lock:
+                    self._evict([service])
+            raise
+
+        entry = self._states.get(service)
+        # caching routing tables return the same record object until the record changes, so the identity check is
+        # usually enough
+        if entry is not None and (entry[0] is record or entry[0] == record):
+            entry[2] = next(self._clock)
+            return entry[1]
+
+        # the routing table may have to query redis, which should not happen while holding the lock
+        services = self._list_services()
 
-def gcd(ls):
-    return reduce(math.gcd, ls)
+        with self._lock:
+            entry = self._states.get(service)
+            if entry is not None and (entry[0] is record or entry[0] == record):  # avoid race condition
+                return entry[1]
+
+            state = self._compile(record)
+            self._states[service] = [record, state, next(self._clock)]
+            self._prune(service, services)
+            return state
+
+    def _list_services(self):
+        try:
+            return set(self._rtbl.list_services())
+        except NotImplementedError:
+            return None
+
+    def _prune(self, current, services):
+        """
+        Evicts the states of services that are not in ``services`` (unless it is None), and then the least recently
+        used states beyond ``max_entries``. Called while holding the lock.
+        """
+        if services is not None:
+            # the current service may not be listed yet, e.g., if the table has not received its update
+            self._evict([s for s in self._states if s not in services and s != current])
+
+        excess = len(self._states) - self.max_entries
+        if excess > 0:
+            lru = sorted((entry[2], service) for service, entry in self._states.items() if service != current)
+            self._evict([service for _, service in lru[:excess]])
+
+    def _evict(self, services):
+        for service in services:
+            entry = self._states.pop(service, None)
+            if entry is None:
+                continue
+            self._evictions += 1
+            self._on_evict(service, entry[1])
+
+        if services:
+            logger.debug('evicted balancer state of %d services, %d remaining', len(services), len(self._states))
+
+    def _on_evict(self, service, state):
+        pass
+
+    def _compile(self, record: RoutingRecord):
+        raise NotImplementedError
+
+    def _next(self, state):
+        raise NotImplementedError
 
 
-class WeightedRoundRobinBalancer(Balancer):
+class AliasTable:
     """
-    Implementation of http://kb.linuxvirtualserver.org/wiki/Weighted_Round-Robin_Scheduling
+    Alias table (Vose's alias method) for sampling items with the given weights in O(1), after O(n) construction.
+    """
+
+    def __init__(self, items: List, weights: List[float]) -> None:
+        super().__init__()
+        n = len(items)
+        total = sum(weights)
+        if n == 0 or total <= 0:
+            raise ValueError('need at least one item with a positive weight')
+
+        prob = [w * n / total for w in weights]
+        alias = list(range(n))
+
+        small = [i for i, p in enumerate(prob) if p < 1]
+        large = [i for i, p in enumerate(prob) if p >= 1]
+
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            alias[s] = g
+            prob[g] = prob[g] + prob[s] - 1
+            if prob[g] < 1:
+                small.append(g)
+            else:
+                large.append(g)
+
+        # remaining entries are (up to rounding errors) exactly 1
+        for i in small + large:
+            prob[i] = 1.
+
+        self.items = items
+        self.prob = prob
+        self.alias = alias
+
+    def sample(self, rnd=random.random):
+        # one random number selects both the column and the coin flip within the column
+        u = rnd() * len(self.prob)
+        i = int(u)
+        if u - i < self.prob[i]:
+            return self.items[i]
+        return self.items[self.alias[i]]
+
+    def sample_many(self, k: int, rnd=random.random) -> List:
+        items, prob, alias, n = self.items, self.prob, self.alias, len(self.prob)
+
+        result = list()
+        for _ in range(k):
+            u = rnd() * n
+            i = int(u)
+            result.append(items[i] if u - i < prob[i] else items[alias[i]])
+        return result
+
+
+class WeightedRandomBalancer(RecordCachingBalancer):
+    """
+    Picks a random host with a probability proportional to its weight. Each routing record is compiled into an
+    AliasTable, so sampling a host is O(1) regardless of the number of hosts.
+    """
+
+    def next_hosts(self, service, k: int) -> List[str]:
+        if not service:
+            raise ValueError
+
+        return self._get_state(service).sample_many(k)
 
-    FIXME: generators are never freed
+    def _compile(self, record: RoutingRecord):
+        return AliasTable(record.hosts, record.weights)
+
+    def _next(self, state):
+        return state.sample()
+
+
+def wrr_schedule(hosts: List[str], weights: List[int]) -> List[str]:
     """
+    Computes one period of the weighted round-robin sequence of
+    http://kb.linuxvirtualserver.org/wiki/Weighted_Round-Robin_Scheduling. The period contains each host
+    ``weight / gcd(weights)`` times.
+    """
+    if not weights or max(weights) <= 0:
+        raise ValueError('need at least one host with a positive weight')
+
+    g = gcd(weights)
+    length = sum(w for w in weights if w > 0) // g
+    n = len(hosts)
 
-    def __init__(self, rtbl: RoutingTable) -> None:
+    schedule = list()
+    i = -1
+    cw = 0
+
+    while len(schedule) < length:
+        i = (i + 1) % n
+        if i == 0:
+            cw = cw - g
+            if cw <= 0:
+                cw = max(weights)
+
+        if weights[i] >= cw:
+            schedule.append(hosts[i])
+
+    return schedule
+
+
+class SmoothWeightedRoundRobin:
+    """
+    Smooth weighted round-robin (as used by nginx), which needs O(n) per pick but no memory proportional to the sum of
+    the weights. Used for records whose WRR schedule would be too long to precompute.
+    """
+
+    def __init__(self, hosts: List[str], weights: List[int]) -> None:
         super().__init__()
-        self._rtbl = rtbl
-        self._generators = dict()  # service name -> generator
+        if not weights or max(weights) <= 0:
+            raise ValueError('need at least one host with a positive weight')
+
+        self.hosts = hosts
+        self.weights = weights
+        self.total = sum(weights)
+        self.current = [0] * len(hosts)
         self._lock = threading.Lock()
 
-    def generator(self, service):
-        i = -1
-        cw = 0
+    def __next__(self):
+        with self._lock:
+            current = self.current
+            best = 0
+            for i, weight in enumerate(self.weights):
+                current[i] += weight
+                if current[i] > current[best]:
+                    best = i
 
-        while True:
-            record = self._rtbl.get_routing(service)
+            current[best] -= self.total
+            return self.hosts[best]
 
-            hosts = record.hosts
-            weights = [int(w) for w in record.weights]
+    def __iter__(self):
+        return self
 
-            n = len(hosts)
-            i = (i + 1) % n
-            if i == 0:
-                cw = cw - gcd(weights)
-                if cw <= 0:
-                    cw = max(weights)
-                    if cw == 0:
-                        raise ValueError
 
-            if weights[i] >= cw:
-                yield hosts[i]
+class WeightedRoundRobinBalancer(RecordCachingBalancer):
+    """
+    Implementation of http://kb.linuxvirtualserver.org/wiki/Weighted_Round-Robin_Scheduling
 
-    def _require_generator(self, service):
-        gen = self._generators.get(service)
-        if gen:
-            return gen
+    Each routing record is compiled once into the host sequence of one scheduling period, which is then cycled through,
+    so picking a host is O(1). Records whose period would be longer than ``max_schedule_length`` use a
+    SmoothWeightedRoundRobin state instead.
+    """
+    max_schedule_length = 4096
+
+    def _compile(self, record: RoutingRecord):
+        weights = [int(w) for w in record.weights]
+        positive = [w for w in weights if w > 0]
+
+        if positive and sum(positive) // gcd(positive) > self.max_schedule_length:
+            return SmoothWeightedRoundRobin(record.hosts, weights)
+
+        return itertools.cycle(wrr_schedule(record.hosts, weights))
+
+    def _next(self, state):
+        return next(state)
+
+
+class HostStats:
+    __slots__ = ('outstanding', 'ewma', 'samples')
+
+    def __init__(self) -> None:
+        self.outstanding = 0
+        self.ewma = 0.
+        self.samples = 0
+
+    def __repr__(self):
+        return 'HostStats(outstanding=%d, ewma=%.6f, samples=%d)' % (self.outstanding, self.ewma, self.samples)
+
+
+class LatencyAwareBalancer(RecordCachingBalancer):
+    """
+    Picks hosts based on the feedback the router reports for completed requests (see ``Balancer.on_response``), rather
+    than on the weights of the routing table. For each service and host, it tracks the number of outstanding requests
+    and an exponentially weighted moving average (EWMA) of the latency. Hosts with a weight of 0 are not used.
+
+    Policies:
+
+    - ``p2c``: power of two choices, i.e., picks two hosts at random and takes the one with the lower expected cost
+      ``ewma * (outstanding + 1)``
+    - ``least-outstanding``: takes the host with the fewest outstanding requests (ties are broken by the EWMA)
+
+    For ``p2c``, a host without any completed request is assumed to have the mean EWMA of the other hosts of the service
+    (or ``error_penalty`` if no host has completed a request yet), so a host that never answers does not look free
+    however many requests are outstanding on it. ``least-outstanding`` compares the outstanding requests first, so hosts
+    without completed requests are tried first. Failed requests count with a latency of at least ``error_penalty``
+    seconds, which keeps hosts that fail fast from attracting all requests.
+
+    :param rtbl: the routing table
+    :param policy: p2c|least-outstanding
+    :param alpha: the weight of a new latency sample in the EWMA
+    :param error_penalty: the minimum latency recorded for a failed request
+    :param rnd: the random number generator used to pick hosts
+    """
+    policies = ('p2c', 'least-outstanding')
+
+    def __init__(self, rtbl: RoutingTable, policy: str = 'p2c', alpha: float = 0.3, error_penalty: float = 1.,
+                 rnd: random.Random = None) -> None:
+        super().__init__(rtbl)
+        if policy not in self.policies:
+            raise ValueError('unknown policy %s, expected one of %s' % (policy, self.policies))
+        if not 0 < alpha <= 1:
+            raise ValueError('alpha has to be in (0, 1]')
+
+        self.policy = policy
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self._random = rnd or random.Random()
+        self._stats = dict()  # (service, host) -> HostStats
+        self._stats_lock = threading.Lock()
+
+    def get_stats(self, service, host) -> HostStats:
+        key = (service, host)
+        stats = self._stats.get(key)
+        if stats is None:
+            with self._stats_lock:
+                stats = self._stats.setdefault(key, HostStats())
+        return stats
+
+    def on_request(self, service, host):
+        stats = self.get_stats(service, host)
+        with self._stats_lock:
+            stats.outstanding += 1
+
+    def on_response(self, service, host, latency: float, ok: bool):
+        if not ok:
+            latency = max(latency, self.error_penalty)
+
+        stats = self._stats.get((service, host))
+        if stats is None:
+            # the host was removed from the routing record while the request was outstanding
+            return
+
+        with self._stats_lock:
+            stats.outstanding = max(0, stats.outstanding - 1)
+            if stats.samples == 0:
+                stats.ewma = latency
+            else:
+                stats.ewma += self.alpha * (latency - stats.ewma)
+            stats.samples += 1
+
+    def _compile(self, record: RoutingRecord):
+        hosts = [host for host, weight in zip(record.hosts, record.weights) if weight > 0]
+        if not hosts:
+            raise ValueError('no hosts with a positive weight for service %s' % record.service)
+
+        # called while holding the lock, so the previous state of the service can be read safely
+        entry = self._states.get(record.service)
+        if entry is not None:
+            self._drop_stats(record.service, set(entry[1][2]) - set(hosts))
+
+        return record.service, [self.get_stats(record.service, host) for host in hosts], hosts
+
+    def _on_evict(self, service, state):
+        self._drop_stats(service, state[2])
+
+    def _drop_stats(self, service, hosts):
+        with self._stats_lock:
+            for host in hosts:
+                self._stats.pop((service, host), None)
+
+    def _next(self, state):
+        service, stats, hosts = state
+        n = len(hosts)
+
+        if n == 1:
+            return hosts[0]
+
+        if self.policy == 'p2c':
+            i, j = self._random.sample(range(n), 2)
+            a, b = stats[i], stats[j]
+
+            ewma_a, ewma_b = a.ewma, b.ewma
+            if a.samples == 0 or b.samples == 0:
+                default = self._mean_ewma(stats)
+                ewma_a = ewma_a if a.samples else default
+                ewma_b = ewma_b if b.samples else default
+
+            return hosts[i] if ewma_a * (a.outstanding + 1) <= ewma_b * (b.outstanding + 1) else hosts[j]
+
+        # least-outstanding, starting at a random offset so that ties are not always broken in favor of the same host
+        offset = self._random.randrange(n)
+        best = None
+        for k in range(n):
+            i = (offset + k) % n
+            if best is None or (stats[i].outstanding, stats[i].ewma) < (stats[best].outstanding, stats[best].ewma):
+                best = i
+        return hosts[best]
+
+    def _mean_ewma(self, stats: List[HostStats]) -> float:
+        """
+        Returns the mean EWMA of the hosts that have completed requests, or ``error_penalty`` if there are none.
+        """
+        ewmas = [s.ewma for s in stats if s.samples]
+        return sum(ewmas) / len(ewmas) if ewmas else self.error_penalty
+
+
+def ring_hash(value) -> int:
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    A consistent hash ring with virtual nodes. A host has a number of points on the ring proportional to its weight,
+    and the points of a host only depend on its name, so adding or removing a host only moves the keys that hash to its
+    points. Rings are immutable, ``update`` returns a new ring that re-uses the points of unchanged hosts.
+    """
+
+    def __init__(self, points: List, weights: dict) -> None:
+        super().__init__()
+        self.points = points  # sorted list of (hash, host)
+        self.hashes = [h for h, _ in points]
+        self.weights = weights  # host -> weight (only hosts with a positive weight)
+        self.total_weight = sum(weights.values())
+
+    @staticmethod
+    def host_points(host, n: int) -> List:
+        return [(ring_hash('%s#%d' % (host, i)), host) for i in range(n)]
+
+    @staticmethod
+    def point_counts(weights: dict, vnodes: int) -> dict:
+        # a host with the mean weight gets vnodes points
+        mean = sum(weights.values()) / len(weights)
+        return {host: max(1, round(vnodes * weight / mean)) for host, weight in weights.items()}
+
+    @classmethod
+    def create(cls, hosts: List[str], weights: List[float], vnodes: int = 100) -> 'HashRing':
+        return cls.EMPTY.update(hosts, weights, vnodes)
+
+    def update(self, hosts: List[str], weights: List[float], vnodes: int = 100) -> 'HashRing':
+        new_weights = {host: weight for host, weight in zip(hosts, weights) if weight > 0}
+        if not new_weights:
+            raise ValueError('need at least one host with a positive weight')
+
+        old_counts = self.point_counts(self.weights, vnodes) if self.weights else dict()
+        new_counts = self.point_counts(new_weights, vnodes)
+
+        changed = {host for host in set(old_counts) | set(new_counts) if old_counts.get(host) != new_counts.get(host)}
+        if not changed:
+            return HashRing(self.points, new_weights)
+
+        points = [point for point in self.points if point[1] not in changed]
+        for host in changed:
+            if host in new_counts:
+                points.extend(self.host_points(host, new_counts[host]))
+        points.sort()
+
+        return HashRing(points, new_weights)
+
+    def lookup(self, key_hash: int) -> int:
+        """
+        Returns the index of the first point clockwise from the given hash.
+        """
+        i = bisect.bisect_left(self.hashes, key_hash)
+        return 0 if i == len(self.hashes) else i
 
-        with self._lock:
-            if service in self._generators:  # avoid race condition
-                return self._generators[service]
 
-            gen = self.generator(service)
-            self._generators[service] = gen
-            return gen
+HashRing.EMPTY = HashRing([], dict())
+
+
+class ConsistentHashBalancer(RecordCachingBalancer):
+    """
+    Routes requests with the same key (see ``ServiceRequest.key``) to the same host, using consistent hashing with
+    virtual nodes and bounded loads. The ring is built from the hosts and weights of the routing record, and is updated
+    incrementally when the record changes, so only keys of added or removed hosts move.
+
+    With bounded loads, a host accepts a request only while its outstanding requests (reported through
+    ``on_request``/``on_response``) are below ``ceil(load_factor * (outstanding + 1) * weight / total_weight)``,
+    where outstanding is the number of outstanding requests of the service. Otherwise, the request goes to the next
+    host clockwise on the ring. A ``load_factor`` of None disables the bound. Requests without a key go to the host
+    with the fewest outstanding requests relative to its weight.
+
+    :param rtbl: the routing table
+    :param vnodes: the number of points on the ring of a host with the mean weight
+    :param load_factor: how much more than its fair share of outstanding requests a host may get (> 1)
+    """
+
+    def __init__(self, rtbl: RoutingTable, vnodes: int = 100, load_factor: Optional[float] = 1.25) -> None:
+        super().__init__(rtbl)
+        if load_factor is not None and load_factor <= 1:
+            raise ValueError('load_factor has to be > 1')
+
+        self.vnodes = vnodes
+        self.load_factor = load_factor
+        self._loads = dict()  # (service, host) -> outstanding requests, only hosts with outstanding requests
+        self._service_loads = dict()  # service -> outstanding requests
+        self._loads_lock = threading.Lock()
 
     def next_host(self, service=None):
         if not service:
             raise ValueError
 
-        gen = self._require_generator(service)
-        return next(gen)
+        ring = self._get_state(service)
+        return min(ring.weights, key=lambda host: self._loads.get((service, host), 0) / ring.weights[host])
+
+    def next_host_for_key(self, service, key):
+        if key is None:
+            return self.next_host(service)
+        if not service:
+            raise ValueError
+
+        ring = self._get_state(service)
+        points = ring.points
+        i = ring.lookup(ring_hash(key))
+
+        if self.load_factor is None:
+            return points[i][1]
+
+        bound = self.load_factor * (self._service_loads.get(service, 0) + 1) / ring.total_weight
+        tried = set()
+        for k in range(len(points)):
+            host = points[(i + k) % len(points)][1]
+            if host in tried:
+                continue
+            if self._loads.get((service, host), 0) < math.ceil(bound * ring.weights[host]):
+                return host
+            tried.add(host)
+            if len(tried) == len(ring.weights):
+                break
+
+        # not reachable with load_factor > 1, as the capacities add up to more than the outstanding requests
+        return points[i][1]
+
+    def on_request(self, service, host):
+        with self._loads_lock:
+            self._loads[(service, host)] = self._loads.get((service, host), 0) + 1
+            self._service_loads[service] = self._service_loads.get(service, 0) + 1
+
+    def on_response(self, service, host, latency: float, ok: bool):
+        with self._loads_lock:
+            # entries are removed when they drop to 0, so loads of removed hosts and services do not accumulate
+            load = self._loads.pop((service, host), 0)
+            if load == 0:
+                return
+            if load > 1:
+                self._loads[(service, host)] = load - 1
+
+            service_load = self._service_loads.pop(service) - 1
+            if service_load > 0:
+                self._service_loads[service] = service_load
+
+    def _compile(self, record: RoutingRecord):
+        # _compile is called while holding the lock, so the previous state of the service can be read safely
+        entry = self._states.get(record.service)
+        previous = entry[1] if entry is not None else HashRing.EMPTY
+        return previous.update(record.hosts, record.weights, self.vnodes)
@@ -0,0 +1,156 @@
+"""
+Passive health checks for the hosts of a DynamicRouter. Each host has a circuit breaker that is fed with the outcome of
+the requests sent to it:
+
+- ``closed``: requests pass. After ``failure_threshold`` consecutive failures, the breaker opens.
+- ``open``: the host receives no requests, so the router picks another one. After ``reset_timeout`` seconds, the
+  breaker becomes half-open.
+- ``half-open``: a single probe request is let through. If it succeeds, the breaker closes, otherwise it opens again.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class HostUnavailableError(Exception):
+    """
+    Raised by a router if it could not find a host whose circuit breaker lets the request through.
+    """
+    pass
+
+
+class CircuitBreaker:
+    __slots__ = ('state', 'failures', 'opened', 'probing')
+
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0.
+        self.probing = False
+
+    def __repr__(self):
+        return 'CircuitBreaker(state=%s, failures=%d)' % (self.state, self.failures)
+
+
+class HostHealth:
+    """
+    Keeps one CircuitBreaker per host. Breakers only exist for hosts that have failed recently, so checking a healthy
+    host does not take a lock.
+
+    :param failure_threshold: the number of consecutive failures that open the breaker of a host
+    :param reset_timeout: seconds after which an open breaker lets a probe request through
+    :param listener: called with (host, old state, new state) on every state change
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.,
+                 listener: Callable[[str, str, str], None] = None) -> None:
+        super().__init__()
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold has to be at least 1')
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.listener = listener
+
+        self._breakers: Dict[str, CircuitBreaker] = dict()
+        self._lock = threading.Lock()
+
+    def state(self, host) -> str:
+        breaker = self._breakers.get(host)
+        return breaker.state if breaker is not None else CLOSED
+
+    def acquire(self, host) -> bool:
+        """
+        Returns True if a request may be sent to the host. If the breaker of the host is half-open, the request is the
+        probe, and no other request is let through until its outcome was reported.
+        """
+        breaker = self._breakers.get(host)
+        if breaker is None or breaker.state == CLOSED:
+            return True
+
+        with self._lock:
+            if breaker.state == OPEN:
+                if time.monotonic() - breaker.opened < self.reset_timeout:
+                    return False
+                old = self._set_state(breaker, HALF_OPEN)
+            elif breaker.state == HALF_OPEN:
+                if breaker.probing:
+                    return False
+                old = None
+            else:
+                return True
+
+            breaker.probing = True
+
+        if old is not None:
+            self._notify(host, old, HALF_OPEN)
+        return True
+
+    def on_success(self, host, sent: float = None):
+        """
+        Reports a successful request to the host.
+
+        :param host: the host
+        :param sent: the ``time.monotonic()`` at which the request was sent. Successes of requests that were sent before
+                     the breaker opened do not close it, only the probe does.
+        """
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            return
+
+        with self._lock:
+            if breaker.state == OPEN:
+                # the request was sent before the breaker opened, open breakers let no requests through
+                return
+            if breaker.state == HALF_OPEN and sent is not None and sent < breaker.opened:
+                return
+
+            # healthy hosts do not need a breaker
+            if self._breakers.pop(host, None) is None:
+                return
+            old = breaker.state
+
+        if old != CLOSED:
+            self._notify(host, old, CLOSED)
+
+    def on_failure(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker()
+                self._breakers[host] = breaker
+
+            breaker.failures += 1
+            breaker.probing = False
+
+            if breaker.state == HALF_OPEN or (breaker.state == CLOSED and breaker.failures >= self.failure_threshold):
+                breaker.opened = time.monotonic()
+                old = self._set_state(breaker, OPEN)
+            else:
+                return
+
+        self._notify(host, old, OPEN)
+
+    @staticmethod
+    def _set_state(breaker: CircuitBreaker, state: str) -> str:
+        old = breaker.state
+        breaker.state = state
+        return old
+
+    def _notify(self, host, old, new):
+        logger.info('circuit breaker of host %s changed from %s to %s', host, old, new)
+
+        if self.listener is None:
+            return
+
+        try:
+            self.listener(host, old, new)
+        except Exception:
+            logger.exception('error while reporting circuit breaker state change of host %s', host)
@@ -1,22 +1,41 @@
 import abc
 import logging
 import time
+from typing import Optional
+
 import requests
 
+from galileo import util
 from galileo.routing.balancer import Balancer
+from galileo.routing.health import HostHealth, HostUnavailableError
+from galileo.routing.session import SessionPool
+from galileo.routing.table import CacheInfo
+from galileo.routing.timing import RequestTiming, recording, request as timed_request
 
 logger = logging.getLogger(__name__)
 
 
 class ServiceRequest:
+    """
+    A request to a service. ``created`` is the time the request object was created, ``scheduled`` is the time at
+    which the request was due according to the workload (set by the RequestGenerator, may be None), ``sent`` and
+    ``done`` are set by the router, as is ``host`` by routers that use a balancer. All timestamps are taken with
+    ``util.wall_time``. If ``timing`` is set to a RequestTiming, the router records the phases of the request into it
+    (see ``galileo.routing.timing``). ``key`` is an optional hash key (e.g., the ID of the requested object) that
+    balancers like the ConsistentHashBalancer use to route requests with the same key to the same host.
+    """
     service: str
     path: str
     method: str
     kwargs: dict
 
     created: float
+    scheduled: float
     sent: float
     done: float
+    timing: RequestTiming
+    host: str
+    key: str
 
     def __init__(self, service, path='/', method='get', **kwargs) -> None:
         super().__init__()
@@ -25,12 +44,22 @@ class ServiceRequest:
         self.method = method
         self.kwargs = kwargs
 
-        self.created = time.time()
+        self.created = util.wall_time()
+        self.scheduled = None
+        self.timing = None
+        self.host = None
+        self.key = None
 
 
 class Router(abc.ABC):
+    """
+    Sends ServiceRequest objects to the URL determined by ``_get_url``. If a SessionPool is set, requests are sent
+    over the pooled keep-alive sessions, otherwise each request is sent with ``requests.request``.
+    """
+    session_pool: SessionPool
 
-    def __init__(self):
+    def __init__(self, session_pool: SessionPool = None):
+        self.session_pool = session_pool
         self.last_log_update = time.time()
         self.requests_since_last_log_update = 0
 
@@ -39,21 +68,43 @@ class Router(abc.ABC):
 
         logger.debug('forwarding request %s %s', req.method, url)
 
-        req.sent = time.time()
-        response = requests.request(req.method, url, **req.kwargs)
+        req.sent = util.wall_time()
+        if req.timing is None:
+            response = self._send(req, url)
+        else:
+            with recording(req.timing):
+                response = self._send(req, url)
+            # elapsed is the time until the response headers were parsed
+            req.timing.ttfb = max(0., response.elapsed.total_seconds() - req.timing.connect - req.timing.tls)
         req.done = req.sent
 
+        self._log_response(req, url, response)
+        return response
+
+    def _send(self, req: ServiceRequest, url: str) -> requests.Response:
+        if self.session_pool is not None:
+            return self.session_pool.request(req.method, url, **req.kwargs)
+        if req.timing is not None:
+            return timed_request(req.method, url, **req.kwargs)
+        return requests.request(req.method, url, **req.kwargs)
+
+    def _log_response(self, req: ServiceRequest, url: str, response: requests.Response):
         logger.debug('%s %s: %s', req.method, url, response.status_code)
         self.requests_since_last_log_update += 1
         if time.time() - self.last_log_update >= 1:
             logger.debug(f'Sent {self.requests_since_last_log_update} requests in the last second')
             self.requests_since_last_log_update = 0
             self.last_log_update = time.time()
-        return response
 
     def _get_url(self, req: ServiceRequest) -> str:
         raise NotImplementedError
 
+    def cache_info(self) -> Optional[CacheInfo]:
+        """
+        Returns the CacheInfo of the balancer state of the router, or None if the router does not use a balancer.
+        """
+        return None
+
 
 class StaticRouter(Router):
     """
@@ -61,8 +112,8 @@ class StaticRouter(Router):
     everything to a webserver on localhost:8080.
     """
 
-    def __init__(self, path_prefix) -> None:
-        super().__init__()
+    def __init__(self, path_prefix, session_pool: SessionPool = None) -> None:
+        super().__init__(session_pool=session_pool)
         self.path_prefix = path_prefix
 
     def _get_url(self, req: ServiceRequest) -> str:
@@ -71,18 +122,74 @@ class StaticRouter(Router):
 
 class DynamicRouter(Router, abc.ABC):
     """
-    Abstract base class for routing using a balancer.
+    Abstract base class for routing using a balancer. The router reports each request to the balancer when it is sent
+    and when it has completed (see ``Balancer.on_request`` and ``Balancer.on_response``), so balancers can take the
+    observed latencies into account.
+
+    If a HostHealth is set, the outcome of each request is also fed into the circuit breaker of its host (see
+    ``galileo.routing.health``). Hosts with an open breaker are skipped by drawing another host from the balancer, which
+    re-distributes their share of the requests among the other hosts. If no available host is found within
+    ``max_attempts`` draws, the request fails with a HostUnavailableError.
     """
     _balancer: Balancer
+    max_attempts: int = 8
 
-    def __init__(self, balancer: Balancer) -> None:
-        super().__init__()
+    def __init__(self, balancer: Balancer, session_pool: SessionPool = None, health: HostHealth = None) -> None:
+        super().__init__(session_pool=session_pool)
         self._balancer = balancer
+        self.health = health
+
+    def request(self, req: ServiceRequest) -> requests.Response:
+        then = time.monotonic()
+        try:
+            response = super().request(req)
+        except Exception:
+            self._report_response(req, then, None)
+            raise
+
+        self._report_response(req, then, response)
+        return response
+
+    def _report_response(self, req: ServiceRequest, then: float, response):
+        if req.host is None:
+            # the request failed before a host was picked
+            return
+
+        ok = response is not None and response.status_code < 500
+        self._balancer.on_response(req.service, req.host, time.monotonic() - then, ok)
+
+        if self.health is not None:
+            if ok:
+                self.health.on_success(req.host, then)
+            else:
+                self.health.on_failure(req.host)
+
+    def cache_info(self) -> Optional[CacheInfo]:
+        return self._balancer.cache_info()
 
     def _get_url(self, req: ServiceRequest) -> str:
-        host = self._balancer.next_host(req.service)
+        host = self._next_host(req)
+        req.host = host
+        self._balancer.on_request(req.service, host)
         return self._create_url(host, req)
 
+    def _next_host(self, req: ServiceRequest) -> str:
+        key = req.key
+
+        for _ in range(self.max_attempts if self.health is not None else 1):
+            if key is None:
+                host = self._balancer.next_host(req.service)
+            else:
+                host = self._balancer.next_host_for_key(req.service, key)
+
+            if self.health is None or self.health.acquire(host):
+                return host
+
+            # the host of the key is unavailable, so the request loses its affinity until the host has recovered
+            key = None
+
+        raise HostUnavailableError(f"No available host for service '{req.service}'")
+
     def _create_url(self, host, req: ServiceRequest):
         raise NotImplementedError
 
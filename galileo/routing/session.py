@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable
+from urllib.parse import urlsplit
+
+import requests
+
+from galileo.routing.timing import TimingHTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    """
+    Keeps one ``requests.Session`` per target host, each with its own pool of keep-alive connections. Using the pool
+    instead of ``requests.request`` (which creates a new session and TCP connection for every request) keeps TCP
+    handshakes out of the latency measurements and avoids exhausting ephemeral ports at high request rates.
+
+    :param size: the maximum number of connections kept open per host
+    :param keep_alive: if False, connections are closed after each request
+    :param idle_timeout: sessions that have not been used for the given number of seconds are closed and re-created
+        the next time they are used (which avoids re-using connections the server has already given up on)
+    :param block: if True, requests block when all connections of a host are in use, instead of opening additional
+        connections that are discarded afterwards
+    """
+
+    def __init__(self, size: int = 10, keep_alive: bool = True, idle_timeout: float = None, block: bool = False):
+        super().__init__()
+        self.size = size
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.block = block
+
+        self._sessions: Dict[str, requests.Session] = dict()
+        self._last_used: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        return self.session(url).request(method, url, **kwargs)
+
+    def session(self, url) -> requests.Session:
+        """
+        Returns the session for the host of the given URL.
+        """
+        key = self._host(url)
+
+        if self.idle_timeout is not None:
+            return self._session_with_idle_timeout(key)
+
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+
+        with self._lock:
+            if key in self._sessions:  # avoid race condition
+                return self._sessions[key]
+
+            session = self._create_session()
+            self._sessions[key] = session
+            return session
+
+    def _session_with_idle_timeout(self, key) -> requests.Session:
+        # the idle check, the swap and the timestamp update happen atomically, so a session is never replaced while
+        # another thread has just taken it
+        now = time.monotonic()
+        idle = None
+
+        with self._lock:
+            session = self._sessions.get(key)
+            last_used = self._last_used.get(key)
+            self._last_used[key] = now
+
+            if session is not None and last_used is not None and now - last_used > self.idle_timeout:
+                idle, session = session, None
+
+            if session is None:
+                session = self._create_session()
+                self._sessions[key] = session
+
+        if idle is not None:
+            # requests that still use the idle session complete normally, their connections are closed when released
+            logger.debug('closing idle session for %s', key)
+            idle.close()
+
+        return session
+
+    def warmup(self, urls: Iterable[str], connections: int = 1, timeout: float = 2):
+        """
+        Opens connections to the hosts of the given URLs by sending HEAD requests to ``/``, so that the first requests
+        of a workload do not pay for connection establishment. Errors are logged and otherwise ignored.
+
+        :param urls: URLs of the hosts to connect to
+        :param connections: the number of connections to open per host
+        :param timeout: request timeout
+        """
+        hosts = {self._host(url) for url in urls}
+        connections = min(connections, self.size)
+
+        for host in hosts:
+            logger.debug('warming up %d connections to %s', connections, host)
+            session = self.session(host)
+
+            # streamed responses keep their connection until they are consumed, which forces the pool to open a new
+            # connection for each request
+            responses = list()
+            try:
+                for _ in range(connections):
+                    responses.append(session.head(host + '/', timeout=timeout, stream=True))
+            except requests.RequestException as e:
+                logger.debug('error while warming up connection to %s: %s', host, e)
+            finally:
+                for response in responses:
+                    # consuming the (empty) body returns the connection to the pool, closing it would drop it
+                    _ = response.content
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._last_used.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+
+        adapter = TimingHTTPAdapter(pool_connections=1, pool_maxsize=self.size, pool_block=self.block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+
+        return session
+
+    @staticmethod
+    def _host(url) -> str:
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
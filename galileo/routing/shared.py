@@ -0,0 +1,143 @@
+"""
+Shares the routing table of a worker host with its client processes through shared memory, so that only one process
+per host has to listen to routing table updates.
+
+The worker daemon writes each RoutingSnapshot of its ReadOnlyListeningRedisRoutingTable into a SharedRoutingSegment,
+and the client processes read it with a SharedMemoryRoutingTable. The segment is protected by a sequence lock: the
+writer makes the version odd while it writes, and even again when it is done. Readers compare the version before and
+after reading, and retry if it changed or was odd, so they never block the writer. As long as the version is unchanged,
+readers keep using the records they already parsed.
+"""
+import json
+import multiprocessing
+import struct
+import time
+from typing import Iterable, List, Tuple
+
+from galileo.routing.table import RoutingTable, RoutingRecord, RoutingSnapshot
+
+
+class SharedRoutingSegment:
+    """
+    Shared memory that holds a serialized list of routing records. The layout is: version (8 bytes), length of the
+    payload (8 bytes), payload (JSON). There must only be one writer.
+
+    :param size: the size of the segment in bytes, which limits the size of the routing table
+    """
+    header = struct.Struct('QQ')
+
+    def __init__(self, size: int = 1 << 20) -> None:
+        super().__init__()
+        if size <= self.header.size:
+            raise ValueError('segment too small')
+
+        self.size = size
+        self._buffer = multiprocessing.RawArray('B', size)
+        self._view = memoryview(self._buffer).cast('B')
+
+    def __getstate__(self):
+        # the segment is passed to client processes, memoryviews cannot be pickled
+        return {'size': self.size, '_buffer': self._buffer}
+
+    def __setstate__(self, state):
+        self.size = state['size']
+        self._buffer = state['_buffer']
+        self._view = memoryview(self._buffer).cast('B')
+
+    def version(self) -> int:
+        return struct.unpack_from('Q', self._view, 0)[0]
+
+    def write(self, records: Iterable[RoutingRecord]) -> int:
+        """
+        Writes the records into the segment and returns the new version.
+
+        :raises ValueError: if the serialized records do not fit into the segment
+        """
+        payload = json.dumps([[r.service, r.hosts, r.weights] for r in records]).encode()
+        n = len(payload)
+        if n > self.size - self.header.size:
+            raise ValueError('routing table (%d bytes) does not fit into shared segment of %d bytes' % (n, self.size))
+
+        version = self.version()
+        offset = self.header.size
+
+        struct.pack_into('Q', self._view, 0, version + 1)
+        struct.pack_into('Q', self._view, 8, n)
+        self._view[offset:offset + n] = payload
+        struct.pack_into('Q', self._view, 0, version + 2)
+
+        return version + 2
+
+    def read(self) -> Tuple[int, List[RoutingRecord]]:
+        """
+        Returns the current version and the records of the segment.
+        """
+        offset = self.header.size
+
+        while True:
+            version, n = self.header.unpack_from(self._view, 0)
+            if version % 2 == 1:
+                # the writer is in the middle of an update
+                time.sleep(0)
+                continue
+
+            payload = bytes(self._view[offset:offset + n])
+
+            if self.version() == version:
+                break
+
+        if version == 0:
+            return version, []
+
+        return version, [RoutingRecord(service, hosts, weights) for service, hosts, weights in json.loads(payload)]
+
+
+class SharedMemoryRoutingTable(RoutingTable):
+    """
+    Read-only routing table of a client process that reads the records from a SharedRoutingSegment written by the
+    worker daemon. Each call only checks the version of the segment, and parses the records again only if the version
+    has changed. Records that did not change keep their object identity, so balancers that cache state per record do
+    not rebuild it.
+    """
+
+    def __init__(self, segment: SharedRoutingSegment) -> None:
+        super().__init__()
+        self.segment = segment
+        self._snapshot = RoutingSnapshot(-1, frozenset(), dict(), dict())
+
+    def _current(self) -> RoutingSnapshot:
+        snapshot = self._snapshot
+        if snapshot.version == self.segment.version():
+            return snapshot
+
+        version, records = self.segment.read()
+
+        updated = dict()
+        for record in records:
+            cached = snapshot.records.get(record.service)
+            updated[record.service] = cached if cached == record else record
+
+        snapshot = RoutingSnapshot(version, frozenset(updated), updated, dict())
+        self._snapshot = snapshot
+        return snapshot
+
+    def list_services(self):
+        return self._current().services
+
+    def get_routes(self):
+        return list(self._current().records.values())
+
+    def get_routing(self, service) -> RoutingRecord:
+        record = self._current().records.get(service)
+        if record is None:
+            raise ValueError(f"No routing record found for service '{service}'")
+        return record
+
+    def set_routing(self, record: RoutingRecord):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def remove_service(self, service):
+        raise NotImplementedError
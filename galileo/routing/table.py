@@ -1,7 +1,8 @@
 import abc
+import json
 import logging
 import threading
-from typing import NamedTuple, List
+from typing import NamedTuple, List, Dict, FrozenSet, Iterable, Optional, Callable, Tuple
 
 import redis
 
@@ -14,6 +15,15 @@ class RoutingRecord(NamedTuple):
     weights: List[float]
 
 
+class CacheInfo(NamedTuple):
+    """
+    Number of entries of a cache, its bound (None if unbounded), and the number of entries evicted so far.
+    """
+    entries: int
+    max_entries: Optional[int]
+    evictions: int
+
+
 class RoutingTable(abc.ABC):
     def get_routing(self, service) -> RoutingRecord:
         raise NotImplementedError
@@ -34,107 +44,273 @@ class RoutingTable(abc.ABC):
         return [self.get_routing(service) for service in self.list_services()]
 
 
+def encode_record(record: RoutingRecord, version: int) -> str:
+    return json.dumps({'service': record.service, 'hosts': record.hosts, 'weights': record.weights, 'version': version})
+
+
+def decode_record(data: str) -> Tuple[str, int, Optional[RoutingRecord]]:
+    """
+    Decodes a record stored by the RedisRoutingTable, or an update message. Returns a tuple (service, version, record),
+    where record is None if the message reports that the service was removed.
+    """
+    doc = json.loads(data)
+    service = doc['service']
+
+    if doc.get('hosts') is None:
+        return service, doc['version'], None
+
+    return service, doc['version'], RoutingRecord(service, doc['hosts'], [float(w) for w in doc['weights']])
+
+
 class RedisRoutingTable(RoutingTable):
+    """
+    Stores each routing record as one JSON document in ``routing:record:<service>``, together with the value of the
+    table-wide version counter ``routing:version`` at the time the record was written. Each change increments the
+    counter, and publishes the new record (or, if the service was removed, a document without hosts) with its version
+    on the record channel ``routing:records``, so subscribers can apply the change without reading from redis again,
+    and can discard messages that are older than what they already have.
+
+    For compatibility with readers of the previous format (e.g., symmetry), the table by default also writes the
+    ``routing:hosts:<service>`` and ``routing:weights:<service>`` lists, and publishes the bare service name on
+    ``routing:updates``. Records that only exist in the previous format are still read (with version 0), and can be
+    converted with ``migrate``.
+
+    :param rds: the redis connection
+    :param legacy: whether to also write the previous format
+    """
     update_channel = 'routing:updates'
-
-    def __init__(self, rds) -> None:
+    record_channel = 'routing:records'
+    services_key = 'routing:services'
+    version_key = 'routing:version'
+    record_key = 'routing:record:%s'
+    legacy_hosts_key = 'routing:hosts:%s'
+    legacy_weights_key = 'routing:weights:%s'
+
+    def __init__(self, rds, legacy: bool = True) -> None:
         super().__init__()
         self.rds = rds
+        self.legacy = legacy
 
     def list_services(self):
-        return self.rds.smembers('routing:services')
+        return self.rds.smembers(self.services_key)
 
     def get_routing(self, service) -> RoutingRecord:
+        records = self.get_routings([service])
+
+        if records:
+            return records[0]
+
+        raise ValueError(f"No routing record found for service '{service}'")
+
+    def get_routings(self, services: Iterable[str]) -> List[RoutingRecord]:
+        """
+        Reads the records of the given services in one round trip (two if there are records in the previous format).
+        Services without a record are skipped.
+        """
+        return [record for _, record in self.get_versioned_routings(services)]
+
+    def get_versioned_routings(self, services: Iterable[str]) -> List[Tuple[int, RoutingRecord]]:
+        """
+        Like ``get_routings``, but returns tuples (version, record). Records in the previous format have version 0.
+        """
+        services = list(services)
+        if not services:
+            return []
+
+        documents = self.rds.mget([self.record_key % service for service in services])
+
+        missing = [service for service, data in zip(services, documents) if not data]
+        legacy = self._get_legacy_routings(missing) if missing else dict()
+
+        result = list()
+        for service, data in zip(services, documents):
+            if data:
+                _, version, record = decode_record(data)
+                result.append((version, record))
+            elif service in legacy:
+                result.append((0, legacy[service]))
+        return result
+
+    def _get_legacy_routings(self, services: List[str]) -> Dict[str, RoutingRecord]:
         rds = self.rds.pipeline()
-        rds.lrange('routing:hosts:%s' % service, 0, -1)
-        rds.lrange('routing:weights:%s' % service, 0, -1)
+        for service in services:
+            rds.lrange(self.legacy_hosts_key % service, 0, -1)
+            rds.lrange(self.legacy_weights_key % service, 0, -1)
         result = rds.execute()
 
-        if result[0]:
-            return RoutingRecord(service, result[0], [float(i) for i in result[1]])
+        records = dict()
+        for i, service in enumerate(services):
+            hosts, weights = result[2 * i], result[2 * i + 1]
+            if hosts:
+                records[service] = RoutingRecord(service, hosts, [float(w) for w in weights])
+        return records
 
-        raise ValueError(f"No routing record found for service '{service}'")
+    def get_routes(self):
+        return self.get_routings(self.list_services())
+
+    def migrate(self) -> int:
+        """
+        Converts all records that only exist in the previous format into versioned documents, and returns the number of
+        converted records.
+        """
+        services = list(self.list_services())
+        documents = self.rds.mget([self.record_key % service for service in services]) if services else []
+        missing = [service for service, data in zip(services, documents) if not data]
+
+        records = self._get_legacy_routings(missing) if missing else dict()
+        for record in records.values():
+            self.set_routing(record)
+
+        logger.info('migrated %d routing records', len(records))
+        return len(records)
 
     def set_routing(self, record: RoutingRecord):
         if len(record.weights) != len(record.hosts):
             raise ValueError('The number of weights does not match the population')
+        if not record.hosts:
+            raise ValueError('A routing record needs at least one host')
 
-        rds = self.rds.pipeline()
-        rds.delete('routing:hosts:%s' % record.service)
-        rds.delete('routing:weights:%s' % record.service)
+        record = RoutingRecord(record.service, list(record.hosts), [float(w) for w in record.weights])
 
-        rds.sadd('routing:services', record.service)
-        rds.rpush('routing:hosts:%s' % record.service, *record.hosts)
-        rds.rpush('routing:weights:%s' % record.service, *record.weights)
-        rds.publish(self.update_channel, record.service)
+        def update(pipe: redis.client.Pipeline):
+            version = int(pipe.get(self.version_key) or 0) + 1
+            data = encode_record(record, version)
 
-        rds.execute()
+            pipe.multi()
+            pipe.set(self.version_key, version)
+            pipe.set(self.record_key % record.service, data)
+            pipe.sadd(self.services_key, record.service)
+
+            pipe.delete(self.legacy_hosts_key % record.service)
+            pipe.delete(self.legacy_weights_key % record.service)
+            if self.legacy:
+                pipe.rpush(self.legacy_hosts_key % record.service, *record.hosts)
+                pipe.rpush(self.legacy_weights_key % record.service, *record.weights)
+
+            pipe.publish(self.record_channel, data)
+            if self.legacy:
+                pipe.publish(self.update_channel, record.service)
+
+        self.rds.transaction(update, self.version_key)
 
     def remove_service(self, service):
         self.remove(service)
 
     def clear(self):
-        rds = self.rds.pipeline()
-        for service in self.list_services():
-            rds.delete('routing:hosts:%s' % service)
-            rds.delete('routing:weights:%s' % service)
-            rds.publish(self.update_channel, service)
-        rds.delete('routing:services')
-        rds.execute()
+        self._remove(lambda pipe: pipe.smembers(self.services_key))
 
     def remove(self, service):
-        rds = self.rds.pipeline()
-        rds.delete('routing:hosts:%s' % service)
-        rds.delete('routing:weights:%s' % service)
-        rds.srem('routing:services', service)
-        rds.publish(self.update_channel, service)
-        rds.execute()
+        self._remove(lambda pipe: [service])
+
+    def _remove(self, services: Callable):
+        def update(pipe: redis.client.Pipeline):
+            removed = list(services(pipe))
+            version = int(pipe.get(self.version_key) or 0) + 1
+
+            pipe.multi()
+            pipe.set(self.version_key, version)
+            for service in removed:
+                pipe.delete(self.record_key % service)
+                pipe.delete(self.legacy_hosts_key % service)
+                pipe.delete(self.legacy_weights_key % service)
+                pipe.srem(self.services_key, service)
+                pipe.publish(self.record_channel, json.dumps({'service': service, 'version': version}))
+                if self.legacy:
+                    pipe.publish(self.update_channel, service)
+
+        self.rds.transaction(update, self.version_key, self.services_key)
+
+
+class RoutingSnapshot(NamedTuple):
+    """
+    Immutable state of a ReadOnlyListeningRedisRoutingTable. The dicts are never modified after the snapshot was
+    created. ``version`` counts the snapshots, ``versions`` holds the RedisRoutingTable version of the last change of
+    each service (including removed services).
+    """
+    version: int
+    services: FrozenSet[str]
+    records: Dict[str, RoutingRecord]
+    versions: Dict[str, int]
 
 
 class ReadOnlyListeningRedisRoutingTable(RoutingTable):
+    """
+    Caches a RedisRoutingTable and keeps the cache up to date by listening to the record channel. ``start`` subscribes
+    to the channel and then loads all records at once, so updates that happen in between are not lost. Readers only
+    access an immutable RoutingSnapshot, which the listener thread replaces when a record changes, so they never take a
+    lock or wait for redis. Updates are applied from the records carried by the update messages, and messages that are
+    not newer than the snapshot's version of the service are discarded. Only services that are not in the snapshot
+    (e.g., because their update has not arrived yet) are read from redis directly. Listeners added with
+    ``add_listener`` are called with each new snapshot.
+
+    Records of removed services are dropped from the snapshot. Only their version is kept, to discard stale messages,
+    for at most ``max_removed`` services.
+    """
+    max_removed: int = 1024
 
     def __init__(self, rds) -> None:
         super().__init__()
         self.rds = rds
         self.rtable = RedisRoutingTable(rds)
-        self._cache = dict()
-        self._services = list()
+        self._snapshot = RoutingSnapshot(0, frozenset(), dict(), dict())
 
-        self._reload_lock = threading.Lock()
+        self._update_lock = threading.Lock()  # only taken by writers of the snapshot
+        self._listeners: List[Callable[[RoutingSnapshot], None]] = list()
+        self._evictions = 0
 
         self._pubsub = None
         self._thread = threading.Thread(target=self.listen)
 
+    def add_listener(self, listener: Callable[[RoutingSnapshot], None]):
+        self._listeners.append(listener)
+
     def start(self):
+        self._subscribe()
         self._thread.start()
 
     def stop(self, timeout=None):
         self.close()
-        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._thread.join(timeout)
 
-    def listen(self):
+    def _subscribe(self):
         self._pubsub = self.rds.pubsub()
+        self._pubsub.subscribe(self.rtable.record_channel)
+        self.reload()
 
-        try:
-            self._pubsub.subscribe(self.rtable.update_channel)
+    def reload(self):
+        """
+        Replaces the snapshot with all records currently stored in redis.
+        """
+        loaded = self.rtable.get_versioned_routings(self.rtable.list_services())
+        records = {record.service: record for _, record in loaded}
+        versions = {record.service: version for version, record in loaded}
 
-            with self._reload_lock:
-                self._services = self.rtable.list_services()
+        with self._update_lock:
+            self._swap(records, versions)
 
+        logger.debug('loaded %d routing records into cache', len(records))
+
+    def listen(self):
+        if self._pubsub is None:
+            self._subscribe()
+
+        try:
             for item in self._pubsub.listen():
                 if item['type'] == 'unsubscribe':
                     break
                 if item['type'] != 'message':
                     continue
 
-                service = item['data']
+                try:
+                    service, version, record = decode_record(item['data'])
+                except (ValueError, KeyError, TypeError):
+                    logger.warning('discarding malformed routing table update %s', item['data'])
+                    continue
 
-                logger.debug('received routing table update for %s', service)
+                logger.debug('received routing table update for %s (version %d)', service, version)
 
-                with self._reload_lock:
-                    if service in self._cache:
-                        del self._cache[service]
-                    self._services = self.rtable.list_services()
+                self._apply(service, version, record)
         except redis.ConnectionError:
             if logger.isEnabledFor(logging.DEBUG):
                 logger.exception('listener terminated due to connection error')
@@ -143,7 +319,60 @@ class ReadOnlyListeningRedisRoutingTable(RoutingTable):
         finally:
             self._pubsub.close()
 
+    def _apply(self, service, version: int, record: Optional[RoutingRecord]) -> Optional[RoutingRecord]:
+        """
+        Swaps in a new snapshot with the given version of the service's record (None if the service was removed), unless
+        the snapshot already has the same or a newer version. Returns the record of the service in the current snapshot.
+        """
+        with self._update_lock:
+            current = self._snapshot
+            if service in current.versions and version <= current.versions[service]:
+                return current.records.get(service)
+
+            records = dict(current.records)
+            versions = dict(current.versions)
+            versions[service] = version
+
+            cached = current.records.get(service)
+            if record is None:
+                if records.pop(service, None) is not None:
+                    self._evictions += 1
+                self._trim_removed(records, versions)
+            elif cached != record:
+                records[service] = record
+            # otherwise keep the cached object, so that balancers that cache state per record do not rebuild it
+
+            self._swap(records, versions)
+            return records.get(service)
+
+    def _trim_removed(self, records: Dict[str, RoutingRecord], versions: Dict[str, int]):
+        removed = [(version, service) for service, version in versions.items() if service not in records]
+        if len(removed) <= self.max_removed:
+            return
+
+        removed.sort()
+        for _, service in removed[:len(removed) - self.max_removed]:
+            del versions[service]
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(len(self._snapshot.records), None, self._evictions)
+
+    def _swap(self, records: Dict[str, RoutingRecord], versions: Dict[str, int]):
+        # called while holding the update lock, so listeners receive the snapshots in order
+        snapshot = RoutingSnapshot(self._snapshot.version + 1, frozenset(records), records, versions)
+        self._snapshot = snapshot
+        logger.debug('routing table snapshot %d: %s', snapshot.version, self.cache_info())
+
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                logger.exception('error while notifying routing table listener')
+
     def close(self):
+        if self._pubsub is None:
+            return
+
         try:
             self._pubsub.unsubscribe()
         except redis.ConnectionError:
@@ -151,19 +380,25 @@ class ReadOnlyListeningRedisRoutingTable(RoutingTable):
             pass
 
     def list_services(self):
-        return self._services
+        return self._snapshot.services
+
+    def get_routes(self):
+        return list(self._snapshot.records.values())
 
     def get_routing(self, service) -> RoutingRecord:
-        record = self._cache.get(service, None)
+        snapshot = self._snapshot
+        record = snapshot.records.get(service)
 
         if record is not None:
             return record
 
-        with self._reload_lock:
-            record = self.rtable.get_routing(service)
-            self._cache[service] = record
-            logger.debug('loaded routing record into cache %s', record)
-            return record
+        loaded = self.rtable.get_versioned_routings([service])
+        record = self._apply(service, *loaded[0]) if loaded else None
+        if record is None:
+            raise ValueError(f"No routing record found for service '{service}'")
+
+        logger.debug('loaded routing record into cache %s', record)
+        return record
 
     def set_routing(self, record: RoutingRecord):
         raise NotImplementedError
@@ -0,0 +1,128 @@
+"""
+Breaks down the time of a request into the phases of the underlying HTTP exchange:
+
+- ``connect``: establishing the TCP connection (0 if a pooled connection was re-used)
+- ``tls``: the TLS handshake (0 for plain HTTP or re-used connections)
+- ``ttfb``: time to first byte, i.e., from the connection being ready until the response headers arrived, which
+  includes sending the request and the service time
+- ``transfer``: reading the response body
+
+All values are in seconds. The synchronous routers measure connect and TLS through the connection classes of the
+``TimingHTTPAdapter``, which record into the RequestTiming of the request that is currently performed by the thread.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+
+class RequestTiming:
+    __slots__ = ('connect', 'tls', 'ttfb', 'transfer', '_mark')
+
+    def __init__(self) -> None:
+        self.connect = 0.
+        self.tls = 0.
+        self.ttfb = 0.
+        self.transfer = 0.
+        self._mark = None
+
+    def to_dict(self) -> dict:
+        return {
+            'connect': self.connect,
+            'tls': self.tls,
+            'ttfb': self.ttfb,
+            'transfer': self.transfer
+        }
+
+    def __repr__(self):
+        return 'RequestTiming(%s)' % ', '.join('%s=%.6f' % item for item in self.to_dict().items())
+
+
+_local = threading.local()
+
+
+def _current() -> Optional[RequestTiming]:
+    return getattr(_local, 'timing', None)
+
+
+@contextmanager
+def recording(timing: Optional[RequestTiming]):
+    """
+    Makes the connections of the TimingHTTPAdapter record into the given RequestTiming while the context is active in
+    the current thread.
+    """
+    previous = _current()
+    _local.timing = timing
+    try:
+        yield timing
+    finally:
+        _local.timing = previous
+
+
+class _ConnectTimer:
+
+    def _new_conn(self):
+        then = time.monotonic()
+        sock = super()._new_conn()
+
+        timing = _current()
+        if timing is not None:
+            timing.connect += time.monotonic() - then
+
+        return sock
+
+
+class TimedHTTPConnection(_ConnectTimer, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_ConnectTimer, HTTPSConnection):
+
+    def connect(self):
+        timing = _current()
+        connect_before = timing.connect if timing is not None else 0.
+        then = time.monotonic()
+
+        super().connect()
+
+        if timing is not None:
+            # connect covers the TCP connection (recorded by _new_conn) and the TLS handshake
+            timing.tls += (time.monotonic() - then) - (timing.connect - connect_before)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimingHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter whose connections record connect and TLS times (see ``recording``). Without an active recording, it
+    behaves like a regular HTTPAdapter.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+
+def request(method, url, **kwargs) -> requests.Response:
+    """
+    Like ``requests.request``, but uses a TimingHTTPAdapter.
+    """
+    with requests.Session() as session:
+        adapter = TimingHTTPAdapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session.request(method, url, **kwargs)
@@ -16,8 +16,11 @@ from telemc import TelemetryController
 from galileo.controller.cluster import ClusterController, RedisClusterController
 from galileo.routing import RoutingRecord, RoutingTable, RedisRoutingTable
 from galileo.shell.printer import sprint_routing_table, print_tabular, Stringer
-from galileo.worker.api import ClientConfig, ClientDescription, CloseClientCommand, ClientInfo, WorkloadDoneEvent
+from galileo.worker.api import ClientConfig, ClientDescription, CloseClientCommand, ClientInfo, WorkloadDoneEvent, \
+    ClientInfoList
 from galileo.worker.client import single_request
+from galileo.worker.profile import ProfileStore
+from galileo.worker.random import schedule as create_schedule
 
 prompt = 'galileo> '
 
@@ -81,16 +84,17 @@ class RequestFuture:
         self.client_ids = client_ids
         self.done = False
         self.aborted = False
+        self.start = None  # the start time of a synchronized workload, once the clients were told to start
         self.lock = Condition()
 
-    def run(self, n=None, ia=None):
+    def run(self, n=None, ia=None, seed=None, users=None, start=None, sync=False):
         clients_done = set(self.client_ids)
 
         # lots of problems with this unfortunately, may never terminate if clients disappear, concurrent events from
         # previous (aborted) calls will interfere with future calls, etc.
 
         def done_subscriber(event: WorkloadDoneEvent):
-            clients_done.remove(event.client_id)
+            clients_done.discard(event.client_id)
             if len(clients_done) == 0:
                 with self.lock:
                     self.done = True
@@ -99,8 +103,15 @@ class RequestFuture:
         try:
             with self.lock:
                 pymq.subscribe(done_subscriber)
-                for c in self.client_ids:
-                    self.ctrl.set_workload(c, ia, n)
+                if sync:
+                    self.start, armed = self.ctrl.sync_workload(list(self.client_ids), ia, n, seed, users)
+                    # clients that did not arm in time do not run the workload, so they never report that they are done
+                    self.client_ids = set(armed)
+                    clients_done.intersection_update(armed)
+                    self.done = len(clients_done) == 0
+                else:
+                    for c in self.client_ids:
+                        self.ctrl.set_workload(c, ia, n, seed, users, start)
 
                 self.lock.wait_for(self.stopped)
         finally:
@@ -149,7 +160,7 @@ class ClientGroup:
         else:
             self.request(ia=(1 / n))
 
-    def request(self, n=None, ia=None) -> RequestFuture:
+    def request(self, n=None, ia=None, seed=None, users=None, start=None, sync=False) -> RequestFuture:
         """
         Tell the clients in the group to start generating requests. You can specify a message rate, or a number of
         requests, or both.
@@ -176,6 +187,17 @@ class ClientGroup:
 
         Will send 100 messages but pause for 0.2 between each message.
 
+        With ``users``, each client runs a closed-loop workload with the given number of virtual users. Each user sends
+        a request, waits for the response, and then waits for a think time given by ``ia`` before it sends the next
+        request. ``n`` then limits the total number of requests per client::
+
+            c.request(users=10, ia=('expovariate', 2), n=1000)
+
+        With ``sync``, the clients first prepare the workload and report when they are ready, and then all of them start
+        at the same wall-clock time, instead of each client starting as soon as it receives the workload::
+
+            c.request(ia=0.1, sync=True)
+
         The method returns a RequestFuture on which you can call ``wait()`` if you want to block until the clients are
         done.
 
@@ -183,6 +205,11 @@ class ClientGroup:
 
         :param n: the maximum number of requests
         :param ia: the request interarrival
+        :param seed: optional seed to make the interarrivals reproducible
+        :param users: number of virtual users per client for a closed-loop workload
+        :param start: optional wall-clock time (unix timestamp) at which the clients start the workload
+        :param sync: start the workload on all clients at the same time, once all of them have prepared it (see
+                     ``ClusterController.sync_workload``)
         :return a RequestFuture object
         """
 
@@ -192,13 +219,35 @@ class ClientGroup:
             self.running_request.wait(1)
 
         future = RequestFuture(self.ctrl, {c.client_id for c in self.clients})
-        t = Thread(target=future.run, args=(n, ia))
+        t = Thread(target=future.run, args=(n, ia, seed, users, start, sync))
         t.start()
 
         self.running_request = future
 
         return future
 
+    def schedule(self, rates: List[float], interval: float, pattern='constant', start=None, seed=None) -> RequestFuture:
+        """
+        Push an entire load schedule to the clients, which then change their request rates locally at the tick
+        boundaries, without further messages from the controller. Each tick lasts ``interval`` seconds, and ``rates``
+        holds the request rate of each client during the tick. For example::
+
+            c.schedule([10, 20, 5], interval=60, start=time.time() + 2)
+
+        Makes every client send 10 requests per second for one minute, then 20, then 5, starting in two seconds. The
+        returned RequestFuture is done once all clients have finished the schedule.
+
+        :param rates: the requests per second of each client per tick
+        :param interval: the duration of a tick in seconds
+        :param pattern: the arrival pattern within a tick (constant|exponential)
+        :param start: wall-clock time (unix timestamp) at which the schedule starts (immediately if None)
+        :param seed: optional seed to make the arrivals reproducible
+        :return: a RequestFuture object
+        """
+        rates = list(rates)
+        create_schedule(interval, rates, pattern)  # fails here rather than in the clients if the schedule is invalid
+        return self.request(ia=('schedule', interval, rates, pattern), seed=seed, start=start)
+
     def pause(self):
         """
         Pause the current workload set by ``ClientGroup.request``.
@@ -207,7 +256,16 @@ class ClientGroup:
             self.ctrl.stop_workload(c.client_id)
 
     def info(self) -> List[ClientInfo]:
-        return pymq.stub('Client.get_info', timeout=2, multi=True)()
+        infos = list()
+
+        # client host processes return the infos of all their clients at once
+        for result in pymq.stub('Client.get_info', timeout=2, multi=True)():
+            if isinstance(result, ClientInfoList):
+                infos.extend(result.infos)
+            else:
+                infos.append(result)
+
+        return infos
 
     def add(self, n=1):
         """
@@ -366,7 +424,9 @@ class Galileo:
         return resp
 
     def spawn(self, service, num: int = 1, client: str = None, parameters: dict = None,
-              worker_labels: dict = None) -> ClientGroup:
+              worker_labels: dict = None, max_inflight: int = None, max_queued: int = None,
+              overload_policy: str = None, trace_level: str = None, trace_headers: List[str] = None,
+              trace_timing: bool = None) -> ClientGroup:
         """
         Spawn clients for the given service and distribute them across workers. If no client app is specified, a default
         http client will be created that creates http requests from the (optional) parameters::
@@ -389,9 +449,18 @@ class Galileo:
         :param client: the client app name (optional, if not given will use service name)
         :param parameters: parameters for the app (optional, e.g.: '{ "size": "small" }'
         :param worker_labels: labels that workers must match to be part of the group
+        :param max_inflight: the maximum number of concurrent requests per client (optional)
+        :param max_queued: the maximum number of requests per client waiting to be sent (optional)
+        :param overload_policy: what clients do with requests that exceed the backlog: block, drop, or shed (optional)
+        :param trace_level: how much of a response is recorded: timing, size, headers, or full (optional)
+        :param trace_headers: the headers recorded with trace level headers (optional)
+        :param trace_timing: record the connect/tls/ttfb/transfer breakdown of each request (optional)
         :return a new ClientGroup for the created clients
         """
-        cfg = ClientConfig(service, client=client, parameters=parameters, worker_labels=worker_labels)
+        cfg = ClientConfig(service, client=client, parameters=parameters, worker_labels=worker_labels,
+                           max_inflight=max_inflight, max_queued=max_queued, overload_policy=overload_policy,
+                           trace_level=trace_level, trace_headers=trace_headers,
+                           trace_timing=trace_timing)
         clients = self.ctrl.create_clients(cfg, num)
         return ClientGroup(self.ctrl, clients, cfg)
 
@@ -494,8 +563,36 @@ class Show:
                 'parameters': param_str,
                 'requests': info.requests,
                 'failed': info.failed,
+                'dropped': info.dropped,
+                'backlog': info.backlog,
+                'lost traces': info.traces_dropped,
             }
 
+            if info.scheduler:
+                record['lag (ms)'] = '%.1f / %.1f' % (info.scheduler.lag_mean * 1000, info.scheduler.lag_max * 1000)
+                record['late'] = info.scheduler.late
+            else:
+                record['lag (ms)'] = '-'
+                record['late'] = '-'
+
+            if info.users:
+                busy = sum(1 for user in info.users if user.busy)
+                requests = sum(user.requests for user in info.users)
+                rt_sum = sum(user.response_time_mean * user.requests for user in info.users)
+                record['users'] = '%d/%d' % (busy, len(info.users))
+                record['rt (ms)'] = '%.1f' % ((rt_sum / requests) * 1000 if requests else 0)
+            else:
+                record['users'] = '-'
+                record['rt (ms)'] = '-'
+
+            record['start lag (ms)'] = '-' if info.start_lag is None else '%.1f' % (info.start_lag * 1000)
+
+            if info.balancer_cache:
+                record['balancer cache'] = '%d (%d evicted)' % (info.balancer_cache.entries,
+                                                                info.balancer_cache.evictions)
+            else:
+                record['balancer cache'] = '-'
+
             for k, v in exclude.items():
                 if k in record and v is False:
                     del record[k]
@@ -624,6 +721,7 @@ def init(rds) -> Dict[str, object]:
     rtbl = RoutingTableHelper(RedisRoutingTable(rds))
     exp = Experiment(rds)
     telemd = Telemd(TelemetryController(rds))
+    profiles = ProfileStore(rds)
 
     return {
         'g': g,
@@ -632,6 +730,7 @@ def init(rds) -> Dict[str, object]:
         'exp': exp,
         'eventbus': eventbus,
         'telemd': telemd,
+        'profiles': profiles,
         'rds': rds
     }
 
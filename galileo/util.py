@@ -7,6 +7,32 @@ from typing import List
 from uuid import uuid4
 
 
+# offset between the wall clock and the monotonic clock, so timestamps from wall_time do not jump or go backwards when
+# the system clock is slewed (floats, as time.time_ns and time.monotonic_ns require Python 3.7)
+_wall_clock_anchor = time.time() - time.monotonic()
+
+# seconds by which wall_time may deviate from the wall clock before it is re-anchored
+wall_clock_max_drift = 0.1
+
+
+def wall_time() -> float:
+    """
+    Returns the current time in seconds since the epoch like ``time.time()``, but measured with the monotonic clock and
+    anchored to the wall clock. If the wall clock was stepped by more than ``wall_clock_max_drift`` seconds (e.g., by
+    NTP on a device without a real-time clock that started before the clock was synchronized), the anchor is moved, so
+    that times compared across hosts (like the start time of a synchronized workload) remain valid.
+    """
+    global _wall_clock_anchor
+
+    mono = time.monotonic()
+    now = time.time()
+
+    if abs(now - (_wall_clock_anchor + mono)) > wall_clock_max_drift:
+        _wall_clock_anchor = now - mono
+
+    return _wall_clock_anchor + mono
+
+
 def read_file(f, mode='rb'):
     """
     Convenience method for reading a file into a byte buffer.
@@ -51,6 +77,12 @@ def namedtuples_from_strings(cls, ls: List[str]):
     return tuples
 
 
+def to_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ['true', '1', 'yes']
+
+
 def subdict(data: dict, keys: list):
     return {k: data[k] for k in keys if k in data}
 
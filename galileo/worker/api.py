@@ -1,4 +1,6 @@
-from typing import NamedTuple
+from typing import NamedTuple, List
+
+from galileo.routing.table import CacheInfo
 
 
 class RegisterWorkerEvent(NamedTuple):
@@ -13,6 +15,13 @@ class RegisterWorkerCommand(NamedTuple):
     pass
 
 
+class ClockEstimate(NamedTuple):
+    offset: float  # seconds to add to the local time to get the reference time
+    drift: float  # seconds the offset changes per second
+    rtt: float  # round-trip time of the measurement the offset was derived from
+    timestamp: float  # local time of the measurement
+
+
 class StartTracingCommand(NamedTuple):
     pass
 
@@ -26,6 +35,12 @@ class ClientConfig(NamedTuple):
     client: str = None
     parameters: dict = None
     worker_labels: dict = None
+    max_inflight: int = None  # maximum number of concurrent requests
+    max_queued: int = None  # maximum number of requests waiting to be sent
+    overload_policy: str = None  # block|drop|shed
+    trace_level: str = None  # timing|size|headers|full
+    trace_headers: List[str] = None  # headers recorded with trace level 'headers' (all if None)
+    trace_timing: bool = None  # record the connect/tls/ttfb/transfer breakdown of requests
 
     def __repr__(self):
         return self.__str__()
@@ -50,10 +65,36 @@ class ClientDescription(NamedTuple):
     config: ClientConfig
 
 
+class SchedulerStats(NamedTuple):
+    dispatched: int = 0
+    late: int = 0
+    lag_mean: float = 0.
+    lag_max: float = 0.
+
+
+class UserStats(NamedTuple):
+    user: int
+    requests: int = 0
+    busy: bool = False  # whether the user is waiting for a response
+    response_time_mean: float = 0.
+    response_time_max: float = 0.
+
+
 class ClientInfo(NamedTuple):
     description: ClientDescription
     requests: int
     failed: int
+    scheduler: SchedulerStats = None
+    backlog: int = 0
+    dropped: int = 0
+    traces_dropped: int = 0
+    users: List[UserStats] = None  # the virtual users of a closed-loop workload
+    start_lag: float = None  # seconds by which the client missed the start time of a synchronized workload
+    balancer_cache: CacheInfo = None  # the balancer state the client's router keeps per service
+
+
+class ClientInfoList(NamedTuple):
+    infos: List[ClientInfo]  # the infos of all clients of a client host process
 
 
 class CloseClientCommand(NamedTuple):
@@ -85,6 +126,19 @@ class SetWorkloadCommand(NamedTuple):
     num: int = None
     distribution: str = 'constant'
     parameters: tuple = None
+    seed: int = None  # makes the interarrivals reproducible (each client derives its own seed from it)
+    users: int = None  # number of virtual users of a closed-loop workload, the distribution is then the think time
+    start: float = None  # wall-clock time at which the workload starts (immediately if None)
+    armed: bool = False  # the client prepares the workload, but waits for a StartWorkloadCommand to start it
+
+
+class WorkloadArmedEvent(NamedTuple):
+    client_id: str
+
+
+class StartWorkloadCommand(NamedTuple):
+    client_ids: List[str]
+    start: float  # wall-clock time at which the armed workloads start
 
 
 class StopWorkloadCommand(NamedTuple):
@@ -1,3 +1,5 @@
+import asyncio
+import itertools
 import json
 import logging
 import signal
@@ -5,7 +7,8 @@ import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Queue
-from queue import Full
+from typing import Dict, List, Optional
+
 import pymq
 import requests
 from galileodb.model import RequestTrace
@@ -13,23 +16,23 @@ from pymq.provider.redis import RedisEventBus
 
 from galileo import util
 from galileo.apps.app import AppClient, DefaultAppClient
-from galileo.routing import ServiceRequest
+from galileo.routing import ServiceRequest, Router, RequestTiming
 from galileo.worker.api import ClientDescription, ClientConfig, ClientInfo, SetWorkloadCommand, StopWorkloadCommand, \
-    WorkloadDoneEvent
+    WorkloadDoneEvent, SchedulerStats, CloseClientCommand, ClientInfoList, UserStats, WorkloadArmedEvent, \
+    StartWorkloadCommand
 from galileo.worker.context import Context
 from galileo.worker.random import create_sampler
+from galileo.worker.trace import STATUS_ERROR, STATUS_DROPPED, TIMING_HEADER, TraceBuffer
 
 logger = logging.getLogger(__name__)
 
 
 def constant(mean):
-    while True:
-        yield mean
+    return itertools.repeat(mean)
 
 
 def limiter(limit, gen):
-    for _ in range(limit):
-        yield next(gen)
+    return itertools.islice(gen, limit)
 
 
 def create_interarrival_generator(cmd: SetWorkloadCommand, ctx: Context):
@@ -40,7 +43,7 @@ def create_interarrival_generator(cmd: SetWorkloadCommand, ctx: Context):
             gen = constant(0)
     else:
         logger.debug(f'generating sampler {cmd.distribution} with client_id {cmd.client_id}')
-        gen = create_sampler(cmd.distribution, cmd.parameters, ctx, client_id=cmd.client_id)
+        gen = create_sampler(cmd.distribution, cmd.parameters, ctx, client_id=cmd.client_id, seed=cmd.seed)
 
     if cmd.num:
         return limiter(cmd.num, gen)
@@ -49,8 +52,24 @@ def create_interarrival_generator(cmd: SetWorkloadCommand, ctx: Context):
 
 
 class RequestGenerator:
+    """
+    Generates requests according to the interarrival generator of the current workload. Requests are scheduled
+    open-loop: each request is due at an absolute deadline (the start of the workload plus the sum of all previous
+    interarrivals), so neither sleep overshoot nor the time it takes to dispatch a request make the generator drift. If
+    the generator falls behind, it emits all requests that are due without sleeping. How late requests are emitted is
+    tracked and can be retrieved with ``get_stats``.
+
+    If the workload has a start time, the first deadline is anchored at that (wall-clock) time instead of at the moment
+    the first interarrival is drawn. How late the first request of such a workload was dispatched is kept in
+    ``start_lag``.
+
+    The wall-clock time at which a request was due is attached to the request as ``ServiceRequest.scheduled``, so that
+    delays caused by the generator or the client (coordinated omission) remain visible in the traces.
+    """
     DONE = object()
 
+    late_threshold = 0.001  # seconds after which a request is counted as late
+
     def __init__(self, factory, ctx=None) -> None:
         super().__init__()
         self.factory = factory
@@ -60,6 +79,13 @@ class RequestGenerator:
 
         self._gen = None
         self._gen_lock = threading.Condition()
+        self._generation = 0  # incremented whenever the workload changes, guarded by _gen_lock
+
+        self._deadline = None
+        self._start = None  # wall-clock time at which the current workload starts
+        self.start_lag = None  # how late the first request of a workload with a start time was dispatched
+        self._epoch = None  # (wall-clock time, monotonic time) at the start of the current workload
+        self._reset_stats()
 
     def close(self):
         with self._gen_lock:
@@ -67,57 +93,283 @@ class RequestGenerator:
             self._closed = True
             self._gen_lock.notify_all()
 
-    def set_workload(self, cmd: SetWorkloadCommand):
-        with self._gen_lock:
+    def set_workload(self, cmd: SetWorkloadCommand, gen=None):
+        """
+        Sets the workload. The interarrival generator is created from the command, unless it was already created
+        beforehand (see ``create_interarrival_generator``) and is passed as ``gen``.
+        """
+        if gen is None:
             gen = create_interarrival_generator(cmd, self.ctx)
+
+        with self._gen_lock:
             self._gen = gen
+            self._generation += 1
+            self._deadline = None
+            self._start = cmd.start
+            self.start_lag = None
+            self._reset_stats()
             self._gen_lock.notify_all()
 
     def pause(self):
         with self._gen_lock:
             self._gen = None
+            self._generation += 1
+            self._gen_lock.notify_all()
+
+    def get_stats(self) -> SchedulerStats:
+        n = self._dispatched
+        return SchedulerStats(
+            dispatched=n,
+            late=self._late,
+            lag_mean=(self._lag_sum / n) if n else 0.,
+            lag_max=self._lag_max
+        )
+
+    def _reset_stats(self):
+        self._dispatched = 0
+        self._late = 0
+        self._lag_sum = 0.
+        self._lag_max = 0.
 
     def _next_interarrival(self):
+        """
+        Returns a tuple (interarrival, generation), where generation identifies the workload the interarrival was drawn
+        for.
+        """
+        # if the workload changes in between, the interarrival is attributed to the old workload and dropped, rather
+        # than the other way around
+        generation = self._generation
         gen = self._gen
-        if gen is not None:
-            return next(gen)
 
+        if gen is None:
+            with self._gen_lock:
+                if self._gen is None:  # set_rps may already have been called and notified has_gen
+                    logger.debug('generator paused %s', self)
+                    # pause also notifies waiters, so wait until there is a generator again
+                    while not self._closed and self._gen is None:
+                        self._gen_lock.wait()
+                    if self._closed:
+                        raise InterruptedError
+
+                logger.debug('generator resumed %s', self)
+                generation = self._generation
+                gen = self._gen
+
+        try:
+            return next(gen), generation
+        except StopIteration:
+            with self._gen_lock:
+                # the workload is done, unless it was replaced in the meantime
+                if generation == self._generation:
+                    self._gen = None
+            raise
+
+    def _wait_until_due(self, a, generation):
+        """
+        Advances the deadline by the given interarrival and waits until the deadline is reached. Returns a tuple
+        (deadline, epoch) of the request, or None if the workload changed (see ``set_workload``) before the request was
+        due, in which case the request belongs to the old workload and must be dropped. The scheduler state is only
+        accessed while holding the lock, and only if the workload is still the one of the given generation.
+        """
         with self._gen_lock:
-            if self._gen is None:  # set_rps may already have been called and notified has_gen
-                logger.debug('generator paused %s', self)
-                self._gen_lock.wait()
-                if self._closed or not self._gen:
-                    raise InterruptedError
+            if generation != self._generation:
+                return None
+
+            deadline = self._deadline
+            epoch = self._epoch
+            if deadline is None:
+                # first request of the workload
+                epoch = (util.wall_time(), time.monotonic())
+                self._epoch = epoch
+                deadline = epoch[1]
+                if self._start is not None:
+                    # anchor the workload at its start time, so clients that received the workload at different times
+                    # still send their requests in lockstep
+                    deadline += self._start - epoch[0]
+
+            deadline += a
+            self._deadline = deadline
+
+            # set_workload, pause and close notify the condition, so a changed workload does not wait for the old
+            # deadline
+            while not self._closed and generation == self._generation:
+                delay = deadline - time.monotonic()
+                if delay <= 0:
+                    break
+                self._gen_lock.wait(delay)
 
-            logger.debug('generator resumed %s', self)
+            if self._closed:
+                raise InterruptedError
+            if generation != self._generation:
+                return None
 
-            return next(self._gen)
+            self._record_lag(time.monotonic() - deadline)
+
+        return deadline, epoch
+
+    @staticmethod
+    def _scheduled_time(deadline, epoch):
+        """
+        Returns the given deadline as wall-clock time.
+        """
+        wall, mono = epoch
+        return wall + (deadline - mono)
+
+    def _record_lag(self, lag):
+        if self._dispatched == 0 and self._start is not None:
+            self.start_lag = lag
+
+        self._dispatched += 1
+        self._lag_sum += lag
+        if lag > self._lag_max:
+            self._lag_max = lag
+        if lag > self.late_threshold:
+            self._late += 1
 
     def run(self):
         logger.debug('running request generator %s', self)
 
         factory = self.factory
         last_log_time = time.time()
+        last_log_dispatched = 0
 
         while not self._closed:
             try:
-                a = self._next_interarrival()  # may block until a generator is available
-                if a > 0:
-                    time.sleep(a)
-                else:
+                a, generation = self._next_interarrival()  # may block until a generator is available
+                if a < 0:
                     raise ValueError(f'ia time was {a}, which is invalid and leads to massive crashes!')
-                if time.time() - last_log_time >= 5 and a != 0:
-                    logger.debug(f'Last ia time indicated target request rate of {str(1/a)}rps')
-                    last_log_time = time.time()
+
+                due = self._wait_until_due(a, generation)
+                if due is None:
+                    logger.debug('workload changed, dropping request of the previous workload %s', self)
+                    continue
+                deadline, epoch = due
+
+                if logger.isEnabledFor(logging.DEBUG) and time.time() - last_log_time >= 5:
+                    now = time.time()
+                    stats = self.get_stats()
+                    rate = (stats.dispatched - last_log_dispatched) / (now - last_log_time)
+                    logger.debug('dispatched %.2f rps, mean lag %.4fs, max lag %.4fs, %d late', rate, stats.lag_mean,
+                                 stats.lag_max, stats.late)
+                    last_log_time = now
+                    last_log_dispatched = stats.dispatched
             except StopIteration:
-                with self._gen_lock:
-                    self._gen = None
                 yield RequestGenerator.DONE
                 continue
             except InterruptedError:
                 break
 
-            yield factory()
+            request = factory()
+            if isinstance(request, ServiceRequest):
+                request.scheduled = self._scheduled_time(deadline, epoch)
+
+            yield request
+
+
+class VirtualUsers:
+    """
+    A closed-loop workload: each of ``cmd.users`` virtual users sends a request, waits for the response, and then waits
+    for a think time sampled from the distribution of the workload before it sends the next request. Each user runs in
+    its own thread. If ``cmd.num`` is set, the users stop after sending that many requests in total, and the workload is
+    done once all users have stopped. If a start time is given, the users wait until that (wall-clock) time before they
+    send their first request.
+    """
+
+    def __init__(self, client: 'Client', cmd: SetWorkloadCommand) -> None:
+        super().__init__()
+        self.client = client
+        self.n = cmd.users
+        self.limit = cmd.num
+
+        self._think_times = create_interarrival_generator(cmd._replace(num=None), client.ctx)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sent = 0
+        self._running = 0
+        self._threads = list()
+        self._start = cmd.start
+        self.start_lag = None
+
+        # per-user statistics: [requests, busy, response time sum, response time max]
+        self._stats = [[0, False, 0., 0.] for _ in range(self.n)]
+
+    def start(self, at: float = None):
+        if at is not None:
+            self._start = at
+
+        with self._lock:
+            self._running = self.n
+
+        for user in range(self.n):
+            thread = threading.Thread(target=self._run_user, args=(user,), daemon=True,
+                                      name='user-%s-%d' % (self.client.client_id, user))
+            self._threads.append(thread)
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def get_stats(self) -> List[UserStats]:
+        result = list()
+
+        for user, (n, busy, rt_sum, rt_max) in enumerate(self._stats):
+            result.append(UserStats(user, n, busy, (rt_sum / n) if n else 0., rt_max))
+
+        return result
+
+    def _claim(self) -> bool:
+        if self.limit is None:
+            return True
+
+        with self._lock:
+            if self._sent >= self.limit:
+                return False
+            self._sent += 1
+            return True
+
+    def _next_think_time(self):
+        with self._lock:
+            return next(self._think_times, None)
+
+    def _run_user(self, user: int):
+        factory = self.client.request_generator.factory
+        stats = self._stats[user]
+
+        try:
+            if self._start is not None:
+                if self._stopped.wait(max(0., self._start - util.wall_time())):
+                    return
+                with self._lock:
+                    if self.start_lag is None:
+                        self.start_lag = util.wall_time() - self._start
+
+            while not self._stopped.is_set() and self._claim():
+                request = factory()
+                request.scheduled = util.wall_time()
+
+                stats[1] = True
+                t = self.client.perform_user_request(request)
+                stats[1] = False
+
+                response_time = t.done - (t.sent if t.sent > 0 else t.created)
+                stats[0] += 1
+                stats[2] += response_time
+                stats[3] = max(stats[3], response_time)
+
+                think_time = self._next_think_time()
+                if think_time is None:
+                    break
+                if think_time > 0 and self._stopped.wait(think_time):
+                    break
+        except Exception:
+            logger.exception('error in virtual user %d of client %s', user, self.client.client_id)
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+
+            if last and not self._stopped.is_set():
+                self.client._workload_done()
 
 
 class AppClientRequestFactory:
@@ -130,6 +382,7 @@ class AppClientRequestFactory:
     def create_request(self) -> ServiceRequest:
         req = self.client.next_request()
         service_request = ServiceRequest(self.service, req.endpoint, req.method, **req.kwargs)
+        service_request.key = req.key
 
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug('client %s created request %s', self.client.name, service_request.__dict__)
@@ -141,18 +394,82 @@ class AppClientRequestFactory:
 
 
 class Client:
-
-    def __init__(self, ctx: Context, trace_queue: Queue, description: ClientDescription, eventbus=None) -> None:
+    """
+    Performs the requests generated by the RequestGenerator and records their traces. At most ``max_inflight`` requests
+    are performed concurrently, and at most ``max_queued`` further requests wait for being performed. When both are
+    exhausted, the overload policy determines what happens with new requests:
+
+    - ``block``: the request generator is blocked until a request completes (the delay is reflected in the trace)
+    - ``drop``: the request is not sent, but a trace with status ``STATUS_DROPPED`` is recorded
+    - ``shed``: the request is discarded without recording a trace
+
+    The values are taken from the ClientConfig, or from the context (galileo_client_max_inflight,
+    galileo_client_max_queued, galileo_client_overload_policy) if they are not set.
+
+    The trace level determines how much of a response is recorded in its trace:
+
+    - ``timing``: only status and timestamps
+    - ``size``: additionally the number of bytes of the response body (as Content-Length in the headers field)
+    - ``headers``: additionally the response headers (only those listed in ``trace_headers``, if given)
+    - ``full``: all headers and the decoded response body
+
+    For all levels but ``full``, the response body is streamed and discarded without being decoded. With
+    ``trace_timing``, the router additionally measures the connect, TLS, time-to-first-byte and transfer phases of each
+    request, which are stored as ``Galileo-Timing`` in the headers of the trace (see ``timing_breakdown``).
+
+    An armed workload (``SetWorkloadCommand.armed``) is prepared when the command arrives, but only started at the time
+    given by the subsequent StartWorkloadCommand. The client reports a WorkloadArmedEvent once it is ready, and records
+    by how much it missed the start time in ``ClientInfo.start_lag``.
+
+    A hosted client (see ClientHost) uses the router it is given, and neither subscribes to workload commands nor
+    exposes ``get_info`` itself, as the ClientHost does this on behalf of all its clients.
+    """
+    overload_policies = ('block', 'drop', 'shed')
+    trace_levels = ('timing', 'size', 'headers', 'full')
+    default_max_inflight = 50
+
+    def __init__(self, ctx: Context, trace_queue: Queue, description: ClientDescription, eventbus=None,
+                 router: Router = None, hosted=False) -> None:
         super().__init__()
         self.ctx = ctx
+        self.hosted = hosted
         self.description = description
         self.client_id = description.client_id
         self.cfg = description.config
         self.traces = trace_queue
         self.eventbus = eventbus or pymq
+        self.trace_buffer = TraceBuffer(
+            trace_queue,
+            size=self._get_setting('trace_batch_size', 100),
+            max_age=self._get_setting('trace_batch_age', 1, float)
+        )
+
+        self.max_inflight = self._get_setting('max_inflight', self.default_max_inflight)
+        self.max_queued = self._get_setting('max_queued', None)
+        self.overload_policy = self._get_setting('overload_policy', 'block', str)
+        if self.overload_policy not in self.overload_policies:
+            raise ValueError('Unknown overload policy %s' % self.overload_policy)
+
+        self.trace_level = self._get_setting('trace_level', 'full', str)
+        if self.trace_level not in self.trace_levels:
+            raise ValueError('Unknown trace level %s' % self.trace_level)
+        self.trace_timing = self._get_setting('trace_timing', False, util.to_bool)
+        self.trace_headers = self._get_setting('trace_headers', None, lambda value: value.split(','))
+        if self.trace_headers is not None:
+            self.trace_headers = {header.strip().lower() for header in self.trace_headers}
+
+        # bounds the number of requests that were dispatched but are not done yet
+        if self.max_inflight is not None and self.max_queued is not None:
+            self._backlog_semaphore = threading.BoundedSemaphore(self.max_inflight + self.max_queued)
+        else:
+            self._backlog_semaphore = None
+        self._backlog = 0
+        self._backlog_lock = threading.Lock()
 
-        self.router = ctx.create_router()
+        self.router = router or self._create_router()
         self.request_generator = RequestGenerator(self._create_request_factory(), self.ctx)
+        self.users: Optional[VirtualUsers] = None  # set while a closed-loop workload is running
+        self._armed = None  # (command, generator or virtual users) of a workload waiting to be started
 
         # used for generating request ids
         self.client_uuid = util.uuid()[-10:]
@@ -160,72 +477,226 @@ class Client:
 
         # used for statistics
         self.failed_counter = 0
+        self.dropped_counter = 0
 
         # expose methods
-        self.eventbus.subscribe(self._on_set_workload_command)
-        self.eventbus.subscribe(self._on_stop_workload_command)
-        self.eventbus.expose(self.get_info, 'Client.get_info')
-        self.request_executor = ThreadPoolExecutor(max_workers=50)
+        if not hosted:
+            self.eventbus.subscribe(self._on_set_workload_command)
+            self.eventbus.subscribe(self._on_start_workload_command)
+            self.eventbus.subscribe(self._on_stop_workload_command)
+            self.eventbus.expose(self.get_info, 'Client.get_info')
+        self.request_executor = ThreadPoolExecutor(max_workers=self.max_inflight or self.default_max_inflight)
+
+    def _get_setting(self, name, default, type_fn=int):
+        value = getattr(self.cfg, name, None)
+        if value is not None:
+            return value
+
+        value = self.ctx.getenv('galileo_client_%s' % name)
+        if value is not None:
+            return type_fn(value)
+
+        return default
+
+    def _create_router(self):
+        return self.ctx.create_router()
 
     def _create_request_id(self, _: ServiceRequest) -> str:
         self.request_counter += 1
         return self.client_uuid + ":" + str(self.request_counter)
 
     def get_info(self) -> ClientInfo:
-        return ClientInfo(self.description, self.request_counter, self.failed_counter)
+        users = self.users.get_stats() if self.users else None
+        start_lag = self.users.start_lag if self.users else self.request_generator.start_lag
+
+        return ClientInfo(self.description, self.request_counter, self.failed_counter,
+                          self.request_generator.get_stats(), self._backlog, self.dropped_counter,
+                          self.trace_buffer.dropped, users, start_lag, self.router.cache_info())
 
     def perform_request(self, request):
-        client_id = self.client_id
-        traces = self.traces
-        router = self.router
         if request is RequestGenerator.DONE:
-            self.eventbus.publish(WorkloadDoneEvent(self.client_id))
+            self._workload_done()
             return
 
-        logger.debug('client %s processing request %s', client_id, request)
-        request.client_id = client_id
-        request.request_id = self._create_request_id(request)
+        try:
+            self._execute(request)
+        finally:
+            self._release()
+
+    def perform_user_request(self, request) -> RequestTrace:
+        """
+        Performs a request of a virtual user (see VirtualUsers) in the calling thread, and returns its trace.
+        """
+        return self._execute(request)
+
+    def _execute(self, request: ServiceRequest) -> RequestTrace:
+        self._prepare_request(request)
 
         try:
             request.sent = -1  # will be updated by router
-            response: requests.Response = router.request(request)
-            host = response.url.split("//")[-1].split("/")[0].split('?')[0]
-
-            t = RequestTrace(
-                request_id=request.request_id,
-                client=client_id,
-                service=request.service,
-                created=request.created,
-                sent=request.sent,
-                done=time.time(),
-                status=response.status_code,
-                server=host,
-                response=response.text.strip(),
-                headers=json.dumps(dict(response.headers))
-            )
+            response: requests.Response = self.router.request(request)
+            t = self._create_trace(request, response)
         except Exception as e:
-            if logger.isEnabledFor(logging.DEBUG):
-                logger.exception('error while handling request %s', request)
+            t = self._create_error_trace(request, e)
+
+        self._record_trace(t)
+        return t
+
+    def _workload_done(self):
+        self.trace_buffer.flush()
+        self.eventbus.publish(WorkloadDoneEvent(self.client_id))
+
+    def _prepare_request(self, request: ServiceRequest):
+        logger.debug('client %s processing request %s', self.client_id, request)
+        request.client_id = self.client_id
+        request.request_id = self._create_request_id(request)
+
+        if self.trace_level != 'full':
+            # the body is discarded in _create_trace, so there is no need to read it into memory
+            request.kwargs.setdefault('stream', True)
+
+        if self.trace_timing:
+            request.timing = RequestTiming()
+
+    def _create_trace(self, request: ServiceRequest, response: requests.Response) -> RequestTrace:
+        host = response.url.split("//")[-1].split("/")[0].split('?')[0]
+        level = self.trace_level
+
+        if level == 'full':
+            done = util.wall_time()
+            headers = dict(response.headers)
+            text = response.text.strip()
+        else:
+            size = self._discard_body(response)
+            done = util.wall_time()
+            text = None
+
+            if level == 'timing':
+                headers = None
+            elif level == 'size':
+                headers = {'Content-Length': str(size)}
             else:
-                logger.error('error while handling request %s: %s', request, e)
-
-            t = RequestTrace(
-                request_id=request.request_id,
-                client=client_id,
-                service=request.service,
-                created=request.created,
-                sent=request.sent,
-                done=time.time(),
-                status=-1
-            )
-
-        if t.status < 0 or t.status >= 300:
+                headers = self._filter_headers(response.headers)
+
+        timing = request.timing
+        if timing is not None:
+            timing.transfer = max(0., done - request.sent - timing.connect - timing.tls - timing.ttfb)
+            headers = headers or dict()
+            headers[TIMING_HEADER] = timing.to_dict()
+
+        return RequestTrace(
+            request_id=request.request_id,
+            client=self.client_id,
+            service=request.service,
+            created=request.scheduled or request.created,
+            sent=request.sent,
+            done=done,
+            status=response.status_code,
+            server=host,
+            response=text,
+            headers=json.dumps(headers) if headers is not None else None
+        )
+
+    def _filter_headers(self, headers) -> dict:
+        if self.trace_headers is None:
+            return dict(headers)
+
+        return {k: v for k, v in headers.items() if k.lower() in self.trace_headers}
+
+    @staticmethod
+    def _discard_body(response: requests.Response) -> int:
+        """
+        Reads the remaining body of the response without decoding it, and returns its size in bytes.
+        """
+        size = getattr(response, 'body_size', None)  # set by routers that already discarded the body
+        if size is not None:
+            return size
+
+        if response.raw is None or response._content_consumed:
+            return len(response.content or b'')
+
+        size = 0
+        for chunk in response.raw.stream(65536, decode_content=False):
+            size += len(chunk)
+        return size
+
+    def _create_error_trace(self, request: ServiceRequest, e: Exception) -> RequestTrace:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.exception('error while handling request %s', request)
+        else:
+            logger.error('error while handling request %s: %s', request, e)
+
+        return RequestTrace(
+            request_id=request.request_id,
+            client=self.client_id,
+            service=request.service,
+            created=request.scheduled or request.created,
+            sent=request.sent,
+            done=util.wall_time(),
+            status=STATUS_ERROR
+        )
+
+    def _create_dropped_trace(self, request: ServiceRequest) -> RequestTrace:
+        return RequestTrace(
+            request_id=request.request_id,
+            client=self.client_id,
+            service=request.service,
+            created=request.scheduled or request.created,
+            sent=-1,
+            done=util.wall_time(),
+            status=STATUS_DROPPED
+        )
+
+    def _record_trace(self, t: RequestTrace):
+        if t.status == STATUS_DROPPED:
+            self.dropped_counter += 1
+        elif t.status < 0 or t.status >= 300:
             self.failed_counter += 1
 
-        try:
-            traces.put_nowait(t)
-        except Full:
-            pass
+        self.trace_buffer.put(t)
+
+    def _acquire(self, request) -> bool:
+        """
+        Reserves a place in the backlog for the given request, and applies the overload policy if the backlog is full.
+        Returns False if the request must not be dispatched.
+        """
+        if request is RequestGenerator.DONE:
+            return True
+
+        semaphore = self._backlog_semaphore
+        if semaphore is not None:
+            if self.overload_policy == 'block':
+                semaphore.acquire()
+            elif not semaphore.acquire(blocking=False):
+                self._reject(request)
+                return False
+
+        with self._backlog_lock:
+            self._backlog += 1
+
+        return True
+
+    def _release(self):
+        with self._backlog_lock:
+            self._backlog -= 1
+
+        if self._backlog_semaphore is not None:
+            self._backlog_semaphore.release()
+
+    def _reject(self, request: ServiceRequest):
+        logger.debug('client %s overloaded, rejecting request %s', self.client_id, request)
+
+        if self.overload_policy == 'drop':
+            self._prepare_request(request)
+            self._record_trace(self._create_dropped_trace(request))
+        else:
+            self.dropped_counter += 1
+
+    def _dispatch(self, request):
+        self.request_executor.submit(self.perform_request, request)
+
+    def _shutdown(self):
+        self.request_executor.shutdown(wait=False)
 
     def run(self):
         client_id = self.client_id
@@ -238,7 +709,9 @@ class Client:
                 logger.debug("client %s waiting for next request", client_id)
                 try:
                     request = next(rgen)
-                    self.request_executor.submit(self.perform_request, request)
+                    if not self._acquire(request):
+                        continue
+                    self._dispatch(request)
                     dispatches_since_last_log_update += 1
                     if time.time() - last_log_update >= 1:
                         logger.debug(f'queued {dispatches_since_last_log_update} requests last second')
@@ -252,25 +725,86 @@ class Client:
         except:
             logger.exception("error during read loop in client %s", client_id)
         finally:
-            self.request_executor.shutdown(wait=False)
+            self._shutdown()
 
     def close(self):
         self.request_generator.close()
-        self.eventbus.unsubscribe(self._on_set_workload_command)
-        self.eventbus.unsubscribe(self._on_stop_workload_command)
-        self.eventbus.unexpose('Client.get_info')
+        self._stop_users()
+        self.trace_buffer.close()
+
+        if not self.hosted:
+            self.eventbus.unsubscribe(self._on_set_workload_command)
+            self.eventbus.unsubscribe(self._on_start_workload_command)
+            self.eventbus.unsubscribe(self._on_stop_workload_command)
+            self.eventbus.unexpose('Client.get_info')
 
     def _on_set_workload_command(self, cmd: SetWorkloadCommand):
         if cmd.client_id != self.client_id:
             return
 
-        self.request_generator.set_workload(cmd)
+        if cmd.armed:
+            self._arm(cmd)
+            return
+
+        self._stop_users()
+
+        if cmd.users:
+            self.request_generator.pause()
+            self.users = VirtualUsers(self, cmd)
+            self.users.start()
+        else:
+            self.request_generator.set_workload(cmd)
+
+    def _arm(self, cmd: SetWorkloadCommand):
+        """
+        Prepares the workload, so that it can be started without delay once the StartWorkloadCommand arrives, and
+        reports that the client is ready.
+        """
+        if cmd.users:
+            prepared = VirtualUsers(self, cmd)
+        else:
+            prepared = create_interarrival_generator(cmd, self.ctx)
+
+        self._armed = (cmd, prepared)
+        self.eventbus.publish(WorkloadArmedEvent(self.client_id))
+
+    def _on_start_workload_command(self, cmd: StartWorkloadCommand):
+        if self.client_id not in cmd.client_ids:
+            return
+
+        armed = self._armed
+        self._armed = None
+        if armed is None:
+            logger.warning('%s received start command but has no armed workload', self)
+            return
+
+        workload, prepared = armed
+        workload = workload._replace(start=cmd.start, armed=False)
+
+        self._stop_users()
+
+        if workload.users:
+            self.request_generator.pause()
+            self.users = prepared
+            self.users.start(cmd.start)
+        else:
+            self.request_generator.set_workload(workload, prepared)
 
     def _on_stop_workload_command(self, cmd: StopWorkloadCommand):
         if cmd.client_id != self.client_id:
             return
 
+        self._armed = None
         self.request_generator.pause()
+        self._stop_users()
+        self.trace_buffer.flush()
+
+    def _stop_users(self):
+        # get_info reports the stats and start lag of the users as long as they are set
+        users = self.users
+        self.users = None
+        if users is not None:
+            users.stop()
 
     def _create_request_factory(self):
         if self.cfg.client:
@@ -285,6 +819,210 @@ class Client:
         return 'Client{client_id=%s}' % self.client_id
 
 
+class AsyncClient(Client):
+    """
+    A Client that performs requests on an asyncio event loop using an AsyncRouter, instead of blocking a thread of a
+    thread pool per request. This allows a single client to keep thousands of requests in flight. Requests are still
+    generated by the RequestGenerator in the thread calling ``run``, and are handed over to the event loop, which runs
+    in a separate thread.
+
+    By default, the number of requests in flight is not limited. The backlog (``max_queued``) and the overload policy
+    can therefore only be used together with ``max_inflight``.
+    """
+
+    default_max_inflight = None
+
+    def __init__(self, ctx: Context, trace_queue: Queue, description: ClientDescription, eventbus=None,
+                 router: Router = None, hosted=False) -> None:
+        super().__init__(ctx, trace_queue, description, eventbus, router, hosted)
+        if self.max_queued is not None and self.max_inflight is None:
+            raise ValueError('max_queued requires max_inflight with the asyncio engine')
+        self.request_executor = None
+        self.loop = asyncio.new_event_loop()
+        self._inflight_semaphore = None
+        self._loop_thread = threading.Thread(target=self.loop.run_forever, name='loop-%s' % self.client_id,
+                                             daemon=True)
+        self._tasks = set()
+
+    def _create_router(self):
+        return self.ctx.create_async_router()
+
+    async def perform_request(self, request):
+        if request is RequestGenerator.DONE:
+            self._workload_done()
+            return
+
+        try:
+            if self._inflight_semaphore is not None:
+                async with self._inflight_semaphore:
+                    await self._perform_request(request)
+            else:
+                await self._perform_request(request)
+        finally:
+            self._release()
+
+    async def _perform_request(self, request) -> RequestTrace:
+        self._prepare_request(request)
+
+        try:
+            request.sent = -1  # will be updated by router
+            response: requests.Response = await self.router.request(request)
+            t = self._create_trace(request, response)
+        except Exception as e:
+            t = self._create_error_trace(request, e)
+
+        self._record_trace(t)
+        return t
+
+    def perform_user_request(self, request) -> RequestTrace:
+        return asyncio.run_coroutine_threadsafe(self._perform_request(request), self.loop).result()
+
+    def _dispatch(self, request):
+        self.loop.call_soon_threadsafe(self._spawn, request)
+
+    def _spawn(self, request):
+        # the event loop only keeps weak references to tasks
+        task = self.loop.create_task(self.perform_request(request))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _shutdown(self):
+        asyncio.run_coroutine_threadsafe(self._close_loop(), self.loop)
+
+    async def _close_loop(self):
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+        close = getattr(self.router, 'close', None)
+        if close is not None:
+            await close()
+
+        self.loop.stop()
+
+    async def _create_inflight_semaphore(self):
+        # asyncio primitives need to be created within the loop they are used in
+        self._inflight_semaphore = asyncio.Semaphore(self.max_inflight)
+
+    def run(self):
+        self._loop_thread.start()
+        if self.max_inflight is not None:
+            asyncio.run_coroutine_threadsafe(self._create_inflight_semaphore(), self.loop).result()
+        super().run()
+
+    def __str__(self):
+        return 'AsyncClient{client_id=%s}' % self.client_id
+
+
+def create_client(ctx: Context, trace_queue: Queue, description: ClientDescription, eventbus=None,
+                  **kwargs) -> Client:
+    """
+    Creates a Client using the request engine configured in the context (``galileo_client_engine``). Additional
+    keyword arguments are passed to the Client.
+    """
+    engine = ctx.getenv('galileo_client_engine', 'threads')
+
+    if engine == 'threads':
+        return Client(ctx, trace_queue, description, eventbus=eventbus, **kwargs)
+    elif engine == 'asyncio':
+        return AsyncClient(ctx, trace_queue, description, eventbus=eventbus, **kwargs)
+
+    raise ValueError('Unknown client engine %s' % engine)
+
+
+class ClientHost:
+    """
+    Hosts many clients in one process. The clients share the event bus and the router (and with it the connection pools
+    and the routing table), but keep their own client ids, request generators, traces, and statistics. Each client runs
+    in its own thread. The host subscribes to workload commands once and forwards them to the addressed client, and
+    exposes ``Client.get_info`` on behalf of all its clients, which returns a ClientInfoList.
+
+    The router is only shared with the threads engine. With the asyncio engine, each client creates its own router, as
+    an asyncio router is bound to the event loop of its client.
+    """
+
+    def __init__(self, ctx: Context, trace_queue: Queue, eventbus=None) -> None:
+        super().__init__()
+        self.ctx = ctx
+        self.trace_queue = trace_queue
+        self.eventbus = eventbus or pymq
+
+        self.clients: Dict[str, Client] = dict()
+        self._threads: Dict[str, threading.Thread] = dict()
+        self._lock = threading.RLock()
+
+        if ctx.getenv('galileo_client_engine', 'threads') == 'threads':
+            self.router = ctx.create_router()
+        else:
+            self.router = None
+
+        self.eventbus.subscribe(self._on_set_workload_command)
+        self.eventbus.subscribe(self._on_start_workload_command)
+        self.eventbus.subscribe(self._on_stop_workload_command)
+        self.eventbus.expose(self.get_info, 'Client.get_info')
+
+    def add_client(self, description: ClientDescription) -> Client:
+        with self._lock:
+            if description.client_id in self.clients:
+                raise ValueError('client %s already hosted' % description.client_id)
+
+            c = create_client(self.ctx, self.trace_queue, description, eventbus=self.eventbus, router=self.router,
+                              hosted=True)
+            thread = threading.Thread(target=c.run, name='client-%s' % c.client_id, daemon=True)
+
+            self.clients[c.client_id] = c
+            self._threads[c.client_id] = thread
+
+        logger.info('%s starting', c)
+        thread.start()
+        return c
+
+    def remove_client(self, client_id: str, timeout=2):
+        with self._lock:
+            c = self.clients.pop(client_id, None)
+            thread = self._threads.pop(client_id, None)
+
+        if c is None:
+            return
+
+        logger.info('%s closing', c)
+        c.close()
+        thread.join(timeout)
+
+    def get_info(self) -> ClientInfoList:
+        with self._lock:
+            clients = list(self.clients.values())
+
+        return ClientInfoList([c.get_info() for c in clients])
+
+    def close(self):
+        with self._lock:
+            client_ids = list(self.clients.keys())
+
+        for client_id in client_ids:
+            self.remove_client(client_id)
+
+        self.eventbus.unsubscribe(self._on_set_workload_command)
+        self.eventbus.unsubscribe(self._on_start_workload_command)
+        self.eventbus.unsubscribe(self._on_stop_workload_command)
+        self.eventbus.unexpose('Client.get_info')
+
+    def _on_set_workload_command(self, cmd: SetWorkloadCommand):
+        c = self.clients.get(cmd.client_id)
+        if c is not None:
+            c._on_set_workload_command(cmd)
+
+    def _on_start_workload_command(self, cmd: StartWorkloadCommand):
+        for client_id in cmd.client_ids:
+            c = self.clients.get(client_id)
+            if c is not None:
+                c._on_start_workload_command(cmd)
+
+    def _on_stop_workload_command(self, cmd: StopWorkloadCommand):
+        c = self.clients.get(cmd.client_id)
+        if c is not None:
+            c._on_stop_workload_command(cmd)
+
+
 def single_request(cfg: ClientConfig, ctx=None, router_type=None) -> requests.Response:
     ctx = ctx or Context()
 
@@ -307,7 +1045,7 @@ def run(ctx: Context, trace_queue: Queue, description: ClientDescription):
     bus_thread = threading.Thread(target=bus.run)
     bus_thread.start()
 
-    client = Client(ctx, trace_queue, description, eventbus=bus)
+    client = create_client(ctx, trace_queue, description, eventbus=bus)
 
     def handler(signum, frame):
         logger.debug('client %s received signal %s', client.client_id, signum)
@@ -328,3 +1066,47 @@ def run(ctx: Context, trace_queue: Queue, description: ClientDescription):
     bus_thread.join(2)
 
     logger.info("%s exitting", client)
+
+
+def run_host(ctx: Context, trace_queue: Queue, commands: Queue):
+    """
+    Runs a ClientHost that reads commands from the given queue: a ClientDescription adds a client, a CloseClientCommand
+    removes one, and None closes the host.
+    """
+    logger.info('starting new client host process')
+
+    bus = RedisEventBus(rds=ctx.create_redis())
+    bus_thread = threading.Thread(target=bus.run)
+    bus_thread.start()
+
+    host = ClientHost(ctx, trace_queue, eventbus=bus)
+
+    def handler(signum, frame):
+        logger.debug('client host received signal %s', signum)
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
+
+    try:
+        while True:
+            cmd = commands.get()
+
+            if cmd is None:
+                break
+            elif isinstance(cmd, ClientDescription):
+                host.add_client(cmd)
+            elif isinstance(cmd, CloseClientCommand):
+                host.remove_client(cmd.client_id)
+            else:
+                logger.warning('client host received unknown command %s', cmd)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        host.close()
+
+    logger.debug('shutting down eventbus')
+    bus.close()
+    bus_thread.join(2)
+
+    logger.info('client host exitting')
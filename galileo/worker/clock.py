@@ -0,0 +1,165 @@
+"""
+Estimates the offset of the local clock to a reference clock, so that timestamps recorded on different workers can be
+compared.
+
+The reference clock is the clock of the Redis server, which is read with the ``TIME`` command. Like NTP, each
+measurement assumes that the server read its clock halfway through the round trip, so the error of a measurement is at
+most half its round-trip time. Of several round trips, only the one with the smallest round-trip time is used, and the
+drift of the local clock is the slope of a least-squares fit through the recent offsets. The local clock is the clock
+of the trace timestamps (``util.wall_time``).
+"""
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+import redis
+from galileodb.model import RequestTrace
+
+from galileo import util
+from galileo.worker.api import ClockEstimate
+
+logger = logging.getLogger(__name__)
+
+
+def measure_offset(rds: redis.Redis, samples: int = 8) -> Tuple[float, float]:
+    """
+    Measures the offset of the local clock to the clock of the Redis server.
+
+    :param rds: the redis connection
+    :param samples: the number of round trips, of which the one with the smallest round-trip time is used
+    :return: a tuple (offset, rtt), where offset is the number of seconds to add to the local time to get the server
+             time
+    """
+    best = None
+
+    for _ in range(samples):
+        t0 = util.wall_time()
+        seconds, micros = rds.time()
+        t1 = util.wall_time()
+
+        rtt = t1 - t0
+        if best is None or rtt < best[1]:
+            best = ((seconds + micros / 1e6) - (t0 + t1) / 2, rtt)
+
+    return best
+
+
+def estimate_drift(history) -> float:
+    """
+    Returns the slope of the least-squares fit through the given (timestamp, offset) pairs, i.e., the number of seconds
+    the offset changes per second.
+    """
+    n = len(history)
+    if n < 2:
+        return 0.
+
+    t_mean = sum(t for t, _ in history) / n
+    o_mean = sum(o for _, o in history) / n
+
+    var = sum((t - t_mean) ** 2 for t, _ in history)
+    if var == 0:
+        return 0.
+
+    return sum((t - t_mean) * (o - o_mean) for t, o in history) / var
+
+
+def correct_time(t: float, estimate: ClockEstimate) -> float:
+    """
+    Converts a local timestamp into the time of the reference clock. Values <= 0 (placeholders for timestamps that were
+    never set) are returned as they are.
+    """
+    if t <= 0:
+        return t
+
+    return t + estimate.offset + estimate.drift * (t - estimate.timestamp)
+
+
+def correct_trace(trace: RequestTrace, estimate: ClockEstimate) -> RequestTrace:
+    return trace._replace(
+        created=correct_time(trace.created, estimate),
+        sent=correct_time(trace.sent, estimate),
+        done=correct_time(trace.done, estimate)
+    )
+
+
+class SharedClockEstimate:
+    """
+    Holds the latest ClockEstimate in shared memory, so that it can be read by other processes (e.g., the trace logger).
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._values = multiprocessing.Array('d', 4)  # offset, drift, rtt, timestamp
+
+    def set(self, estimate: ClockEstimate):
+        with self._values.get_lock():
+            self._values[:] = [estimate.offset, estimate.drift, estimate.rtt, estimate.timestamp]
+
+    def get(self) -> Optional[ClockEstimate]:
+        with self._values.get_lock():
+            values = self._values[:]
+
+        if values[3] == 0:
+            return None
+
+        return ClockEstimate(*values)
+
+
+class ClockSync:
+    """
+    Periodically estimates the clock offset and drift of the worker, and passes each new ClockEstimate to the given
+    callback.
+
+    :param rds: the redis connection used to read the reference clock
+    :param interval: seconds between two estimates
+    :param samples: round trips per estimate
+    :param history: number of past offsets used to estimate the drift
+    :param callback: called with each new ClockEstimate
+    """
+
+    def __init__(self, rds: redis.Redis, interval: float = 60, samples: int = 8, history: int = 10,
+                 callback: Callable[[ClockEstimate], None] = None) -> None:
+        super().__init__()
+        self.rds = rds
+        self.interval = interval
+        self.samples = samples
+        self.callback = callback
+
+        self.estimate: Optional[ClockEstimate] = None
+        self._history = deque(maxlen=history)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='clock-sync', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.update()
+            except redis.RedisError as e:
+                logger.warning('could not estimate clock offset: %s', e)
+
+            self._stopped.wait(self.interval)
+
+    def update(self) -> ClockEstimate:
+        offset, rtt = measure_offset(self.rds, self.samples)
+        now = util.wall_time()
+
+        self._history.append((now, offset))
+        estimate = ClockEstimate(offset, estimate_drift(self._history), rtt, now)
+        self.estimate = estimate
+
+        logger.debug('clock offset %.6fs (rtt %.6fs), drift %.3e', estimate.offset, estimate.rtt, estimate.drift)
+
+        if self.callback:
+            self.callback(estimate)
+
+        return estimate
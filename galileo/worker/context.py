@@ -1,20 +1,27 @@
 import atexit
 import logging
 import os
-import time
 from socket import gethostname
-from typing import MutableMapping, List, Dict
+from typing import MutableMapping, List, Dict, Optional, Iterable
 
 import redis
 import requests
 from galileodb import ExperimentDatabase
 from galileodb.factory import create_experiment_database_from_env
+from galileodb.model import Event as ExperimentEvent
+from galileodb.reporter.events import RedisEventReporter as ExperimentEventReporter
 from galileodb.trace import TraceLogger, TraceWriter, FileTraceWriter, RedisTopicTraceWriter, DatabaseTraceWriter
 
+from galileo import util
 from galileo.apps.loader import AppClientLoader, AppClientDirectoryLoader, AppRepositoryFallbackLoader
 from galileo.apps.repository import RepositoryClient
 from galileo.routing import Router, ServiceRequest, ServiceRouter, HostRouter, StaticRouter, RedisRoutingTable, \
-    ReadOnlyListeningRedisRoutingTable, WeightedRoundRobinBalancer
+    ReadOnlyListeningRedisRoutingTable, WeightedRoundRobinBalancer, SessionPool, RoutingTable, Balancer, \
+    WeightedRandomBalancer, LatencyAwareBalancer, ConsistentHashBalancer
+from galileo.routing.health import HostHealth
+from galileo.routing.shared import SharedRoutingSegment, SharedMemoryRoutingTable
+from galileo.worker.clock import ClockSync, SharedClockEstimate
+from galileo.worker.trace import BatchTraceLogger
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +55,51 @@ class Context:
         - galileo_router_type: SymmetryServiceRouter|SymmetryHostRouter|StaticRouter|DebugRouter
             - StaticRouter:
                 - galileo_router_static_host (http://localhost)
+        - galileo_router_balancer: WeightedRoundRobin|WeightedRandom|p2c|least-outstanding|ConsistentHash
+          (WeightedRoundRobin), how routers that use a routing table pick hosts. p2c and least-outstanding use the
+          latencies and outstanding requests observed by the client instead of the weights. ConsistentHash routes
+          requests with the same key to the same host.
+            - ConsistentHash:
+                - galileo_router_hash_vnodes: points on the hash ring per host (100)
+                - galileo_router_hash_load_factor: bound on the load of a host relative to its fair share (1.25, 0
+                  disables the bound)
+        - galileo_router_breaker_failures: consecutive failures of a host that open its circuit breaker, so that the
+          host receives no requests until a probe request succeeds (0, which disables the circuit breakers)
+        - galileo_router_breaker_reset: seconds after which an open circuit breaker lets a probe request through (5)
+        - galileo_router_pool_size: connections kept open per host (None, which disables connection pooling)
+        - galileo_router_keep_alive: true|false (true)
+        - galileo_router_idle_timeout: seconds after which idle connections are re-established (None)
+        - galileo_router_warmup: connections opened per host with HEAD requests when the router is created (0)
+
+    - Worker
+        - galileo_worker_name (hostname)
+        - galileo_worker_client_hosts: number of processes that host clients (0, which runs each client in its own
+          process)
+        - galileo_worker_pool_size: number of idle client processes started in advance (0)
+        - galileo_worker_shared_routing_table: true|false, whether the worker daemon listens to routing table updates
+          once, and shares the routing table with the client processes through shared memory, instead of each process
+          listening itself (true, only applies to the Caching* router types)
+        - galileo_worker_routing_segment_size: size in bytes of the shared memory for the routing table (1048576)
+
+    - Clock synchronization
+        - galileo_clock_sync_interval: seconds between estimates of the clock offset to the redis server (60, 0
+          disables the estimation)
+        - galileo_clock_sync_samples: round trips per estimate (8)
+        - galileo_clock_correct_traces: true|false, whether trace timestamps are converted to the redis server clock
+          before they are written (false)
+
+    - Client
+        - galileo_client_engine: threads|asyncio (threads)
+        - galileo_client_max_inflight: maximum number of concurrent requests (50, no limit for asyncio)
+        - galileo_client_max_queued: maximum number of requests waiting to be sent (None, which means no limit,
+          requires galileo_client_max_inflight for asyncio)
+        - galileo_client_overload_policy: block|drop|shed (block)
+        - galileo_client_trace_batch_size: maximum number of traces sent to the trace logger at once (100)
+        - galileo_client_trace_batch_age: maximum number of seconds traces are held back (1)
+        - galileo_client_trace_level: timing|size|headers|full (full)
+        - galileo_client_trace_headers: comma-separated list of headers recorded with trace level headers (None = all)
+        - galileo_client_trace_timing: true|false, whether traces break down the request time into connect, TLS,
+          time-to-first-byte and transfer (false)
 
     - Client app loader:
         - galileo_apps_dir ('./apps')
@@ -57,6 +109,8 @@ class Context:
     def __init__(self, env: MutableMapping = os.environ) -> None:
         super().__init__()
         self.env = env
+        # set by the worker daemon, and passed with the context to the client processes
+        self.routing_segment: Optional[SharedRoutingSegment] = None
 
     def getenv(self, *args, **kwargs):
         return self.env.get(*args, **kwargs)
@@ -97,42 +151,169 @@ class Context:
         else:
             raise ValueError('Unknown trace logging type %s' % trace_logging)
 
-    def create_trace_logger(self, trace_queue, start=True) -> TraceLogger:
+    def create_trace_logger(self, trace_queue, start=True, clock: SharedClockEstimate = None) -> TraceLogger:
         writer = self.create_trace_writer()
-        return TraceLogger(trace_queue, writer, start)
+        return BatchTraceLogger(trace_queue, writer, start, clock)
+
+    def create_clock_sync(self, callback=None) -> Optional[ClockSync]:
+        """
+        Creates a ClockSync that estimates the clock offset to the redis server, or returns None if
+        galileo_clock_sync_interval is 0.
+        """
+        interval = float(self.env.get('galileo_clock_sync_interval', '60'))
+        if interval <= 0:
+            return None
+
+        samples = int(self.env.get('galileo_clock_sync_samples', '8'))
+        return ClockSync(self.create_redis(), interval, samples, callback=callback)
+
+    @property
+    def correct_traces(self) -> bool:
+        return self.env.get('galileo_clock_correct_traces', 'false').lower() in ['true', '1', 'yes']
+
+    def create_router(self, router_type=None) -> Router:
+        if router_type is None:
+            router_type = self.env.get('galileo_router_type', 'CachingSymmetryHostRouter')
+
+        if router_type == 'DebugRouter':
+            return DebugRouter()
+
+        session_pool = self.create_session_pool()
+
+        if router_type == 'StaticRouter':
+            host = self.env.get('galileo_router_static_host', 'http://localhost')
+            self._warmup_session_pool(session_pool, [host])
+            return StaticRouter(host, session_pool=session_pool)
+
+        rtable, router_cls = self._create_dynamic_router_parts(router_type, ServiceRouter, HostRouter)
+        self._warmup_session_pool(session_pool, self._routing_table_urls(rtable))
+
+        return router_cls(self.create_balancer(rtable), session_pool=session_pool, health=self.create_host_health())
 
-    def create_router(self, router_type=None):
+    def create_async_router(self, router_type=None) -> Router:
+        """
+        Creates the asyncio variant of the router that ``create_router`` would create. Requires aiohttp.
+        """
         if router_type is None:
             router_type = self.env.get('galileo_router_type', 'CachingSymmetryHostRouter')
 
+        if router_type == 'DebugRouter':
+            return AsyncDebugRouter()
+
+        from galileo.routing.aio import AsyncStaticRouter, AsyncServiceRouter, AsyncHostRouter
+
+        if router_type == 'StaticRouter':
+            host = self.env.get('galileo_router_static_host', 'http://localhost')
+            return AsyncStaticRouter(host)
+
+        rtable, router_cls = self._create_dynamic_router_parts(router_type, AsyncServiceRouter, AsyncHostRouter)
+        return router_cls(self.create_balancer(rtable), health=self.create_host_health())
+
+    def create_host_health(self) -> Optional[HostHealth]:
+        """
+        Creates the HostHealth that tracks the circuit breakers of a router's hosts, or returns None if
+        galileo_router_breaker_failures is 0. Every state change of a breaker is reported as an experiment event
+        ``circuit_breaker`` with the value '<worker> <host> <old state> <new state>'.
+        """
+        failures = int(self.env.get('galileo_router_breaker_failures', '0'))
+        if failures <= 0:
+            return None
+
+        reset = float(self.env.get('galileo_router_breaker_reset', '5'))
+        reporter = ExperimentEventReporter(self.create_redis())
+        worker = self.worker_name
+
+        def report(host, old, new):
+            value = '%s %s %s %s' % (worker, host, old, new)
+            reporter.report(ExperimentEvent(util.wall_time(), 'circuit_breaker', value))
+
+        return HostHealth(failures, reset, listener=report)
+
+    def create_balancer(self, rtable: RoutingTable) -> Balancer:
+        balancer_type = self.env.get('galileo_router_balancer', 'WeightedRoundRobin')
+
+        if balancer_type == 'WeightedRoundRobin':
+            return WeightedRoundRobinBalancer(rtable)
+        if balancer_type == 'WeightedRandom':
+            return WeightedRandomBalancer(rtable)
+        if balancer_type in LatencyAwareBalancer.policies:
+            return LatencyAwareBalancer(rtable, policy=balancer_type)
+        if balancer_type == 'ConsistentHash':
+            vnodes = int(self.env.get('galileo_router_hash_vnodes', '100'))
+            load_factor = float(self.env.get('galileo_router_hash_load_factor', '1.25'))
+            return ConsistentHashBalancer(rtable, vnodes=vnodes, load_factor=load_factor or None)
+
+        raise ValueError('Unknown balancer type %s' % balancer_type)
+
+    def _create_dynamic_router_parts(self, router_type, service_router_cls, host_router_cls):
         if router_type == 'SymmetryServiceRouter':
-            rtable = RedisRoutingTable(self.create_redis())
-            balancer = WeightedRoundRobinBalancer(rtable)
-            return ServiceRouter(balancer)
+            return RedisRoutingTable(self.create_redis()), service_router_cls
         elif router_type == 'CachingSymmetryServiceRouter':
-            rtable = ReadOnlyListeningRedisRoutingTable(self.create_redis())
-            rtable.start()
-            atexit.register(rtable.stop, timeout=2)
-            balancer = WeightedRoundRobinBalancer(rtable)
-            return ServiceRouter(balancer)
+            return self._create_listening_routing_table(), service_router_cls
         elif router_type == 'SymmetryHostRouter':
-            rtable = RedisRoutingTable(self.create_redis())
-            balancer = WeightedRoundRobinBalancer(rtable)
-            return HostRouter(balancer)
+            return RedisRoutingTable(self.create_redis()), host_router_cls
         elif router_type == 'CachingSymmetryHostRouter':
-            rtable = ReadOnlyListeningRedisRoutingTable(self.create_redis())
-            rtable.start()
-            atexit.register(rtable.stop, timeout=2)
-            balancer = WeightedRoundRobinBalancer(rtable)
-            return HostRouter(balancer)
-        elif router_type == 'StaticRouter':
-            host = self.env.get('galileo_router_static_host', 'http://localhost')
-            return StaticRouter(host)
-        elif router_type == 'DebugRouter':
-            return DebugRouter()
+            return self._create_listening_routing_table(), host_router_cls
 
         raise ValueError('Unknown router type %s' % router_type)
 
+    def _create_listening_routing_table(self) -> RoutingTable:
+        if self.routing_segment is not None:
+            return SharedMemoryRoutingTable(self.routing_segment)
+
+        rtable = ReadOnlyListeningRedisRoutingTable(self.create_redis())
+        rtable.start()
+        atexit.register(rtable.stop, timeout=2)
+        return rtable
+
+    def create_shared_routing_segment(self) -> Optional[SharedRoutingSegment]:
+        """
+        Creates the SharedRoutingSegment through which the worker daemon shares the routing table with its client
+        processes, or returns None if galileo_worker_shared_routing_table is disabled or the router does not cache the
+        routing table.
+        """
+        if not util.to_bool(self.env.get('galileo_worker_shared_routing_table', 'true')):
+            return None
+
+        router_type = self.env.get('galileo_router_type', 'CachingSymmetryHostRouter')
+        if not router_type.startswith('Caching'):
+            return None
+
+        return SharedRoutingSegment(int(self.env.get('galileo_worker_routing_segment_size', str(1 << 20))))
+
+    def create_session_pool(self) -> Optional[SessionPool]:
+        """
+        Creates a SessionPool for a router, or returns None if galileo_router_pool_size is not set.
+        """
+        size = self.env.get('galileo_router_pool_size')
+        if not size:
+            return None
+
+        keep_alive = self.env.get('galileo_router_keep_alive', 'true').lower() in ['true', '1', 'yes']
+        idle_timeout = self.env.get('galileo_router_idle_timeout')
+        idle_timeout = float(idle_timeout) if idle_timeout else None
+
+        return SessionPool(int(size), keep_alive=keep_alive, idle_timeout=idle_timeout)
+
+    def _warmup_session_pool(self, session_pool: Optional[SessionPool], urls):
+        connections = int(self.env.get('galileo_router_warmup', '0'))
+        if session_pool is None or not connections:
+            return
+
+        session_pool.warmup(urls, connections)
+
+    @staticmethod
+    def _routing_table_urls(rtable: RoutingTable) -> Iterable[str]:
+        try:
+            records = rtable.get_routes()
+        except Exception as e:
+            logger.warning('could not read hosts from routing table: %s', e)
+            return
+
+        for record in records:
+            for host in record.hosts:
+                yield 'http://%s' % host
+
     def create_app_loader(self) -> AppClientLoader:
         loader = AppClientDirectoryLoader(self.env.get('galileo_apps_dir', os.path.abspath('./apps')))
         repo = RepositoryClient(self.env.get('galileo_apps_repository', 'http://localhost:5001'))
@@ -172,9 +353,15 @@ class DebugRouter(Router):
         response = requests.Response()
         response.status_code = 200
         response.url = self._get_url(req)
-        req.sent = time.time()
+        req.sent = util.wall_time()
 
         return response
 
     def _get_url(self, req: ServiceRequest) -> str:
         return 'http://debughost' + req.path
+
+
+class AsyncDebugRouter(DebugRouter):
+
+    async def request(self, req: ServiceRequest) -> requests.Response:
+        return super().request(req)
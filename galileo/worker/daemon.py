@@ -1,15 +1,18 @@
 import logging
 import multiprocessing
 import threading
-from typing import Dict, List
+from typing import Dict, List, Union
 
 import pymq
 from galileodb.trace import START, PAUSE
 
 import galileo.worker.client as client
 from galileo.controller.cluster import RedisClusterController
+from galileo.routing.table import ReadOnlyListeningRedisRoutingTable, RoutingSnapshot
 from galileo.worker.api import RegisterWorkerEvent, UnregisterWorkerEvent, RegisterWorkerCommand, \
-    StartTracingCommand, PauseTracingCommand, CreateClientCommand, CloseClientCommand, ClientDescription, ClientConfig
+    StartTracingCommand, PauseTracingCommand, CreateClientCommand, CloseClientCommand, ClientDescription, \
+    ClientConfig, ClockEstimate
+from galileo.worker.clock import SharedClockEstimate
 from galileo.worker.context import Context
 
 logger = logging.getLogger(__name__)
@@ -25,10 +28,57 @@ class ClientProcess(multiprocessing.Process):
         self.daemon = True
 
 
+class ClientHostProcess(multiprocessing.Process):
+    """
+    A process that hosts many clients (see ``client.ClientHost``). Clients are added and removed by sending commands
+    through a queue.
+    """
+    client_ids: set
+
+    def __init__(self, ctx, trace_queue, name) -> None:
+        self.commands = multiprocessing.Queue()
+        super().__init__(name=name, target=client.run_host, args=(ctx, trace_queue, self.commands))
+        self.client_ids = set()
+        self.daemon = True
+
+    def add_client(self, description: ClientDescription):
+        self.client_ids.add(description.client_id)
+        self.commands.put(description)
+
+    def close_client(self, client_id: str):
+        self.client_ids.discard(client_id)
+        self.commands.put(CloseClientCommand(client_id))
+
+    def close(self, timeout=3):
+        self.commands.put(None)
+        self.join(timeout)
+        if self.is_alive():
+            self.terminate()
+            self.join(2)
+
+
 class WorkerDaemon:
     """
     The worker daemon manages multiple ClientGroup processes on a host machine and exposes several interaction points
     via pymq.
+
+    By default, each client runs in its own process. If ``galileo_worker_client_hosts`` is set to a number n > 0, the
+    daemon instead starts up to n ClientHostProcess instances, and distributes clients among them, so that many clients
+    share one process, event bus, and router.
+
+    Otherwise, if ``galileo_worker_pool_size`` is set to a number n > 0, the daemon keeps n idle ClientHostProcess
+    instances that are started in advance. Creating a client then only assigns the client to an idle process, which is
+    much faster than starting a new process. When the client is closed, its process goes back into the pool, or is
+    closed if the pool is already full.
+
+    The daemon periodically estimates the offset of its clock to the clock of the redis server (see
+    ``galileo.worker.clock``), and stores the estimate in ``galileo:worker:<name>:clock``. If
+    ``galileo_clock_correct_traces`` is set, the trace logger converts trace timestamps to the redis server clock.
+
+    With a Caching* router type, the daemon listens to routing table updates on behalf of its client processes, and
+    shares the routing table with them through a SharedRoutingSegment (see ``galileo.routing.shared``), so a worker
+    needs only one pub/sub connection and reloads each updated record once. This can be disabled with
+    ``galileo_worker_shared_routing_table``.
     """
     name: str
 
@@ -41,13 +91,31 @@ class WorkerDaemon:
         self.ctrl = ctrl or RedisClusterController(self.rds, self.eventbus)
 
         self.trace_queue = self._create_trace_queue()
-        self._trace_logger = self.ctx.create_trace_logger(self.trace_queue)
+        self._clock = SharedClockEstimate() if self.ctx.correct_traces else None
+        self._trace_logger = self.ctx.create_trace_logger(self.trace_queue, clock=self._clock)
+        self.clock_sync = self.ctx.create_clock_sync(self._on_clock_estimate)
+        if self._clock is not None and self.clock_sync is None:
+            logger.warning('trace timestamps are not corrected, as clock synchronization is disabled')
+
+        # the segment is passed to the client processes with the context
+        self.ctx.routing_segment = self.ctx.create_shared_routing_segment()
+        self._routing_table = None
+        if self.ctx.routing_segment is not None:
+            self._routing_table = ReadOnlyListeningRedisRoutingTable(self.ctx.create_redis())
+            self._routing_table.add_listener(self._on_routing_snapshot)
+
+        self.client_hosts = int(self.ctx.getenv('galileo_worker_client_hosts', 0))
+        self.pool_size = int(self.ctx.getenv('galileo_worker_pool_size', 0))
 
         self._lock = threading.RLock()
-        self._clients: Dict[str, ClientProcess] = dict()
+        self._clients: Dict[str, Union[ClientProcess, ClientHostProcess]] = dict()
+        self._hosts: List[ClientHostProcess] = list()
+        self._pool: List[ClientHostProcess] = list()
+        self._pool_fill_lock = threading.Lock()
         self._closed = threading.Event()
 
         self._client_id_counter = 0
+        self._process_counter = 0
 
     def _create_trace_queue(self):
         return multiprocessing.Queue()
@@ -63,7 +131,12 @@ class WorkerDaemon:
 
         logger.debug('WorkerDaemon %s running...', self.name)
         with self._lock:
+            if self.clock_sync:
+                self.clock_sync.start()
+            if self._routing_table:
+                self._routing_table.start()
             self._trace_logger.start()
+            self._fill_pool()
             self._register_worker()
 
         try:
@@ -102,28 +175,125 @@ class WorkerDaemon:
 
         return result
 
-    def _start_client_process(self, description: ClientDescription) -> ClientProcess:
+    def _start_client_process(self, description: ClientDescription) -> Union[ClientProcess, ClientHostProcess]:
         cid = description.client_id
 
         if cid in self._clients:
             raise ValueError('process for client %s already registered' % cid)
 
+        if self.client_hosts > 0:
+            host = self._get_client_host()
+            logger.info('adding client %s to host process %s', cid, host.name)
+            host.add_client(description)
+            return host
+
+        if self.pool_size > 0:
+            process = self._take_pooled_process()
+            logger.info('assigning client %s to pooled process %s', cid, process.name)
+            process.add_client(description)
+            return process
+
         process = ClientProcess(self.ctx, self.trace_queue, description)
         logger.info('starting client process %s', process)
         process.start()
         return process
 
+    def _get_client_host(self) -> ClientHostProcess:
+        """
+        Returns the host process with the fewest clients, and starts a new one if fewer than ``client_hosts`` are
+        running and all existing ones host clients.
+        """
+        with self._lock:
+            if self._hosts:
+                host = min(self._hosts, key=lambda h: len(h.client_ids))
+                if not host.client_ids or len(self._hosts) >= self.client_hosts:
+                    return host
+
+            host = ClientHostProcess(self.ctx, self.trace_queue, 'client-host-%s-%d' % (self.name, len(self._hosts)))
+            logger.info('starting client host process %s', host.name)
+            host.start()
+            self._hosts.append(host)
+            return host
+
+    def _start_pooled_process(self) -> ClientHostProcess:
+        with self._lock:
+            name = 'client-pool-%s-%d' % (self.name, self._process_counter)
+            self._process_counter += 1
+
+        process = ClientHostProcess(self.ctx, self.trace_queue, name)
+        logger.debug('starting pooled client process %s', name)
+        process.start()
+        return process
+
+    def _fill_pool(self):
+        with self._pool_fill_lock:
+            while not self._closed.is_set() and len(self._pool) < self.pool_size:
+                process = self._start_pooled_process()
+                with self._lock:
+                    self._pool.append(process)
+
+    def _take_pooled_process(self) -> ClientHostProcess:
+        """
+        Takes an idle process from the pool (or starts a new one if the pool is empty), and refills the pool in the
+        background.
+        """
+        with self._lock:
+            process = self._pool.pop(0) if self._pool else None
+
+        if process is None:
+            logger.debug('client process pool is empty')
+            process = self._start_pooled_process()
+
+        threading.Thread(target=self._fill_pool, name='pool-filler', daemon=True).start()
+        return process
+
+    def _return_pooled_process(self, process: ClientHostProcess):
+        with self._lock:
+            if not self._closed.is_set() and process.is_alive() and len(self._pool) < self.pool_size:
+                logger.debug('returning client process %s to pool', process.name)
+                self._pool.append(process)
+                return
+
+        logger.debug('recycling client process %s', process.name)
+        process.close()
+
     def close(self):
         with self._lock:
+            # stops the pool from being filled, and makes processes of closed clients close instead of being pooled
+            self.pool_size = 0
+
             logger.debug('closing clients')
             self.close_clients()
 
+            for host in self._hosts:
+                logger.debug('closing client host process %s', host.name)
+                host.close()
+            self._hosts.clear()
+
+        with self._pool_fill_lock:
+            with self._lock:
+                pool = list(self._pool)
+                self._pool.clear()
+
+        for process in pool:
+            logger.debug('closing pooled client process %s', process.name)
+            process.close()
+
+        with self._lock:
             logger.debug("closing trace logger")
             self._trace_logger.close()
             self._trace_logger.join(timeout=3)
             self._trace_logger.terminate()
             self._trace_logger.join(timeout=2)
 
+            if self.clock_sync:
+                logger.debug("stopping clock synchronization")
+                self.clock_sync.stop(timeout=2)
+
+            if self._routing_table:
+                logger.debug("stopping routing table listener")
+                self._routing_table.stop(timeout=2)
+
             logger.debug("triggering exit of control loop")
             self._closed.set()
 
@@ -142,6 +312,12 @@ class WorkerDaemon:
 
         self.ctrl.unregister_client(client_id)
 
+        if isinstance(process, ClientHostProcess):
+            process.close_client(client_id)
+            if process not in self._hosts:
+                self._return_pooled_process(process)
+            return
+
         process.terminate()
         logger.debug('waiting on client process %s', process.name)
         process.join(3)
@@ -158,6 +334,16 @@ class WorkerDaemon:
         self.ctrl.unregister_worker(self.name)
         self.eventbus.publish(UnregisterWorkerEvent(self.name))
 
+    def _on_clock_estimate(self, estimate: ClockEstimate):
+        if self._clock is not None:
+            self._clock.set(estimate)
+
+        self.ctrl.update_worker_clock(self.name, estimate)
+
+    def _on_routing_snapshot(self, snapshot: RoutingSnapshot):
+        version = self.ctx.routing_segment.write(snapshot.records.values())
+        logger.debug('shared routing table with %d services (version %d)', len(snapshot.records), version)
+
     def _on_create_client_command(self, command: CreateClientCommand):
         if command.host != self.name:
             logger.debug('ignoring CreateClientCommand sent to %s', command.host)
@@ -0,0 +1,178 @@
+"""
+Pre-recorded interarrival profiles that are stored once in Redis and can be replayed by any number of clients.
+
+A profile is stored as a list of chunks under ``galileo:profile:<profile_id>``, where each chunk holds up to
+``chunk_size`` interarrivals as base64-encoded little-endian float32 values (about 5.3 bytes per value, and usable with
+the text-decoding Redis connections galileo uses everywhere). The number of values and the chunk size are stored in the
+hash ``galileo:profile:<profile_id>:meta``.
+"""
+import base64
+import itertools
+import logging
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileInfo(NamedTuple):
+    profile_id: str
+    length: int
+    chunk_size: int
+
+
+def pack(values: Iterable[float]) -> str:
+    arr = array('f', values)
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return base64.b64encode(arr.tobytes()).decode('ascii')
+
+
+def unpack(chunk: str) -> List[float]:
+    arr = array('f')
+    arr.frombytes(base64.b64decode(chunk))
+    if sys.byteorder == 'big':
+        arr.byteswap()
+    return arr.tolist()
+
+
+class ProfileStore:
+    """
+    Stores interarrival profiles in Redis and streams them back in pages of ``page_size`` chunks. While the values of a
+    page are consumed, the next page is already loaded in the background.
+
+    :param rds: the redis connection
+    :param chunk_size: the number of values stored per chunk
+    :param page_size: the number of chunks loaded at once when streaming a profile
+    """
+    key_prefix = 'galileo:profile:'
+
+    def __init__(self, rds: redis.Redis, chunk_size: int = 4096, page_size: int = 4) -> None:
+        super().__init__()
+        self.rds = rds
+        self.chunk_size = chunk_size
+        self.page_size = page_size
+
+    def save(self, profile_id: str, values: Iterable[float]) -> ProfileInfo:
+        """
+        Stores the given interarrivals under the given profile id, replacing an existing profile with that id.
+        """
+        key = self._key(profile_id)
+        length = 0
+
+        pipe = self.rds.pipeline()
+        pipe.delete(key, key + ':meta')
+
+        chunk = list()
+        for value in values:
+            chunk.append(value)
+            if len(chunk) == self.chunk_size:
+                pipe.rpush(key, pack(chunk))
+                length += len(chunk)
+                chunk = list()
+
+        if chunk:
+            pipe.rpush(key, pack(chunk))
+            length += len(chunk)
+
+        pipe.hmset(key + ':meta', {'length': length, 'chunk_size': self.chunk_size})
+        pipe.execute()
+
+        return ProfileInfo(profile_id, length, self.chunk_size)
+
+    def info(self, profile_id: str) -> Optional[ProfileInfo]:
+        meta = self.rds.hgetall(self._key(profile_id) + ':meta')
+        if not meta:
+            return None
+
+        return ProfileInfo(profile_id, int(meta['length']), int(meta['chunk_size']))
+
+    def delete(self, profile_id: str):
+        key = self._key(profile_id)
+        self.rds.delete(key, key + ':meta')
+
+    def list_profiles(self) -> List[str]:
+        suffix = ':meta'
+        keys = self.rds.scan_iter(match=self.key_prefix + '*' + suffix)
+        return sorted(key[len(self.key_prefix):-len(suffix)] for key in keys)
+
+    def stream(self, profile_id: str, offset: int = 0, time_shift: float = 0.) -> Iterator[float]:
+        """
+        Streams the interarrivals of a profile, leaving the stored profile in place. The stream starts at the value with
+        the given offset, and wraps around to the beginning of the profile, so that clients with different offsets all
+        replay the entire profile. A time shift is added to the first interarrival, which delays the stream.
+
+        :param profile_id: the profile id
+        :param offset: the index of the first value
+        :param time_shift: seconds added to the first interarrival
+        :return: a generator of interarrivals
+        """
+        info = self.info(profile_id)
+        if info is None:
+            raise KeyError('no such profile %s' % profile_id)
+
+        if info.length == 0:
+            return
+
+        offset = offset % info.length
+        values = self._read(info, offset, info.length)
+        if offset:
+            values = itertools.chain(values, self._read(info, 0, offset))
+
+        first = next(values, None)
+        if first is None:
+            return
+
+        yield first + time_shift
+        yield from values
+
+    def _read(self, info: ProfileInfo, start: int, end: int) -> Iterator[float]:
+        """
+        Reads the values with index start (inclusive) to end (exclusive).
+        """
+        first_chunk = start // info.chunk_size
+        last_chunk = (end - 1) // info.chunk_size
+        skip = start - first_chunk * info.chunk_size
+        remaining = end - start
+
+        for page in self._read_pages(self._key(info.profile_id), first_chunk, last_chunk):
+            for chunk in page:
+                values = unpack(chunk)
+                if skip:
+                    values = values[skip:]
+                    skip = 0
+                if len(values) > remaining:
+                    values = values[:remaining]
+                remaining -= len(values)
+
+                yield from values
+
+    def _read_pages(self, key: str, first_chunk: int, last_chunk: int) -> Iterator[List[str]]:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            start = first_chunk
+            future = executor.submit(self._read_page, key, start, last_chunk)
+
+            while future is not None:
+                page = future.result()
+                start += self.page_size
+
+                # read ahead while the current page is consumed
+                if page and start <= last_chunk:
+                    future = executor.submit(self._read_page, key, start, last_chunk)
+                else:
+                    future = None
+
+                if page:
+                    yield page
+
+    def _read_page(self, key: str, start: int, last_chunk: int) -> List[str]:
+        end = min(start + self.page_size - 1, last_chunk)
+        logger.debug('reading chunks %d-%d of profile %s', start, end, key)
+        return self.rds.lrange(key, start, end)
+
+    def _key(self, profile_id: str) -> str:
+        return self.key_prefix + profile_id
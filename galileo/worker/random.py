@@ -1,10 +1,23 @@
+import functools
+import itertools
+import logging
+import math
 import random
 import time
-import logging
+import zlib
+
 from galileo.worker.context import Context
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 
+block_size = 4096  # number of values numpy samplers draw at once
+
+
 class InvalidDistributionException(Exception):
     pass
 
@@ -29,6 +42,43 @@ distributions = {
 }
 
 
+def _triangular(rng, size, low=0.0, high=1.0, mode=None):
+    if mode is None:
+        mode = (low + high) / 2
+    return rng.triangular(low, mode, high, size)
+
+
+# numpy equivalents of the functions in ``distributions``. they take the same arguments as the functions of the random
+# module, which are mapped to the (sometimes differently parameterized) numpy distributions.
+block_distributions = {
+    'constant': lambda rng, size, x: np.full(size, x, dtype=float),
+    'uniform': lambda rng, size, a, b: rng.uniform(a, b, size),
+    'triangular': _triangular,
+    'normalvariate': lambda rng, size, mu=0.0, sigma=1.0: rng.normal(mu, sigma, size),
+    'lognormvariate': lambda rng, size, mu, sigma: rng.lognormal(mu, sigma, size),
+    'expovariate': lambda rng, size, lambd=1.0: rng.exponential(1 / lambd, size),
+    'vonmisesvariate': lambda rng, size, mu, kappa: np.mod(rng.vonmises(mu, kappa, size), 2 * math.pi),
+    'gammavariate': lambda rng, size, alpha, beta: rng.gamma(alpha, beta, size),
+    'gauss': lambda rng, size, mu=0.0, sigma=1.0: rng.normal(mu, sigma, size),
+    'betavariate': lambda rng, size, alpha, beta: rng.beta(alpha, beta, size),
+    'paretovariate': lambda rng, size, alpha: rng.pareto(alpha, size) + 1,
+    'weibullvariate': lambda rng, size, alpha, beta: alpha * rng.weibull(beta, size)
+}
+
+
+def client_seed(seed, client_id=None) -> int:
+    """
+    Derives the seed of a client from the seed of a workload, so that clients with the same workload seed draw
+    different, but reproducible, values. The workload seed is masked to 32 bits, as numpy rejects negative seeds.
+    """
+    seed = int(seed) & 0xFFFFFFFF
+
+    if client_id is None:
+        return seed
+
+    return (seed << 32) ^ zlib.crc32(str(client_id).encode())
+
+
 def pre_recorded_profile(ctx: Context, list_key: str):
     rds = ctx.create_redis()
     start = time.time()
@@ -42,29 +92,148 @@ def pre_recorded_profile(ctx: Context, list_key: str):
         yield float(value)
     logger.info('done')
 
-def create_sampler(distribution: str, args: tuple, ctx: Context, client_id=None):
+
+def profile(ctx: Context, profile_id: str, offset: int = 0, time_shift: float = 0.):
+    """
+    Streams a profile stored in the ProfileStore. Unlike ``pre_recorded_profile``, the profile is not deleted, so it can
+    be replayed by many clients.
+    """
+    from galileo.worker.profile import ProfileStore
+
+    store = ProfileStore(ctx.create_redis())
+    if store.info(profile_id) is None:
+        raise InvalidDistributionException('unknown profile ' + profile_id)
+
+    return store.stream(profile_id, int(offset), float(time_shift))
+
+
+def schedule(interval: float, rates, pattern: str = 'constant', seed=None):
+    """
+    Generates the interarrivals of a load schedule, i.e., a list of request rates (requests per second) that each hold
+    for ``interval`` seconds. The interarrivals are computed in the virtual time of the schedule (starting at 0), so
+    rate changes happen exactly at the tick boundaries, regardless of when the values are drawn. The generator ends
+    after the last tick.
+
+    With the pattern ``constant``, requests are evenly spaced, with ``exponential`` they form a Poisson process. A
+    request that would fall into a tick with a rate of 0 is deferred to the next tick with a non-zero rate.
+
+    :param interval: the duration of each tick in seconds
+    :param rates: the request rate of each tick
+    :param pattern: constant|exponential
+    :param seed: optional seed for the exponential pattern
+    :return: a generator of interarrivals
+    """
+    if pattern == 'constant':
+        draw = itertools.repeat(1.).__next__
+    elif pattern in ('exponential', 'poisson'):
+        draw = functools.partial(random.Random(seed).expovariate, 1.)
+    else:
+        raise InvalidDistributionException('unknown arrival pattern ' + str(pattern))
+
+    try:
+        interval = float(interval)
+        rates = [float(rate) for rate in rates]
+    except (TypeError, ValueError) as e:
+        raise InvalidDistributionException('invalid schedule parameters: ' + str(e))
+
+    if interval <= 0:
+        raise InvalidDistributionException('schedule interval needs to be positive')
+    if any(rate < 0 for rate in rates):
+        raise InvalidDistributionException('schedule rates must not be negative')
+
+    return _schedule(interval, rates, draw)
+
+
+def _schedule(interval: float, rates, draw):
+    # each request needs a certain amount of "work" (1 for constant arrivals, exponentially distributed for poisson
+    # arrivals), which accrues at the rate of the current tick. this inverts the piecewise constant rate function.
+    t = 0.
+    last = 0.
+    need = draw()
+
+    for i, rate in enumerate(rates):
+        end = (i + 1) * interval
+
+        if rate > 0:
+            while t + need / rate <= end:
+                t += need / rate
+                yield t - last
+                last = t
+                need = draw()
+
+            need -= rate * (end - t)
+
+        t = end
+
+
+def block_sampler(distribution: str, args: tuple, seed=None, size=None):
+    """
+    Generator that draws values of the given distribution in blocks of ``size`` values using numpy.
+    """
+    fn = block_distributions[distribution]
+    rng = np.random.default_rng(seed)
+    size = size or block_size
+
+    while True:
+        yield from fn(rng, size, *args).tolist()
+
+
+def python_sampler(distribution: str, args: tuple, seed=None):
+    """
+    Generator that draws values of the given distribution one by one using the random module.
+    """
+    if distribution == 'constant':
+        fn = constant
+    else:
+        fn = getattr(random.Random(seed), distribution)
+
+    while True:
+        yield fn(*args)
+
+
+def create_sampler(distribution: str, args: tuple, ctx: Context, client_id=None, seed=None):
     """
-    Creates a generator for the given distribution with the given arguments.
+    Creates a generator for the given distribution with the given arguments. Values are drawn in blocks using numpy if
+    it is installed, and from the random module otherwise.
 
     :param distribution: the distribution, e.g., 'lognormvariate'
     :param args: the arguments, e.g., (0.5, 1)
     :param ctx: context object
+    :param client_id: the client the sampler is created for
+    :param seed: optional seed to make the values reproducible (combined with the client id)
     :return: a generator
     """
-    print("create sampler")
     if distribution == 'prerecorded':
-        yield from pre_recorded_profile(ctx, client_id)
-    else:
-        if distribution not in distributions:
-            raise InvalidDistributionException('unknown distribution ' + distribution)
+        return pre_recorded_profile(ctx, client_id)
+    if distribution == 'profile':
+        if not args:
+            raise InvalidDistributionException('profile requires a profile id')
+        return profile(ctx, *args)
+    if distribution == 'schedule':
+        if not args or len(args) < 2:
+            raise InvalidDistributionException('schedule requires an interval and a list of rates')
+        if seed is not None:
+            seed = client_seed(seed, client_id)
+        return schedule(*args, seed=seed)
+
+    if distribution not in distributions:
+        raise InvalidDistributionException('unknown distribution ' + distribution)
 
-        try:
-            fn = distributions[distribution]
-        except TypeError as e:
-            raise InvalidDistributionException('invalid distribution parameters: ' + str(e))
+    if args is None:
+        args = []
+
+    if seed is not None:
+        seed = client_seed(seed, client_id)
+
+    if np is not None:
+        gen = block_sampler(distribution, args, seed)
+    else:
+        gen = python_sampler(distribution, args, seed)
 
-        if args is None:
-            args = []
+    try:
+        # draw the first value eagerly, so invalid parameters are detected when the sampler is created
+        first = next(gen)
+    except (TypeError, ValueError) as e:
+        raise InvalidDistributionException('invalid distribution parameters: ' + str(e))
 
-        while True:
-            yield fn(*args)
+    return itertools.chain((first,), gen)
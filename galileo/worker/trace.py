@@ -0,0 +1,241 @@
+"""
+Functions to work with the request traces recorded by clients.
+
+The ``created`` field of a trace holds the time at which the request was due according to the workload (see
+``ServiceRequest.scheduled``), not the time it was actually sent. The difference between the two is the time the request
+waited in the client, e.g., because the client or the request generator was saturated. ``latency`` only measures the
+time between sending the request and receiving the response, whereas ``corrected_latency`` includes the waiting time,
+which makes it robust against coordinated omission.
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from multiprocessing.queues import Queue
+from queue import Full
+from typing import NamedTuple, Optional, Iterable, List, Dict
+
+from galileodb.model import RequestTrace
+from galileodb.trace import TraceLogger, TraceWriter
+
+from galileo.worker.clock import SharedClockEstimate, correct_trace
+
+logger = logging.getLogger(__name__)
+
+STATUS_ERROR = -1  # the request failed with an exception
+STATUS_DROPPED = -2  # the request was not sent because the client was overloaded
+
+TIMING_HEADER = 'Galileo-Timing'  # key of the timing breakdown in the headers of a trace
+
+
+class LatencyRecord(NamedTuple):
+    request_id: str
+    client: str
+    service: str
+    server: str
+    status: int
+    latency: Optional[float]
+    corrected_latency: float
+    delay: Optional[float]
+
+
+def latency(trace: RequestTrace) -> Optional[float]:
+    """
+    Returns the time between sending the request and receiving the response, or None if the request was never sent.
+    """
+    if trace.sent is None or trace.sent < 0:
+        return None
+
+    return trace.done - trace.sent
+
+
+def corrected_latency(trace: RequestTrace) -> float:
+    """
+    Returns the time between the point in time the request was due and receiving the response.
+    """
+    return trace.done - trace.created
+
+
+def delay(trace: RequestTrace) -> Optional[float]:
+    """
+    Returns the time the request waited in the client before it was sent, or None if the request was never sent.
+    """
+    if trace.sent is None or trace.sent < 0:
+        return None
+
+    return trace.sent - trace.created
+
+
+def timing_breakdown(trace: RequestTrace) -> Optional[Dict[str, float]]:
+    """
+    Returns the connect, tls, ttfb and transfer times of the request (see ``galileo.routing.timing``), or None if the
+    client did not record them (see ``ClientConfig.trace_timing``).
+    """
+    if not trace.headers:
+        return None
+
+    try:
+        headers = json.loads(trace.headers)
+    except ValueError:
+        return None
+
+    return headers.get(TIMING_HEADER)
+
+
+def latency_view(traces: Iterable[RequestTrace]) -> List[LatencyRecord]:
+    """
+    Computes the latency, corrected latency, and delay for each of the given traces.
+
+    :param traces: the request traces
+    :return: a list of LatencyRecord tuples
+    """
+    return [
+        LatencyRecord(t.request_id, t.client, t.service, t.server, t.status, latency(t), corrected_latency(t), delay(t))
+        for t in traces
+    ]
+
+
+class TraceBatch(NamedTuple):
+    """
+    A batch of traces as sent from a client process to the trace logger. Traces are stored as plain tuples, which are
+    considerably cheaper to pickle than RequestTrace objects, and the whole batch is sent with a single queue operation.
+    """
+    traces: List[tuple]
+
+    @staticmethod
+    def pack(traces: Iterable[RequestTrace]) -> 'TraceBatch':
+        return TraceBatch([tuple(t) for t in traces])
+
+    def unpack(self) -> List[RequestTrace]:
+        return [RequestTrace(*t) for t in self.traces]
+
+
+class TraceBuffer:
+    """
+    Buffers the traces of a client and sends them as TraceBatch to the trace queue once ``size`` traces were buffered,
+    or the oldest buffered trace is older than ``max_age`` seconds. A background thread takes care of the latter, so
+    traces are also sent when a client is idle. Batches that do not fit into the queue are discarded and counted in
+    ``dropped``.
+
+    :param trace_queue: the queue consumed by the trace logger
+    :param size: the maximum number of traces in a batch
+    :param max_age: the maximum number of seconds a trace is held back
+    """
+
+    def __init__(self, trace_queue: Queue, size: int = 100, max_age: float = 1) -> None:
+        super().__init__()
+        self.queue = trace_queue
+        self.size = size
+        self.max_age = max_age
+        self.dropped = 0
+
+        self._buffer = list()
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def put(self, trace: RequestTrace):
+        if self._flusher is None:
+            self._start_flusher()
+
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.time()
+            self._buffer.append(trace)
+
+            if len(self._buffer) < self.size and not self._closed.is_set():
+                return
+
+            traces = self._take()
+
+        self._send(traces)
+
+    def flush(self):
+        with self._lock:
+            traces = self._take()
+
+        if traces:
+            self._send(traces)
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+    def _take(self) -> List[RequestTrace]:
+        traces = self._buffer
+        self._buffer = list()
+        self._oldest = None
+        return traces
+
+    def _send(self, traces: List[RequestTrace]):
+        try:
+            self.queue.put_nowait(TraceBatch.pack(traces))
+        except Full:
+            logger.warning('trace queue full, dropping %d traces', len(traces))
+            self.dropped += len(traces)
+
+    def _start_flusher(self):
+        if self._flusher is not None or self._closed.is_set():
+            return
+
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name='trace-flusher', daemon=True)
+
+        self._flusher.start()
+
+    def _run_flusher(self):
+        while not self._closed.wait(self.max_age / 2):
+            oldest = self._oldest
+            if oldest is not None and time.time() - oldest >= self.max_age:
+                self.flush()
+
+
+class BatchTraceReader:
+    """
+    Wraps the trace queue of a trace logger and unpacks TraceBatch items, so the TraceLogger sees individual traces.
+    Other items (like the control messages of the TraceLogger) are passed through. If a clock estimate is given, the
+    timestamps of the traces are converted to the reference clock (see ``galileo.worker.clock``).
+    """
+
+    def __init__(self, trace_queue: Queue, clock: SharedClockEstimate = None) -> None:
+        super().__init__()
+        self.queue = trace_queue
+        self.clock = clock
+        self._pending = deque()
+
+    def get(self, block=True, timeout=None):
+        if self._pending:
+            return self._pending.popleft()
+
+        item = self.queue.get(block, timeout)
+        if not isinstance(item, TraceBatch):
+            return item
+
+        traces = item.unpack()
+        estimate = self.clock.get() if self.clock is not None else None
+        if estimate is not None:
+            traces = [correct_trace(trace, estimate) for trace in traces]
+
+        self._pending.extend(traces)
+        if not self._pending:
+            return self.get(block, timeout)
+
+        return self._pending.popleft()
+
+    def put(self, *args, **kwargs):
+        return self.queue.put(*args, **kwargs)
+
+
+class BatchTraceLogger(TraceLogger):
+    """
+    A TraceLogger that consumes the TraceBatch items sent by the TraceBuffer of clients, and optionally corrects their
+    timestamps with the given clock estimate.
+    """
+
+    def __init__(self, trace_queue: Queue, writer: TraceWriter = None, start=True,
+                 clock: SharedClockEstimate = None) -> None:
+        super().__init__(BatchTraceReader(trace_queue, clock), writer, start)
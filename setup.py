@@ -9,7 +9,9 @@ tests_require = [
     'pytest>=5.0.0',
     'pytest-cov>=2.7.1',
     'coverage>=4.5.3',
-    'coveralls'
+    'coveralls',
+    'aiohttp>=3.6.0',
+    'numpy>=1.17.0'
 ]
 install_requires = [
     'galileo-db>=0.10.4.dev1',
@@ -20,6 +22,10 @@ install_requires = [
     'pyyaml>=5.4.1',
     'click>=7.0',
 ]
+extras_require = {
+    'asyncio': ['aiohttp>=3.6.0'],
+    'numpy': ['numpy>=1.17.0'],
+}
 
 setuptools.setup(
     name="edgerun-galileo",
@@ -34,6 +40,7 @@ setuptools.setup(
     test_suite="tests",
     tests_require=tests_require,
     install_requires=install_requires,
+    extras_require=extras_require,
     classifiers=[
         "Programming Language :: Python :: 3",
         "Operating System :: OS Independent",
@@ -1,6 +1,6 @@
 import unittest
 
-from galileo.apps.app import DefaultAppClient
+from galileo.apps.app import DefaultAppClient, AppClient
 from galileo.worker.client import AppClientRequestFactory
 
 
@@ -27,3 +27,17 @@ class DefaultAppClientTest(unittest.TestCase):
         self.assertEqual('/foo', req.path)
         self.assertEqual('post', req.method)
         self.assertEqual({'data': '500'}, req.kwargs)
+
+    def test_request_key(self):
+        class Module:
+            @staticmethod
+            def next_request():
+                return 'get', '/images/42', None, 'image-42'
+
+        factory = AppClientRequestFactory('myservice', AppClient('images', None, Module))
+
+        req = factory.create_request()
+
+        self.assertEqual('/images/42', req.path)
+        self.assertEqual('image-42', req.key)
+        self.assertIsNone(DefaultAppClient().next_request().key)
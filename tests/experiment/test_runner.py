@@ -0,0 +1,34 @@
+import unittest
+from unittest.mock import MagicMock
+
+from galileodb.model import ExperimentConfiguration, WorkloadConfiguration
+
+from galileo.experiment.runner import run_experiment, validate_experiment
+from galileo.worker.random import InvalidDistributionException
+
+
+class RunnerTest(unittest.TestCase):
+
+    def test_validate_experiment(self):
+        workload = WorkloadConfiguration('aservice', [1, 2], 1, 'exponential')
+        validate_experiment(ExperimentConfiguration(2, 1, [workload]))
+        validate_experiment(ExperimentConfiguration(2, 1, [workload._replace(arrival_pattern=None)]))
+
+        invalid = [
+            ExperimentConfiguration(2, 1, [workload._replace(arrival_pattern='foo')]),
+            ExperimentConfiguration(2, 0, [workload]),
+            ExperimentConfiguration(2, 1, [workload._replace(ticks=[1, 'x'])]),
+        ]
+        for exp in invalid:
+            self.assertRaises(InvalidDistributionException, validate_experiment, exp)
+
+    def test_invalid_experiment_fails_before_spawning_clients(self):
+        ctrl = MagicMock()
+        exp = ExperimentConfiguration(2, 1, [WorkloadConfiguration('aservice', [1, 2], 1, 'foo')])
+
+        self.assertRaises(InvalidDistributionException, run_experiment, ctrl, exp)
+        ctrl.create_clients.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
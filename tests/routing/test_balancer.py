@@ -1,8 +1,11 @@
+import random
 import unittest
 import unittest.mock
 from collections import Counter, defaultdict
 
-from galileo.routing.balancer import WeightedRandomBalancer, WeightedRoundRobinBalancer
+from galileo.routing.balancer import WeightedRandomBalancer, WeightedRoundRobinBalancer, wrr_schedule, \
+    SmoothWeightedRoundRobin, AliasTable, LatencyAwareBalancer, \
+    ConsistentHashBalancer, HashRing
 from galileo.routing.table import RoutingTable, RoutingRecord
 
 
@@ -129,3 +132,305 @@ class BalancerTest(unittest.TestCase):
         self.assertAlmostEqual(10, cnt['a'], delta=1)
         self.assertAlmostEqual(40, cnt['b'], delta=1)
         self.assertAlmostEqual(50, cnt['c'], delta=1)
+
+    def test_weighted_random_next_hosts(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b', 'c'], weights=[1, 3, 0]))
+
+        balancer = WeightedRandomBalancer(rtbl)
+        with unittest.mock.patch.object(balancer, '_compile', wraps=balancer._compile) as compile_spy:
+            hosts = balancer.next_hosts('aservice', 1000)
+            balancer.next_host('aservice')
+            self.assertEqual(1, compile_spy.call_count)
+
+        cnt = Counter(hosts)
+        self.assertEqual(1000, len(hosts))
+        self.assertEqual(0, cnt['c'])
+        self.assertAlmostEqual(250, cnt['a'], delta=60)
+        self.assertAlmostEqual(750, cnt['b'], delta=60)
+
+    def test_alias_table(self):
+        table = AliasTable(['a', 'b', 'c', 'd'], [1, 2, 3, 0])
+
+        # every column is split between (at most) two items, and the probabilities add up to the weights
+        mass = defaultdict(float)
+        for i, p in enumerate(table.prob):
+            mass[table.items[i]] += p / 4
+            mass[table.items[table.alias[i]]] += (1 - p) / 4
+
+        self.assertAlmostEqual(1 / 6, mass['a'])
+        self.assertAlmostEqual(2 / 6, mass['b'])
+        self.assertAlmostEqual(3 / 6, mass['c'])
+        self.assertAlmostEqual(0, mass['d'])
+
+        self.assertEqual(['a'], AliasTable(['a'], [5]).sample_many(1))
+        self.assertRaises(ValueError, AliasTable, ['a', 'b'], [0, 0])
+        self.assertRaises(ValueError, AliasTable, [], [])
+
+    def test_wrr_schedule(self):
+        self.assertEqual(['c', 'b', 'c', 'b', 'c', 'b', 'c', 'a', 'b', 'c'], wrr_schedule(['a', 'b', 'c'], [1, 4, 5]))
+        self.assertEqual(['b', 'a', 'b'], wrr_schedule(['a', 'b'], [2, 4]))
+        self.assertEqual(['b'], wrr_schedule(['a', 'b'], [0, 3]))
+        self.assertRaises(ValueError, wrr_schedule, ['a', 'b'], [0, 0])
+
+    def test_weighted_round_robin_compiles_record_once(self):
+        route = RoutingRecord('aservice', hosts=['a', 'b', 'c'], weights=[1, 4, 5])
+
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(return_value=route)
+
+        balancer = WeightedRoundRobinBalancer(rtbl)
+        with unittest.mock.patch.object(balancer, '_compile', wraps=balancer._compile) as compile_spy:
+            for _ in range(100):
+                balancer.next_host('aservice')
+
+            self.assertEqual(1, compile_spy.call_count)
+
+            # an equal record (e.g., read again from redis) does not trigger a rebuild either
+            rtbl.get_routing.return_value = RoutingRecord('aservice', hosts=['a', 'b', 'c'], weights=[1, 4, 5])
+            balancer.next_host('aservice')
+            self.assertEqual(1, compile_spy.call_count)
+
+            rtbl.get_routing.return_value = RoutingRecord('aservice', hosts=['a', 'b'], weights=[1, 1])
+            balancer.next_host('aservice')
+            self.assertEqual(2, compile_spy.call_count)
+
+    def test_weighted_round_robin_with_skewed_weights(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b'], weights=[1, 9999]))
+
+        balancer = WeightedRoundRobinBalancer(rtbl)
+        hosts = [balancer.next_host('aservice') for _ in range(10000)]
+
+        cnt = Counter(hosts)
+        self.assertEqual(1, cnt['a'])
+        self.assertEqual(9999, cnt['b'])
+
+    def test_smooth_weighted_round_robin(self):
+        swrr = SmoothWeightedRoundRobin(['a', 'b', 'c'], [5, 1, 1])
+
+        self.assertEqual(['a', 'a', 'b', 'a', 'c', 'a', 'a'], [next(swrr) for _ in range(7)])
+
+    def test_latency_aware_p2c_prefers_fast_hosts(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['fast', 'slow', 'off'], weights=[1, 1, 0]))
+
+        balancer = LatencyAwareBalancer(rtbl, policy='p2c', rnd=random.Random(42))
+        latency = {'fast': 0.01, 'slow': 0.1}
+
+        hosts = []
+        for _ in range(100):
+            host = balancer.next_host('aservice')
+            balancer.on_request('aservice', host)
+            balancer.on_response('aservice', host, latency[host], True)
+            hosts.append(host)
+
+        cnt = Counter(hosts)
+        self.assertEqual(0, cnt['off'])
+        self.assertGreater(cnt['fast'], 90)
+        self.assertEqual(0, balancer.get_stats('aservice', 'fast').outstanding)
+        self.assertAlmostEqual(0.01, balancer.get_stats('aservice', 'fast').ewma)
+
+    def test_latency_aware_p2c_avoids_hosts_that_never_answer(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b', 'dead'], weights=[1, 1, 1]))
+
+        balancer = LatencyAwareBalancer(rtbl, policy='p2c', rnd=random.Random(42))
+
+        hosts = []
+        for _ in range(300):
+            host = balancer.next_host('aservice')
+            balancer.on_request('aservice', host)
+            if host != 'dead':
+                balancer.on_response('aservice', host, 0.01, True)
+            hosts.append(host)
+
+        stats = balancer.get_stats('aservice', 'dead')
+        self.assertEqual(0, stats.samples)
+        self.assertEqual(Counter(hosts)['dead'], stats.outstanding)
+        self.assertLess(stats.outstanding, 10)
+
+    def test_latency_aware_least_outstanding(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b', 'c'], weights=[1, 1, 1]))
+
+        balancer = LatencyAwareBalancer(rtbl, policy='least-outstanding')
+
+        hosts = []
+        for _ in range(6):
+            host = balancer.next_host('aservice')
+            balancer.on_request('aservice', host)
+            hosts.append(host)
+
+        self.assertEqual({'a': 2, 'b': 2, 'c': 2}, Counter(hosts))
+
+        balancer.on_response('aservice', 'b', 0.1, True)
+        self.assertEqual('b', balancer.next_host('aservice'))
+
+    def test_latency_aware_penalizes_errors(self):
+        rtbl = RoutingTable()
+        balancer = LatencyAwareBalancer(rtbl, error_penalty=2.)
+
+        balancer.on_request('aservice', 'a')
+        balancer.on_response('aservice', 'a', 0.01, False)
+        self.assertEqual(2., balancer.get_stats('aservice', 'a').ewma)
+
+        self.assertRaises(ValueError, LatencyAwareBalancer, rtbl, policy='foo')
+
+    def test_consistent_hash_routes_keys_to_same_host(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b', 'c'], weights=[1, 1, 1]))
+
+        balancer = ConsistentHashBalancer(rtbl, load_factor=None)
+        first = {key: balancer.next_host_for_key('aservice', key) for key in range(1000)}
+        second = {key: balancer.next_host_for_key('aservice', key) for key in range(1000)}
+
+        self.assertEqual(first, second)
+        for host, cnt in Counter(first.values()).items():
+            self.assertAlmostEqual(333, cnt, delta=100, msg=host)
+
+        # adding a host only moves keys to the new host
+        rtbl.get_routing.return_value = RoutingRecord('aservice', hosts=['a', 'b', 'c', 'd'], weights=[1, 1, 1, 1])
+        third = {key: balancer.next_host_for_key('aservice', key) for key in range(1000)}
+        moved = [key for key in first if first[key] != third[key]]
+        self.assertAlmostEqual(250, len(moved), delta=100)
+        self.assertEqual({'d'}, {third[key] for key in moved})
+
+        # removing a host only moves its keys
+        rtbl.get_routing.return_value = RoutingRecord('aservice', hosts=['a', 'c', 'd'], weights=[1, 1, 1])
+        fourth = {key: balancer.next_host_for_key('aservice', key) for key in range(1000)}
+        self.assertEqual({'b'}, {third[key] for key in third if third[key] != fourth[key]})
+
+    def test_hash_ring_update_reuses_points(self):
+        ring = HashRing.create(['a', 'b'], [1, 1], vnodes=10)
+        self.assertEqual(20, len(ring.points))
+
+        with unittest.mock.patch.object(HashRing, 'host_points', wraps=HashRing.host_points) as spy:
+            updated = ring.update(['a', 'b', 'c'], [1, 1, 1], vnodes=10)
+            spy.assert_called_once_with('c', 10)
+
+        self.assertEqual(30, len(updated.points))
+        self.assertEqual(20, len(ring.points))
+        self.assertRaises(ValueError, ring.update, ['a'], [0])
+
+    def test_consistent_hash_bounded_loads(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b', 'c', 'd'], weights=[1, 1, 1, 1]))
+
+        balancer = ConsistentHashBalancer(rtbl, load_factor=1.5)
+
+        # all requests have the same key, but no host gets more than 1.5 times its fair share
+        hosts = []
+        for _ in range(40):
+            host = balancer.next_host_for_key('aservice', 'hot-key')
+            balancer.on_request('aservice', host)
+            hosts.append(host)
+
+        cnt = Counter(hosts)
+        self.assertGreaterEqual(len(cnt), 3)
+        self.assertLessEqual(max(cnt.values()), 15)  # ceil(1.5 * 40 / 4)
+
+        # once the load is gone, the key goes back to its host
+        for host in hosts:
+            balancer.on_response('aservice', host, 0.01, True)
+        self.assertEqual(hosts[0], balancer.next_host_for_key('aservice', 'hot-key'))
+
+    def test_state_of_removed_service_is_evicted(self):
+        records = {
+            'aservice': RoutingRecord('aservice', hosts=['a'], weights=[1]),
+            'bservice': RoutingRecord('bservice', hosts=['b'], weights=[1]),
+        }
+
+        def get_routing(service):
+            if service not in records:
+                raise ValueError
+            return records[service]
+
+        rtbl = RoutingTable()
+        rtbl.get_routing = get_routing
+        rtbl.list_services = lambda: records.keys()
+
+        balancer = WeightedRoundRobinBalancer(rtbl)
+        balancer.next_host('aservice')
+        balancer.next_host('bservice')
+        self.assertEqual((2, 1024, 0), balancer.cache_info())
+
+        del records['aservice']
+        self.assertRaises(ValueError, balancer.next_host, 'aservice')
+        self.assertEqual((1, 1024, 1), balancer.cache_info())
+
+        # services that are no longer listed are evicted when another state is built
+        del records['bservice']
+        records['cservice'] = RoutingRecord('cservice', hosts=['c'], weights=[1])
+        balancer.next_host('cservice')
+        self.assertEqual((1, 1024, 2), balancer.cache_info())
+        self.assertEqual(['cservice'], list(balancer._states))
+
+    def test_services_are_listed_outside_the_lock(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = lambda service: RoutingRecord(service, hosts=['a'], weights=[1])
+
+        balancer = WeightedRoundRobinBalancer(rtbl)
+        locked = list()
+
+        def list_services():
+            locked.append(balancer._lock.locked())
+            return ['aservice']
+
+        rtbl.list_services = list_services
+        balancer.next_host('aservice')
+
+        self.assertEqual([False], locked)
+
+    def test_least_recently_used_states_are_evicted(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = lambda service: RoutingRecord(service, hosts=['a'], weights=[1])
+
+        balancer = WeightedRandomBalancer(rtbl, max_entries=2)
+        balancer.next_host('aservice')
+        balancer.next_host('bservice')
+        balancer.next_host('aservice')
+        balancer.next_host('cservice')
+
+        self.assertEqual({'aservice', 'cservice'}, set(balancer._states))
+        self.assertEqual((2, 2, 1), balancer.cache_info())
+
+    def test_latency_aware_drops_stats_of_removed_hosts(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b'], weights=[1, 1]))
+
+        balancer = LatencyAwareBalancer(rtbl)
+        balancer.next_host('aservice')
+        balancer.on_request('aservice', 'b')
+        self.assertEqual({('aservice', 'a'), ('aservice', 'b')}, set(balancer._stats))
+
+        rtbl.get_routing.return_value = RoutingRecord('aservice', hosts=['a'], weights=[1])
+        balancer.next_host('aservice')
+        self.assertEqual({('aservice', 'a')}, set(balancer._stats))
+
+        # the response of a request to a removed host does not bring back its stats
+        balancer.on_response('aservice', 'b', 0.1, True)
+        self.assertEqual({('aservice', 'a')}, set(balancer._stats))
+
+    def test_consistent_hash_does_not_keep_idle_loads(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('aservice', hosts=['a', 'b'], weights=[1, 1]))
+
+        balancer = ConsistentHashBalancer(rtbl)
+        hosts = [balancer.next_host_for_key('aservice', key) for key in range(10)]
+        for host in hosts:
+            balancer.on_request('aservice', host)
+        for host in hosts:
+            balancer.on_response('aservice', host, 0.01, True)
+
+        self.assertEqual({}, balancer._loads)
+        self.assertEqual({}, balancer._service_loads)
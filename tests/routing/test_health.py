@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import patch
+
+from galileo.routing.health import HostHealth, CLOSED, OPEN, HALF_OPEN
+from galileo.worker.context import Context
+
+
+class HostHealthTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.changes = list()
+        self.health = HostHealth(failure_threshold=3, reset_timeout=5, listener=self.on_change)
+
+    def on_change(self, host, old, new):
+        self.changes.append((host, old, new))
+
+    def test_consecutive_failures_open_breaker(self):
+        self.health.on_failure('a')
+        self.health.on_failure('a')
+        self.health.on_success('a')  # resets the failure count
+        self.health.on_failure('a')
+        self.health.on_failure('a')
+        self.assertEqual(CLOSED, self.health.state('a'))
+        self.assertTrue(self.health.acquire('a'))
+
+        self.health.on_failure('a')
+        self.assertEqual(OPEN, self.health.state('a'))
+        self.assertFalse(self.health.acquire('a'))
+        self.assertTrue(self.health.acquire('b'))
+
+        self.assertEqual([('a', CLOSED, OPEN)], self.changes)
+
+    @patch('galileo.routing.health.time.monotonic')
+    def test_half_open_probe(self, monotonic):
+        monotonic.return_value = 100
+        for _ in range(3):
+            self.health.on_failure('a')
+
+        monotonic.return_value = 104
+        self.assertFalse(self.health.acquire('a'))
+
+        # after the reset timeout, exactly one probe is let through
+        monotonic.return_value = 105
+        self.assertTrue(self.health.acquire('a'))
+        self.assertEqual(HALF_OPEN, self.health.state('a'))
+        self.assertFalse(self.health.acquire('a'))
+
+        # a failed probe opens the breaker again
+        self.health.on_failure('a')
+        self.assertEqual(OPEN, self.health.state('a'))
+        self.assertFalse(self.health.acquire('a'))
+
+        monotonic.return_value = 110
+        self.assertTrue(self.health.acquire('a'))
+        self.health.on_success('a')
+        self.assertEqual(CLOSED, self.health.state('a'))
+        self.assertTrue(self.health.acquire('a'))
+
+        self.assertEqual([
+            ('a', CLOSED, OPEN),
+            ('a', OPEN, HALF_OPEN),
+            ('a', HALF_OPEN, OPEN),
+            ('a', OPEN, HALF_OPEN),
+            ('a', HALF_OPEN, CLOSED),
+        ], self.changes)
+
+    @patch('galileo.routing.health.time.monotonic')
+    def test_late_successes_do_not_close_breaker(self, monotonic):
+        monotonic.return_value = 100
+        for _ in range(3):
+            self.health.on_failure('a')
+
+        # a slow request that was sent before the breaker opened
+        self.health.on_success('a', 99)
+        self.assertEqual(OPEN, self.health.state('a'))
+        self.assertFalse(self.health.acquire('a'))
+
+        monotonic.return_value = 105
+        self.assertTrue(self.health.acquire('a'))
+        self.health.on_success('a', 99)
+        self.assertEqual(HALF_OPEN, self.health.state('a'))
+
+        # only the probe closes the breaker
+        self.health.on_success('a', 105)
+        self.assertEqual(CLOSED, self.health.state('a'))
+
+    def test_healthy_hosts_have_no_breaker(self):
+        self.health.on_failure('a')
+        self.health.on_success('a')
+        self.health.on_success('b')
+
+        self.assertEqual({}, self.health._breakers)
+
+    def test_listener_errors_are_ignored(self):
+        def listener(host, old, new):
+            raise ValueError
+
+        health = HostHealth(failure_threshold=1, listener=listener)
+        health.on_failure('a')
+        self.assertEqual(OPEN, health.state('a'))
+
+    @patch('galileo.worker.context.ExperimentEventReporter')
+    def test_context_reports_state_changes_as_events(self, reporter_cls):
+        ctx = Context({'galileo_router_breaker_failures': '1', 'galileo_worker_name': 'worker1'})
+
+        health = ctx.create_host_health()
+        health.on_failure('ahost')
+
+        event = reporter_cls.return_value.report.call_args[0][0]
+        self.assertEqual('circuit_breaker', event.name)
+        self.assertEqual('worker1 ahost closed open', event.value)
+
+        self.assertIsNone(Context({'galileo_router_breaker_failures': '0'}).create_host_health())
+        self.assertIsNone(Context({}).create_host_health())
@@ -1,8 +1,20 @@
+import asyncio
+import threading
 import unittest
+import unittest.mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 from unittest.mock import patch
 
-from galileo.routing.balancer import StaticLocalhostBalancer
+import requests
+
+from galileo.routing import SessionPool
+from galileo.routing.balancer import StaticLocalhostBalancer, StaticHostBalancer, WeightedRoundRobinBalancer
+from galileo.routing.health import HostHealth, HostUnavailableError, OPEN, CLOSED
+from galileo.routing.aio import AsyncStaticRouter, AsyncHostRouter, AsyncServiceRouter
 from galileo.routing.router import StaticRouter, ServiceRequest, HostRouter, ServiceRouter
+from galileo.routing.table import RoutingTable, RoutingRecord
+from galileo.routing.timing import RequestTiming
 
 
 class TestRouterUrlCreation(unittest.TestCase):
@@ -25,6 +37,18 @@ class TestRouterUrlCreation(unittest.TestCase):
         url = router._get_url(ServiceRequest('foobar', '/some/service'))
         self.assertEqual('http://localhost/foobar/some/service', url)
 
+    def test_cache_info(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = lambda service: RoutingRecord(service, ['a'], [1])
+        rtbl.list_services = lambda: ['foobar']
+
+        router = HostRouter(WeightedRoundRobinBalancer(rtbl))
+        router._get_url(ServiceRequest('foobar', '/some/service'))
+
+        self.assertEqual((1, 1024, 0), router.cache_info())
+        self.assertIsNone(HostRouter(StaticLocalhostBalancer()).cache_info())
+        self.assertIsNone(StaticRouter('http://localhost').cache_info())
+
     @patch('galileo.routing.router.requests.request')
     def test_request_basic(self, mock_request):
         """
@@ -53,5 +77,252 @@ class TestRouterUrlCreation(unittest.TestCase):
         self.assertEqual('http://localhost/some/service', response.args[1])
 
 
+class HelloHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'hello'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_async(coro):
+    # asyncio.run requires Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer requires Python 3.7
+    daemon_threads = True
+
+
+class TestRequestTiming(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('localhost', 0), HelloHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://localhost:%d' % self.server.server_port
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(2)
+
+    def timed_request(self, router) -> ServiceRequest:
+        req = ServiceRequest('foobar', '/')
+        req.timing = RequestTiming()
+        response = router.request(req)
+        self.assertEqual(200, response.status_code)
+        return req
+
+    def test_timing_without_session_pool(self):
+        req = self.timed_request(StaticRouter(self.url))
+
+        self.assertGreater(req.timing.connect, 0)
+        self.assertEqual(0, req.timing.tls)
+        self.assertGreater(req.timing.ttfb, 0)
+
+    def test_timing_with_session_pool(self):
+        pool = SessionPool(size=1)
+        self.addCleanup(pool.close)
+        router = StaticRouter(self.url, session_pool=pool)
+
+        first = self.timed_request(router)
+        second = self.timed_request(router)
+
+        self.assertGreater(first.timing.connect, 0)
+        self.assertEqual(0, second.timing.connect)
+        self.assertGreater(second.timing.ttfb, 0)
+
+    def test_async_timing(self):
+        async def run():
+            router = AsyncStaticRouter(self.url)
+            try:
+                first, second = ServiceRequest('foobar', '/'), ServiceRequest('foobar', '/')
+                first.timing, second.timing = RequestTiming(), RequestTiming()
+                await router.request(first)
+                await router.request(second)
+                return first, second
+            finally:
+                await router.close()
+
+        first, second = run_async(run())
+
+        self.assertGreater(first.timing.connect, 0)
+        self.assertGreater(first.timing.ttfb, 0)
+        self.assertEqual(0, second.timing.connect)
+        self.assertGreater(second.timing.ttfb, 0)
+
+
+class TestBalancerFeedback(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('localhost', 0), HelloHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.host = 'localhost:%d' % self.server.server_port
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(2)
+
+    def test_router_reports_responses(self):
+        balancer = StaticHostBalancer(self.host)
+        balancer.on_request = unittest.mock.MagicMock()
+        balancer.on_response = unittest.mock.MagicMock()
+
+        req = ServiceRequest('foobar', '/')
+        HostRouter(balancer).request(req)
+
+        self.assertEqual(self.host, req.host)
+        balancer.on_request.assert_called_once_with('foobar', self.host)
+        service, host, latency, ok = balancer.on_response.call_args[0]
+        self.assertEqual(('foobar', self.host, True), (service, host, ok))
+        self.assertGreater(latency, 0)
+
+    def test_router_reports_failures(self):
+        balancer = StaticHostBalancer('localhost:1')
+        balancer.on_response = unittest.mock.MagicMock()
+
+        self.assertRaises(Exception, HostRouter(balancer).request, ServiceRequest('foobar', '/'))
+        self.assertFalse(balancer.on_response.call_args[0][3])
+
+    def test_async_router_reports_responses(self):
+        balancer = StaticHostBalancer(self.host)
+        balancer.on_response = unittest.mock.MagicMock()
+
+        async def run():
+            router = AsyncHostRouter(balancer)
+            try:
+                await router.request(ServiceRequest('foobar', '/'))
+            finally:
+                await router.close()
+
+        run_async(run())
+
+        service, host, latency, ok = balancer.on_response.call_args[0]
+        self.assertEqual(('foobar', self.host, True), (service, host, ok))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('localhost', 0), HelloHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.host = 'localhost:%d' % self.server.server_port
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(2)
+
+    def test_dead_host_is_skipped(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('foobar', hosts=[self.host, 'localhost:1'], weights=[1, 1]))
+
+        changes = list()
+        health = HostHealth(failure_threshold=2, reset_timeout=60, listener=lambda *args: changes.append(args))
+        router = HostRouter(WeightedRoundRobinBalancer(rtbl), health=health)
+
+        hosts = list()
+        failed = 0
+        for _ in range(10):
+            req = ServiceRequest('foobar', '/')
+            try:
+                router.request(req)
+            except requests.ConnectionError:
+                failed += 1
+            hosts.append(req.host)
+
+        self.assertEqual(2, failed)
+        self.assertEqual(OPEN, health.state('localhost:1'))
+        self.assertEqual([self.host] * 6, hosts[4:])
+        self.assertEqual([('localhost:1', CLOSED, OPEN)], changes)
+
+    def test_no_available_host(self):
+        rtbl = RoutingTable()
+        rtbl.get_routing = unittest.mock.MagicMock(
+            return_value=RoutingRecord('foobar', hosts=['localhost:1'], weights=[1]))
+
+        router = HostRouter(WeightedRoundRobinBalancer(rtbl), health=HostHealth(failure_threshold=1, reset_timeout=60))
+
+        self.assertRaises(requests.ConnectionError, router.request, ServiceRequest('foobar', '/'))
+        self.assertRaises(HostUnavailableError, router.request, ServiceRequest('foobar', '/'))
+
+
+class TestAsyncRouter(unittest.TestCase):
+
+    def test_async_router_url_creation(self):
+        balancer = StaticLocalhostBalancer()
+
+        url = AsyncStaticRouter('http://localhost')._get_url(ServiceRequest('foobar', '/some/service'))
+        self.assertEqual('http://localhost/some/service', url)
+
+        url = AsyncHostRouter(balancer)._get_url(ServiceRequest('foobar', '/some/service'))
+        self.assertEqual('http://localhost/some/service', url)
+
+        url = AsyncServiceRouter(balancer)._get_url(ServiceRequest('foobar', '/some/service'))
+        self.assertEqual('http://localhost/foobar/some/service', url)
+
+    def test_async_request_returns_requests_response(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = b'hello'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('localhost', 0), Handler)
+        t = threading.Thread(target=server.serve_forever)
+        t.start()
+
+        async def do_requests():
+            router = AsyncStaticRouter('http://localhost:%d' % server.server_port)
+            try:
+                return (
+                    await router.request(ServiceRequest('foobar', '/some/service')),
+                    await router.request(ServiceRequest('foobar', '/some/service', stream=True))
+                )
+            finally:
+                await router.close()
+
+        try:
+            response, streamed = run_async(do_requests())
+        finally:
+            server.shutdown()
+            t.join(2)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('hello', response.text)
+        self.assertEqual('text/plain; charset=utf-8', response.headers['content-type'])
+        self.assertTrue(response.url.endswith('/some/service'))
+
+        self.assertEqual(200, streamed.status_code)
+        self.assertEqual('', streamed.text)
+        self.assertEqual(5, streamed.body_size)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,123 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from galileo.routing.router import StaticRouter, ServiceRequest
+from galileo.routing.session import SessionPool
+from tests.testutils import assert_poll
+
+
+class ConnectionCountingServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer requires Python 3.7
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.clients = set()
+
+    def verify_request(self, request, client_address):
+        self.clients.add(client_address)
+        return True
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionPoolTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ConnectionCountingServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(2)
+
+    def test_router_reuses_connection(self):
+        pool = SessionPool(size=2)
+        router = StaticRouter(self.url, session_pool=pool)
+
+        try:
+            for _ in range(5):
+                response = router.request(ServiceRequest('aservice', '/'))
+                self.assertEqual(200, response.status_code)
+        finally:
+            pool.close()
+
+        self.assertEqual(1, len(self.server.clients))
+        self.assertEqual(0, len(pool))
+
+    def test_router_without_keep_alive_opens_new_connections(self):
+        pool = SessionPool(size=2, keep_alive=False)
+        router = StaticRouter(self.url, session_pool=pool)
+
+        try:
+            for _ in range(3):
+                router.request(ServiceRequest('aservice', '/'))
+        finally:
+            pool.close()
+
+        self.assertEqual(3, len(self.server.clients))
+
+    def test_sessions_are_kept_per_host(self):
+        pool = SessionPool()
+
+        try:
+            s1 = pool.session(self.url + '/a')
+            s2 = pool.session(self.url + '/b/c')
+            s3 = pool.session('http://localhost:%d/a' % self.server.server_port)
+        finally:
+            pool.close()
+
+        self.assertIs(s1, s2)
+        self.assertIsNot(s1, s3)
+
+    def test_idle_sessions_are_replaced(self):
+        pool = SessionPool(idle_timeout=0.1)
+
+        try:
+            s1 = pool.session(self.url)
+            self.assertIs(s1, pool.session(self.url))
+
+            time.sleep(0.2)
+            s2 = pool.session(self.url)
+            self.assertIsNot(s1, s2)
+            self.assertIs(s2, pool.session(self.url))
+            self.assertEqual(1, len(pool))
+        finally:
+            pool.close()
+
+    def test_warmup_opens_connections(self):
+        pool = SessionPool(size=2)
+
+        try:
+            pool.warmup([self.url + '/a', self.url + '/b'], connections=2)
+            assert_poll(lambda: len(self.server.clients) == 2, 'expected two connections after warmup')
+
+            for _ in range(4):
+                pool.request('get', self.url + '/')
+        finally:
+            pool.close()
+
+        self.assertEqual(2, len(self.server.clients))
@@ -0,0 +1,72 @@
+import multiprocessing
+import unittest
+
+from galileo.routing.shared import SharedRoutingSegment, SharedMemoryRoutingTable
+from galileo.routing.table import RoutingRecord
+from galileo.worker.context import Context
+
+
+def read_segment(segment: SharedRoutingSegment, queue):
+    queue.put(SharedMemoryRoutingTable(segment).get_routing('aservice'))
+
+
+class SharedRoutingTableTest(unittest.TestCase):
+
+    def test_write_and_read(self):
+        segment = SharedRoutingSegment(4096)
+        self.assertEqual((0, []), segment.read())
+
+        records = [RoutingRecord('aservice', ['ahost', 'bhost'], [1.0, 2.0]), RoutingRecord('bservice', ['c'], [1.0])]
+        self.assertEqual(2, segment.write(records))
+        self.assertEqual((2, records), segment.read())
+
+        self.assertEqual(4, segment.write(records[:1]))
+        self.assertEqual((4, records[:1]), segment.read())
+
+    def test_write_too_large_table(self):
+        segment = SharedRoutingSegment(64)
+        segment.write([RoutingRecord('aservice', ['a'], [1.0])])
+
+        self.assertRaises(ValueError, segment.write, [RoutingRecord('aservice', ['a' * 100], [1.0])])
+        self.assertEqual(['a'], segment.read()[1][0].hosts)
+
+    def test_table_reads_new_versions(self):
+        segment = SharedRoutingSegment(4096)
+        rtbl = SharedMemoryRoutingTable(segment)
+
+        self.assertRaises(ValueError, rtbl.get_routing, 'aservice')
+
+        segment.write([RoutingRecord('aservice', ['a'], [1.0]), RoutingRecord('bservice', ['b'], [1.0])])
+        arecord = rtbl.get_routing('aservice')
+        self.assertEqual(['a'], arecord.hosts)
+        self.assertIs(arecord, rtbl.get_routing('aservice'))
+        self.assertEqual({'aservice', 'bservice'}, rtbl.list_services())
+
+        segment.write([RoutingRecord('aservice', ['a'], [1.0]), RoutingRecord('bservice', ['b', 'c'], [1.0, 1.0])])
+        self.assertIs(arecord, rtbl.get_routing('aservice'))  # unchanged records keep their identity
+        self.assertEqual(['b', 'c'], rtbl.get_routing('bservice').hosts)
+
+    def test_segment_is_shared_with_processes(self):
+        segment = SharedRoutingSegment(4096)
+        rtbl = SharedMemoryRoutingTable(segment)
+        queue = multiprocessing.Queue()
+
+        process = multiprocessing.Process(target=read_segment, args=(segment, queue))
+        segment.write([RoutingRecord('aservice', ['a'], [1.0])])
+        process.start()
+        try:
+            self.assertEqual(RoutingRecord('aservice', ['a'], [1.0]), queue.get(timeout=5))
+        finally:
+            process.join(2)
+
+        self.assertEqual(['a'], rtbl.get_routing('aservice').hosts)
+
+    def test_context_creates_segment_for_caching_routers(self):
+        self.assertIsNotNone(Context({}).create_shared_routing_segment())
+        self.assertIsNone(Context({'galileo_router_type': 'DebugRouter'}).create_shared_routing_segment())
+        self.assertIsNone(Context({'galileo_worker_shared_routing_table': 'false'}).create_shared_routing_segment())
+
+        ctx = Context({})
+        ctx.routing_segment = SharedRoutingSegment(4096)
+        rtbl, _ = ctx._create_dynamic_router_parts('CachingSymmetryHostRouter', None, None)
+        self.assertIsInstance(rtbl, SharedMemoryRoutingTable)
@@ -1,9 +1,11 @@
 import time
 import unittest
+import unittest.mock
 
 from timeout_decorator import timeout_decorator
 
-from galileo.routing.table import RoutingTable, RoutingRecord, RedisRoutingTable, ReadOnlyListeningRedisRoutingTable
+from galileo.routing.table import RoutingTable, RoutingRecord, RedisRoutingTable, ReadOnlyListeningRedisRoutingTable, \
+    decode_record
 from tests.testutils import RedisResource
 
 
@@ -91,6 +93,89 @@ class TestRoutingTable(unittest.TestCase):
         pubsub.unsubscribe(RedisRoutingTable.update_channel)
         pubsub.close()
 
+    @timeout_decorator.timeout(5)
+    def test_records_are_published_on_set(self):
+        pubsub = self.redis.rds.pubsub()
+
+        pubsub.subscribe(RedisRoutingTable.record_channel)
+
+        listener = pubsub.listen()
+
+        next(listener)  # subscription message
+
+        self.rtbl.set_routing(RoutingRecord('aservice', ['ahost', 'bhost'], [2.0, 3.0]))
+        msg = next(listener)
+        self.assertEqual(('aservice', 1, RoutingRecord('aservice', ['ahost', 'bhost'], [2.0, 3.0])),
+                         decode_record(msg['data']))
+
+        self.rtbl.set_routing(RoutingRecord('bservice', ['ahost', 'bhost'], [2.0, 3.0]))
+        msg = next(listener)
+        self.assertEqual(('bservice', 2, RoutingRecord('bservice', ['ahost', 'bhost'], [2.0, 3.0])),
+                         decode_record(msg['data']))
+
+        self.rtbl.remove_service('bservice')
+        msg = next(listener)
+        self.assertEqual(('bservice', 3, None), decode_record(msg['data']))
+
+        pubsub.unsubscribe(RedisRoutingTable.record_channel)
+        pubsub.close()
+
+    def test_record_is_stored_in_both_formats(self):
+        self.rtbl.set_routing(RoutingRecord('aservice', ['ahost', 'bhost'], [1, 2]))
+        self.rtbl.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+
+        keys = set(self.redis.rds.keys('routing:*'))
+        self.assertEqual({'routing:services', 'routing:version', 'routing:record:aservice', 'routing:hosts:aservice',
+                          'routing:weights:aservice'}, keys)
+        self.assertEqual(
+            ('aservice', 2, RoutingRecord('aservice', ['ahost'], [1.0])),
+            decode_record(self.redis.rds.get('routing:record:aservice'))
+        )
+        self.assertEqual(['ahost'], self.redis.rds.lrange('routing:hosts:aservice', 0, -1))
+        self.assertEqual(['1.0'], self.redis.rds.lrange('routing:weights:aservice', 0, -1))
+        self.assertEqual([(2, RoutingRecord('aservice', ['ahost'], [1.0]))],
+                         self.rtbl.get_versioned_routings(['aservice', 'bservice']))
+
+        self.rtbl.clear()
+        self.assertEqual({'routing:version'}, set(self.redis.rds.keys('routing:*')))
+
+    def test_record_is_stored_in_one_key_without_legacy(self):
+        rtbl = RedisRoutingTable(self.redis.rds, legacy=False)
+        rtbl.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+
+        keys = set(self.redis.rds.keys('routing:*'))
+        self.assertEqual({'routing:services', 'routing:version', 'routing:record:aservice'}, keys)
+
+    def test_legacy_records_are_read(self):
+        self.redis.rds.sadd('routing:services', 'aservice')
+        self.redis.rds.rpush('routing:hosts:aservice', 'ahost', 'bhost')
+        self.redis.rds.rpush('routing:weights:aservice', 1, 2.5)
+
+        self.rtbl.set_routing(RoutingRecord('bservice', ['chost'], [1.0]))
+
+        self.assertEqual(RoutingRecord('aservice', ['ahost', 'bhost'], [1.0, 2.5]), self.rtbl.get_routing('aservice'))
+        self.assertEqual([(1, RoutingRecord('bservice', ['chost'], [1.0])),
+                          (0, RoutingRecord('aservice', ['ahost', 'bhost'], [1.0, 2.5]))],
+                         self.rtbl.get_versioned_routings(['bservice', 'aservice']))
+        self.assertEqual(2, len(self.rtbl.get_routes()))
+
+        self.rtbl.remove_service('aservice')
+        self.assertEqual({'routing:services', 'routing:version', 'routing:record:bservice', 'routing:hosts:bservice',
+                          'routing:weights:bservice'}, set(self.redis.rds.keys('routing:*')))
+
+    def test_migrate(self):
+        self.redis.rds.sadd('routing:services', 'aservice')
+        self.redis.rds.rpush('routing:hosts:aservice', 'ahost')
+        self.redis.rds.rpush('routing:weights:aservice', 1)
+        self.rtbl.set_routing(RoutingRecord('bservice', ['bhost'], [1.0]))
+
+        self.assertEqual(1, self.rtbl.migrate())
+        self.assertEqual(
+            ('aservice', 2, RoutingRecord('aservice', ['ahost'], [1.0])),
+            decode_record(self.redis.rds.get('routing:record:aservice'))
+        )
+        self.assertEqual(0, self.rtbl.migrate())
+
 
 class TestListeningTable(unittest.TestCase):
     redis = RedisResource()
@@ -148,6 +233,121 @@ class TestListeningTable(unittest.TestCase):
         self.assertIn('bservice', self.rtbl.list_services())
         self.assertEqual(1, len(self.rtbl.list_services()))
 
+    def test_get_routings_skips_missing_services(self):
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+        self.rtbl_mutable.set_routing(RoutingRecord('bservice', ['bhost'], [2.0]))
+
+        records = self.rtbl_mutable.get_routings(['aservice', 'cservice', 'bservice'])
+
+        self.assertEqual([RoutingRecord('aservice', ['ahost'], [1.0]), RoutingRecord('bservice', ['bhost'], [2.0])],
+                         records)
+
+    def test_start_preloads_records(self):
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+        self.rtbl_mutable.set_routing(RoutingRecord('bservice', ['bhost'], [2.0]))
+
+        rtbl = ReadOnlyListeningRedisRoutingTable(self.redis.rds)
+        rtbl.start()
+        self.addCleanup(rtbl.stop, 2)
+
+        with unittest.mock.patch.object(rtbl.rtable, 'rds') as rds:
+            self.assertEqual(['ahost'], rtbl.get_routing('aservice').hosts)
+            self.assertEqual(['bhost'], rtbl.get_routing('bservice').hosts)
+            self.assertEqual({'aservice', 'bservice'}, rtbl.list_services())
+            self.assertEqual(2, len(rtbl.get_routes()))
+            rds.assert_not_called()
+            rds.pipeline.assert_not_called()
+
+    def test_update_swaps_snapshot(self):
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+        self.rtbl_mutable.set_routing(RoutingRecord('bservice', ['bhost'], [2.0]))
+        time.sleep(0.25)
+
+        snapshot = self.rtbl._snapshot
+        brecord = self.rtbl.get_routing('bservice')
+
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost', 'chost'], [1.0, 1.0]))
+        time.sleep(0.25)
+
+        self.assertEqual(['ahost'], snapshot.records['aservice'].hosts)  # old snapshots are never modified
+        self.assertEqual(['ahost', 'chost'], self.rtbl.get_routing('aservice').hosts)
+        self.assertIs(brecord, self.rtbl.get_routing('bservice'))
+
+        # an update that does not change the record keeps the cached object
+        arecord = self.rtbl.get_routing('aservice')
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost', 'chost'], [1.0, 1.0]))
+        time.sleep(0.25)
+        self.assertIs(arecord, self.rtbl.get_routing('aservice'))
+
+    def test_listeners_receive_snapshots(self):
+        snapshots = list()
+        self.rtbl.add_listener(snapshots.append)
+
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+        time.sleep(0.25)
+
+        self.assertEqual(1, len(snapshots))
+        self.assertEqual({'aservice'}, snapshots[-1].services)
+        self.assertIs(self.rtbl._snapshot, snapshots[-1])
+
+    def test_updates_are_applied_from_messages(self):
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+        time.sleep(0.25)
+
+        with unittest.mock.patch.object(self.rtbl.rtable, 'rds') as rds:
+            self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost', 'bhost'], [1.0, 1.0]))
+            time.sleep(0.25)
+            rds.assert_not_called()
+            rds.mget.assert_not_called()
+
+        self.assertEqual(['ahost', 'bhost'], self.rtbl.get_routing('aservice').hosts)
+        self.assertEqual(2, self.rtbl._snapshot.versions['aservice'])
+
+    def test_stale_updates_are_ignored(self):
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['bhost'], [1.0]))
+        time.sleep(0.25)
+
+        snapshot = self.rtbl._snapshot
+        record = self.rtbl._apply('aservice', 1, RoutingRecord('aservice', ['ahost'], [1.0]))
+        self.assertEqual(['bhost'], record.hosts)
+        self.assertIs(snapshot, self.rtbl._snapshot)
+        self.assertEqual(['bhost'], self.rtbl.get_routing('aservice').hosts)
+
+        # a removal is not undone by an older record
+        self.rtbl_mutable.remove_service('aservice')
+        time.sleep(0.25)
+        self.rtbl._apply('aservice', 2, RoutingRecord('aservice', ['bhost'], [1.0]))
+        self.assertNotIn('aservice', self.rtbl.list_services())
+
+    def test_legacy_records_are_loaded(self):
+        self.redis.rds.sadd('routing:services', 'aservice')
+        self.redis.rds.rpush('routing:hosts:aservice', 'ahost')
+        self.redis.rds.rpush('routing:weights:aservice', 1)
+
+        rtbl = ReadOnlyListeningRedisRoutingTable(self.redis.rds)
+        rtbl.start()
+        self.addCleanup(rtbl.stop, 2)
+
+        self.assertEqual(RoutingRecord('aservice', ['ahost'], [1.0]), rtbl.get_routing('aservice'))
+
+        self.rtbl_mutable.set_routing(RoutingRecord('aservice', ['bhost'], [1.0]))
+        time.sleep(0.25)
+        self.assertEqual(['bhost'], rtbl.get_routing('aservice').hosts)
+
+    def test_versions_of_removed_services_are_bounded(self):
+        self.rtbl.max_removed = 2
+
+        for i in range(4):
+            self.rtbl_mutable.set_routing(RoutingRecord('service%d' % i, ['ahost'], [1.0]))
+        for i in range(4):
+            self.rtbl_mutable.remove_service('service%d' % i)
+        time.sleep(0.25)
+
+        self.assertEqual(0, len(self.rtbl.list_services()))
+        self.assertEqual({'service2', 'service3'}, set(self.rtbl._snapshot.versions))
+        self.assertEqual((0, None, 4), self.rtbl.cache_info())
+
 
 if __name__ == '__main__':
     unittest.main()
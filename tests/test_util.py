@@ -1,6 +1,8 @@
+import time
 import unittest
+from unittest.mock import patch
 
-from galileo.util import to_seconds
+from galileo.util import to_seconds, wall_time
 
 
 class TestUtil(unittest.TestCase):
@@ -11,3 +13,16 @@ class TestUtil(unittest.TestCase):
         self.assertEqual(60, to_seconds('1m'))
         self.assertEqual(600, to_seconds('10m'))
         self.assertEqual(610, to_seconds('10m 10s'))
+
+    def test_wall_time(self):
+        self.assertAlmostEqual(time.time(), wall_time(), delta=0.01)
+
+        values = [wall_time() for _ in range(1000)]
+        self.assertEqual(values, sorted(values))
+
+    def test_wall_time_is_re_anchored_after_clock_step(self):
+        stepped = time.time() + 3600
+        with patch('galileo.util.time.time', return_value=stepped):
+            self.assertAlmostEqual(stepped, wall_time(), delta=0.01)
+
+        self.assertAlmostEqual(time.time(), wall_time(), delta=0.01)
@@ -1,18 +1,25 @@
+import json
 import os
 import threading
 import time
 import unittest
+from http.server import BaseHTTPRequestHandler
 from queue import Queue
 from typing import List, NamedTuple
 from unittest.mock import patch
 
+from galileodb.model import RequestTrace
 from pymq.provider.simple import SimpleEventBus
 from timeout_decorator import timeout_decorator
 
-from galileo.routing import ServiceRequest, RedisRoutingTable, RoutingRecord
-from galileo.worker.api import ClientDescription, ClientConfig, SetWorkloadCommand
-from galileo.worker.client import Client, RequestGenerator, single_request
+from galileo.routing import ServiceRequest, RedisRoutingTable, RoutingRecord, StaticRouter, SessionPool
+from galileo.controller import RedisClusterController
+from galileo.worker.api import ClientDescription, ClientConfig, SetWorkloadCommand, WorkloadDoneEvent, \
+    WorkloadArmedEvent, StartWorkloadCommand, StopWorkloadCommand
+from galileo.worker.client import Client, RequestGenerator, single_request, AsyncClient, ClientHost
 from galileo.worker.context import Context, DebugRouter
+from galileo.worker.trace import TraceBatch, timing_breakdown
+from tests.routing.test_session import ConnectionCountingServer
 from tests.testutils import RedisResource
 
 
@@ -32,6 +39,14 @@ class StaticRequestGenerator:
         pass
 
 
+def get_traces(trace_queue: Queue, n: int, timeout=2) -> List[RequestTrace]:
+    traces = list()
+    while len(traces) < n:
+        batch: TraceBatch = trace_queue.get(timeout=timeout)
+        traces.extend(batch.unpack())
+    return traces
+
+
 class ClientTest(unittest.TestCase):
 
     @timeout_decorator.timeout(5)
@@ -55,8 +70,7 @@ class ClientTest(unittest.TestCase):
 
         client.run()
 
-        trace1 = trace_queue.get(timeout=2)
-        trace2 = trace_queue.get(timeout=2)
+        trace1, trace2 = get_traces(trace_queue, 2)
 
         self.assertEqual('aservice', trace1.service)
         self.assertEqual('aservice', trace2.service)
@@ -68,6 +82,37 @@ class ClientTest(unittest.TestCase):
         self.assertAlmostEqual(now, trace1.done, delta=2)
         self.assertAlmostEqual(now, trace2.done, delta=2)
 
+    @timeout_decorator.timeout(5)
+    def test_async_client_integration(self):
+        env = dict(os.environ)
+        env['galileo_router_type'] = 'DebugRouter'
+
+        client_id = 'unittest_client'
+        ctx = Context(env)
+        trace_queue = Queue()
+
+        description = ClientDescription(client_id, 'unittest_worker', ClientConfig('aservice'))
+
+        client = AsyncClient(ctx, trace_queue, description, eventbus=SimpleEventBus())
+
+        client.request_generator = StaticRequestGenerator([
+            ServiceRequest('aservice'),
+            ServiceRequest('aservice'),
+        ])
+
+        client.run()
+
+        trace1, trace2 = get_traces(trace_queue, 2)
+
+        self.assertEqual('aservice', trace1.service)
+        self.assertEqual('aservice', trace2.service)
+
+        self.assertEqual('debughost', trace1.server)
+        self.assertEqual('debughost', trace2.server)
+
+        self.assertEqual(200, trace1.status)
+        self.assertEqual(2, client.request_counter)
+
     @timeout_decorator.timeout(5)
     def test_with_router_fault(self):
         class FaultInjectingRouter(DebugRouter):
@@ -96,12 +141,387 @@ class ClientTest(unittest.TestCase):
 
         client.run()
 
-        trace1 = trace_queue.get(timeout=2)
-        trace2 = trace_queue.get(timeout=2)
+        # requests are performed concurrently, so the order of traces is not deterministic
+        trace1, trace2 = sorted(get_traces(trace_queue, 2), key=lambda t: t.sent)
 
         self.assertEqual(-1, trace1.sent)
         self.assertAlmostEqual(trace2.sent, time.time(), delta=2)
 
+    def _run_overloaded_client(self, overload_policy):
+        release = threading.Event()
+
+        class BlockingRouter(DebugRouter):
+            def request(self, req: ServiceRequest) -> 'requests.Response':
+                release.wait(2)
+                return super().request(req)
+
+        router = BlockingRouter()
+
+        ctx = Context()
+        ctx.create_router = lambda: router
+        trace_queue = Queue()
+
+        cfg = ClientConfig('aservice', max_inflight=1, max_queued=0, overload_policy=overload_policy)
+        description = ClientDescription('unittest_client', 'unittest_worker', cfg)
+        client = Client(ctx, trace_queue, description, eventbus=SimpleEventBus())
+
+        client.request_generator = StaticRequestGenerator([
+            ServiceRequest('aservice'),
+            ServiceRequest('aservice'),
+            ServiceRequest('aservice'),
+        ])
+
+        client.run()
+        self.assertEqual(1, client._backlog)
+        release.set()
+
+        return client, trace_queue
+
+    @timeout_decorator.timeout(5)
+    def test_overload_policy_drop(self):
+        client, trace_queue = self._run_overloaded_client('drop')
+
+        traces = get_traces(trace_queue, 3)
+        statuses = sorted(t.status for t in traces)
+
+        self.assertEqual([-2, -2, 200], statuses)
+        self.assertEqual(2, client.dropped_counter)
+        self.assertEqual(0, client.failed_counter)
+
+    @timeout_decorator.timeout(5)
+    def test_overload_policy_shed(self):
+        client, trace_queue = self._run_overloaded_client('shed')
+
+        trace, = get_traces(trace_queue, 1)
+        self.assertEqual(200, trace.status)
+        self.assertEqual(2, client.dropped_counter)
+        self.assertTrue(trace_queue.empty())
+
+    def test_unknown_overload_policy(self):
+        description = ClientDescription('unittest_client', 'unittest_worker',
+                                        ClientConfig('aservice', overload_policy='nope'))
+
+        with self.assertRaises(ValueError):
+            Client(Context(), Queue(), description, eventbus=SimpleEventBus())
+
+    def test_async_client_max_queued_requires_max_inflight(self):
+        description = ClientDescription('unittest_client', 'unittest_worker',
+                                        ClientConfig('aservice', max_queued=10, overload_policy='drop'))
+
+        with self.assertRaises(ValueError):
+            AsyncClient(Context({'galileo_router_type': 'DebugRouter'}), Queue(), description,
+                        eventbus=SimpleEventBus())
+
+
+class BodyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'hello world'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Galileo', 'yes')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TraceLevelTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = ConnectionCountingServer(('127.0.0.1', 0), BodyHandler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(2)
+
+    def run_client(self, n=1, **kwargs) -> List[RequestTrace]:
+        pool = SessionPool(size=1)
+        router = StaticRouter(self.url, session_pool=pool)
+        self.addCleanup(pool.close)
+
+        ctx = Context()
+        ctx.create_router = lambda: router
+        trace_queue = Queue()
+
+        cfg = ClientConfig('aservice', max_inflight=1, **kwargs)
+        description = ClientDescription('unittest_client', 'unittest_worker', cfg)
+        client = Client(ctx, trace_queue, description, eventbus=SimpleEventBus())
+        client.request_generator = StaticRequestGenerator([ServiceRequest('aservice') for _ in range(n)])
+        client.run()
+
+        return get_traces(trace_queue, n)
+
+    @timeout_decorator.timeout(5)
+    def test_full(self):
+        trace, = self.run_client(trace_level='full')
+
+        self.assertEqual(200, trace.status)
+        self.assertEqual('hello world', trace.response)
+        self.assertEqual('yes', json.loads(trace.headers)['X-Galileo'])
+
+    @timeout_decorator.timeout(5)
+    def test_timing(self):
+        trace, = self.run_client(trace_level='timing')
+
+        self.assertEqual(200, trace.status)
+        self.assertIsNone(trace.response)
+        self.assertIsNone(trace.headers)
+        self.assertGreaterEqual(trace.done, trace.sent)
+
+    @timeout_decorator.timeout(5)
+    def test_size_discards_body_and_reuses_connection(self):
+        traces = self.run_client(n=3, trace_level='size')
+
+        for trace in traces:
+            self.assertEqual(200, trace.status)
+            self.assertIsNone(trace.response)
+            self.assertEqual({'Content-Length': '11'}, json.loads(trace.headers))
+
+        self.assertEqual(1, len(self.server.clients))
+
+    @timeout_decorator.timeout(5)
+    def test_headers_with_whitelist(self):
+        trace, = self.run_client(trace_level='headers', trace_headers=['x-galileo', 'Content-Type'])
+
+        self.assertIsNone(trace.response)
+        self.assertEqual({'X-Galileo': 'yes', 'Content-Type': 'text/plain'}, json.loads(trace.headers))
+
+    @timeout_decorator.timeout(5)
+    def test_trace_timing(self):
+        first, second = self.run_client(n=2, trace_level='timing', trace_timing=True)
+
+        for trace in (first, second):
+            timing = timing_breakdown(trace)
+            self.assertEqual({'connect', 'tls', 'ttfb', 'transfer'}, set(timing.keys()))
+            self.assertGreater(timing['ttfb'], 0)
+            self.assertGreaterEqual(timing['transfer'], 0)
+            self.assertLessEqual(sum(timing.values()), trace.done - trace.sent + 1e-6)
+
+        # only the first request opens the connection, the second one re-uses it
+        self.assertGreater(timing_breakdown(first)['connect'], 0)
+        self.assertEqual(0, timing_breakdown(second)['connect'])
+
+    def test_unknown_trace_level(self):
+        description = ClientDescription('unittest_client', 'unittest_worker',
+                                        ClientConfig('aservice', trace_level='nope'))
+
+        with self.assertRaises(ValueError):
+            Client(Context(), Queue(), description, eventbus=SimpleEventBus())
+
+
+class ClosedLoopTest(unittest.TestCase):
+
+    @timeout_decorator.timeout(10)
+    def test_virtual_users(self):
+        lock = threading.Lock()
+        concurrency = {'current': 0, 'max': 0}
+
+        class CountingRouter(DebugRouter):
+            def request(self, req: ServiceRequest) -> 'requests.Response':
+                with lock:
+                    concurrency['current'] += 1
+                    concurrency['max'] = max(concurrency['max'], concurrency['current'])
+                response = super().request(req)  # sets req.sent
+                time.sleep(0.01)
+                with lock:
+                    concurrency['current'] -= 1
+                return response
+
+        router = CountingRouter()
+        ctx = Context()
+        ctx.create_router = lambda: router
+
+        bus = SimpleEventBus()
+        bus.run()
+        self.addCleanup(bus.close)
+
+        done = threading.Event()
+
+        def on_done(event: WorkloadDoneEvent):
+            done.set()
+
+        bus.subscribe(on_done)
+
+        trace_queue = Queue()
+        description = ClientDescription('unittest_client', 'unittest_worker', ClientConfig('aservice'))
+        client = Client(ctx, trace_queue, description, eventbus=bus)
+
+        client._on_set_workload_command(SetWorkloadCommand('unittest_client', num=20, parameters=(0.005,), users=3))
+
+        self.assertTrue(done.wait(5), 'workload did not finish')
+        traces = get_traces(trace_queue, 20)
+
+        self.assertEqual(20, len({t.request_id for t in traces}))
+        self.assertEqual(3, concurrency['max'])
+
+        stats = client.get_info().users
+        self.assertEqual(3, len(stats))
+        self.assertEqual(20, sum(user.requests for user in stats))
+        for user in stats:
+            self.assertFalse(user.busy)
+            self.assertGreaterEqual(user.response_time_mean, 0.01)
+            self.assertGreaterEqual(user.response_time_max, user.response_time_mean)
+
+        # switching to an open-loop workload drops the users
+        client._on_set_workload_command(SetWorkloadCommand('unittest_client', num=1, parameters=(0.005,)))
+        self.assertIsNone(client.get_info().users)
+
+        client.close()
+
+
+class ClientHostTest(unittest.TestCase):
+
+    @timeout_decorator.timeout(10)
+    def test_hosts_multiple_clients(self):
+        ctx = Context({'galileo_router_type': 'DebugRouter'})
+        bus = SimpleEventBus()
+        bus.run()
+        self.addCleanup(bus.close)
+        trace_queue = Queue()
+
+        host = ClientHost(ctx, trace_queue, eventbus=bus)
+        try:
+            c1 = host.add_client(ClientDescription('client-1', 'unittest_worker', ClientConfig('aservice')))
+            c2 = host.add_client(ClientDescription('client-2', 'unittest_worker', ClientConfig('bservice')))
+
+            # clients share the router but are otherwise separate
+            self.assertIs(c1.router, c2.router)
+            self.assertNotEqual(c1.client_id, c2.client_id)
+
+            bus.publish(SetWorkloadCommand('client-2', num=3))
+
+            traces = get_traces(trace_queue, 3)
+            self.assertEqual({'client-2'}, {t.client for t in traces})
+            self.assertEqual({'bservice'}, {t.service for t in traces})
+
+            infos = {info.description.client_id: info for info in host.get_info().infos}
+            self.assertEqual(0, infos['client-1'].requests)
+            self.assertEqual(3, infos['client-2'].requests)
+
+            host.remove_client('client-1')
+            self.assertEqual(['client-2'], [info.description.client_id for info in host.get_info().infos])
+        finally:
+            host.close()
+
+        self.assertEqual(0, len(host.clients))
+
+
+class SyncStartTest(unittest.TestCase):
+
+    @timeout_decorator.timeout(10)
+    def test_sync_workload_starts_clients_at_same_time(self):
+        ctx = Context({'galileo_router_type': 'DebugRouter'})
+        bus = SimpleEventBus()
+        bus.run()
+        self.addCleanup(bus.close)
+        trace_queue = Queue()
+
+        done = set()
+        all_done = threading.Event()
+
+        def on_done(event: WorkloadDoneEvent):
+            done.add(event.client_id)
+            if len(done) == 3:
+                all_done.set()
+
+        bus.subscribe(on_done)
+
+        host = ClientHost(ctx, trace_queue, eventbus=bus)
+        try:
+            client_ids = ['client-1', 'client-2', 'client-3']
+            for client_id in client_ids:
+                host.add_client(ClientDescription(client_id, 'unittest_worker', ClientConfig('aservice')))
+
+            ctrl = RedisClusterController(None, eventbus=bus)
+            then = time.time()
+            start, armed = ctrl.sync_workload(client_ids, ia=0.01, n=5, start_delay=0.3)
+            self.assertAlmostEqual(then + 0.3, start, delta=0.1)
+            self.assertEqual(client_ids, armed)
+
+            self.assertTrue(all_done.wait(5), 'workload did not finish')
+            traces = get_traces(trace_queue, 15)
+
+            for client_id in client_ids:
+                first = min(t.created for t in traces if t.client == client_id)
+                self.assertAlmostEqual(start + 0.01, first, delta=0.005)
+
+            for info in host.get_info().infos:
+                self.assertIsNotNone(info.start_lag)
+                self.assertLess(info.start_lag, 0.005)
+        finally:
+            host.close()
+
+    @timeout_decorator.timeout(10)
+    def test_sync_workload_stops_clients_that_did_not_arm(self):
+        bus = SimpleEventBus()
+        bus.run()
+        self.addCleanup(bus.close)
+
+        started = Queue()
+        stopped = Queue()
+
+        def on_set_workload(cmd: SetWorkloadCommand):
+            if cmd.client_id == 'client-1':
+                bus.publish(WorkloadArmedEvent(cmd.client_id))
+
+        def on_start_workload(cmd: StartWorkloadCommand):
+            started.put(cmd)
+
+        def on_stop_workload(cmd: StopWorkloadCommand):
+            stopped.put(cmd)
+
+        bus.subscribe(on_set_workload)
+        bus.subscribe(on_start_workload)
+        bus.subscribe(on_stop_workload)
+
+        ctrl = RedisClusterController(None, eventbus=bus)
+        start, armed = ctrl.sync_workload(['client-1', 'client-2'], ia=0.01, n=5, start_delay=0.1, timeout=0.5)
+
+        self.assertEqual(['client-1'], armed)
+        self.assertEqual(['client-1'], started.get(timeout=2).client_ids)
+        self.assertEqual(StopWorkloadCommand('client-2'), stopped.get(timeout=2))
+
+    @timeout_decorator.timeout(10)
+    def test_armed_workload_waits_for_start_command(self):
+        bus = SimpleEventBus()
+        bus.run()
+        self.addCleanup(bus.close)
+
+        armed = Queue()
+
+        def on_armed(event: WorkloadArmedEvent):
+            armed.put(event.client_id)
+
+        bus.subscribe(on_armed)
+
+        trace_queue = Queue()
+        description = ClientDescription('unittest_client', 'unittest_worker', ClientConfig('aservice'))
+        client = Client(Context(), trace_queue, description, eventbus=bus, router=DebugRouter())
+        try:
+            client._on_set_workload_command(SetWorkloadCommand('unittest_client', num=3, users=1, armed=True))
+            self.assertEqual('unittest_client', armed.get(timeout=2))
+
+            time.sleep(0.1)
+            self.assertEqual(0, client.request_counter)
+
+            start = time.time() + 0.1
+            client._on_start_workload_command(StartWorkloadCommand(['unittest_client'], start))
+
+            traces = get_traces(trace_queue, 3)
+            self.assertEqual(3, len(traces))
+            self.assertGreaterEqual(min(t.created for t in traces), start)
+            self.assertIsNotNone(client.get_info().start_lag)
+        finally:
+            client.close()
+
 
 class TestSingleRequest(unittest.TestCase):
     redis_resource = RedisResource()
@@ -144,7 +564,6 @@ def queue_collect(vq: Queue, gen):
 
 class RequestGeneratorTest(unittest.TestCase):
 
-    @unittest.skip('FIXME')
     def test_with_limit_and_no_interval(self):
         workload = SetWorkloadCommand('myclient', 3)
         request_generator = RequestGenerator(lambda: 1)
@@ -164,7 +583,6 @@ class RequestGeneratorTest(unittest.TestCase):
             request_generator.close()
             t.join(2)
 
-    @unittest.skip('FIXME')
     def test_with_interval(self):
         workload = SetWorkloadCommand('myclient', parameters=(0.1,))  # 0.1 interarrival delay
         request_generator = RequestGenerator(lambda: 1)
@@ -201,3 +619,135 @@ class RequestGeneratorTest(unittest.TestCase):
         finally:
             request_generator.close()
             t.join(2)
+
+    def test_with_high_rate_does_not_drift(self):
+        workload = SetWorkloadCommand('myclient', num=500, parameters=(0.002,))  # 500 requests per second
+        request_generator = RequestGenerator(lambda: 1)
+        q = Queue()
+
+        t = threading.Thread(target=queue_collect, args=(q, request_generator.run()))
+        t.start()
+
+        try:
+            then = time.time()
+            request_generator.set_workload(workload)
+
+            while True:
+                item = q.get(timeout=2)
+                if item is RequestGenerator.DONE:
+                    break
+
+            self.assertAlmostEqual(1, time.time() - then, delta=0.1)
+
+            stats = request_generator.get_stats()
+            self.assertEqual(500, stats.dispatched)
+            self.assertLess(stats.lag_mean, 0.01)
+        finally:
+            request_generator.close()
+            t.join(2)
+
+    def test_requests_carry_scheduled_time(self):
+        workload = SetWorkloadCommand('myclient', num=5, parameters=(0.05,))
+        request_generator = RequestGenerator(lambda: ServiceRequest('aservice'))
+        q = Queue()
+
+        t = threading.Thread(target=queue_collect, args=(q, request_generator.run()))
+        t.start()
+
+        try:
+            then = time.time()
+            request_generator.set_workload(workload)
+
+            requests = []
+            while True:
+                item = q.get(timeout=2)
+                if item is RequestGenerator.DONE:
+                    break
+                requests.append(item)
+
+            self.assertEqual(5, len(requests))
+            self.assertAlmostEqual(then + 0.05, requests[0].scheduled, delta=0.01)
+            for i in range(1, 5):
+                self.assertAlmostEqual(0.05, requests[i].scheduled - requests[i - 1].scheduled, places=6)
+                self.assertGreaterEqual(requests[i].created, requests[i].scheduled)
+        finally:
+            request_generator.close()
+            t.join(2)
+
+    def test_rate_change_while_running(self):
+        request_generator = RequestGenerator(lambda: ServiceRequest('aservice'))
+        q = Queue()
+
+        t = threading.Thread(target=queue_collect, args=(q, request_generator.run()))
+        t.start()
+
+        try:
+            request_generator.set_workload(SetWorkloadCommand('myclient', parameters=(0.2,)))
+            time.sleep(0.5)
+            request_generator.set_workload(SetWorkloadCommand('myclient', parameters=(0.1,)))
+            time.sleep(1)
+
+            self.assertTrue(t.is_alive())
+            self.assertGreaterEqual(q.qsize(), 10)
+        finally:
+            request_generator.close()
+            t.join(2)
+
+    def test_rate_change_resets_scheduler_state(self):
+        request_generator = RequestGenerator(lambda: ServiceRequest('aservice'))
+        q = Queue()
+
+        t = threading.Thread(target=queue_collect, args=(q, request_generator.run()))
+        t.start()
+
+        try:
+            request_generator.set_workload(SetWorkloadCommand('myclient', parameters=(10,)))
+            time.sleep(0.2)
+
+            # the request of the first workload is still waiting for its deadline, and must not be sent
+            then = time.time()
+            request_generator.set_workload(SetWorkloadCommand('myclient', num=2, parameters=(0.1,)))
+
+            requests = [q.get(timeout=2), q.get(timeout=2)]
+            self.assertEqual(RequestGenerator.DONE, q.get(timeout=2))
+            self.assertAlmostEqual(then + 0.1, requests[0].scheduled, delta=0.05)
+            self.assertAlmostEqual(then + 0.2, requests[1].scheduled, delta=0.05)
+            self.assertEqual(2, request_generator.get_stats().dispatched)
+
+            # pausing drops the waiting request as well
+            request_generator.set_workload(SetWorkloadCommand('myclient', parameters=(0.3,)))
+            time.sleep(0.1)
+            request_generator.pause()
+            time.sleep(0.4)
+            self.assertTrue(q.empty())
+            self.assertTrue(t.is_alive())
+        finally:
+            request_generator.close()
+            t.join(2)
+
+    def test_schedule_is_anchored_at_start_time(self):
+        start = time.time() + 0.3
+        workload = SetWorkloadCommand('myclient', distribution='schedule', parameters=(0.2, [20, 0, 10]), start=start)
+        request_generator = RequestGenerator(lambda: ServiceRequest('aservice'))
+        q = Queue()
+
+        t = threading.Thread(target=queue_collect, args=(q, request_generator.run()))
+        t.start()
+
+        try:
+            request_generator.set_workload(workload)
+
+            requests = []
+            while True:
+                item = q.get(timeout=2)
+                if item is RequestGenerator.DONE:
+                    break
+                requests.append(item)
+
+            self.assertEqual(6, len(requests))
+            self.assertAlmostEqual(start + 0.05, requests[0].scheduled, delta=0.001)
+            self.assertAlmostEqual(start + 0.5, requests[4].scheduled, delta=0.001)
+            self.assertGreaterEqual(requests[0].created, start)
+        finally:
+            request_generator.close()
+            t.join(2)
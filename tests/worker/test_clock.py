@@ -0,0 +1,113 @@
+import time
+import unittest
+
+from galileodb.model import RequestTrace
+
+from galileo.controller import RedisClusterController
+from galileo.worker.api import ClockEstimate
+from galileo.worker.clock import measure_offset, estimate_drift, correct_trace, SharedClockEstimate, ClockSync
+from tests.testutils import RedisResource
+
+
+class SkewedRedis:
+    """
+    Fakes the TIME command of a redis server whose clock is ``skew`` seconds ahead, and runs ``drift`` seconds per
+    second faster than the local clock.
+    """
+
+    def __init__(self, skew, drift=0.) -> None:
+        super().__init__()
+        self.skew = skew
+        self.drift = drift
+        self.origin = time.time()
+
+    def time(self):
+        now = time.time()
+        t = now + self.skew + self.drift * (now - self.origin)
+        return int(t), int((t % 1) * 1e6)
+
+
+class ClockTest(unittest.TestCase):
+
+    def test_measure_offset(self):
+        offset, rtt = measure_offset(SkewedRedis(5.), samples=4)
+
+        self.assertAlmostEqual(5., offset, delta=0.001)
+        self.assertGreaterEqual(rtt, 0)
+
+    def test_estimate_drift(self):
+        history = [(t, 1. + 1e-4 * t) for t in range(0, 100, 10)]
+
+        self.assertAlmostEqual(1e-4, estimate_drift(history))
+        self.assertEqual(0., estimate_drift(history[:1]))
+
+    def test_correct_trace(self):
+        trace = RequestTrace('r1', 'c1', 'aservice', created=10., sent=-1, done=12., status=-1)
+        estimate = ClockEstimate(offset=1., drift=0.01, rtt=0.001, timestamp=10.)
+
+        corrected = correct_trace(trace, estimate)
+
+        self.assertAlmostEqual(11., corrected.created)
+        self.assertEqual(-1, corrected.sent)
+        self.assertAlmostEqual(13.02, corrected.done)
+
+    def test_shared_clock_estimate(self):
+        clock = SharedClockEstimate()
+        self.assertIsNone(clock.get())
+
+        estimate = ClockEstimate(offset=1.5, drift=1e-6, rtt=0.002, timestamp=1000.)
+        clock.set(estimate)
+        self.assertEqual(estimate, clock.get())
+
+    def test_clock_sync_estimates_offset_and_drift(self):
+        estimates = list()
+        sync = ClockSync(SkewedRedis(-2., drift=0.1), samples=2, callback=estimates.append)
+
+        sync.update()
+        time.sleep(0.2)
+        estimate = sync.update()
+
+        self.assertEqual(2, len(estimates))
+        self.assertAlmostEqual(-2. + 0.1 * 0.2, estimate.offset, delta=0.01)
+        self.assertAlmostEqual(0.1, estimate.drift, delta=0.02)
+
+    def test_clock_sync_thread(self):
+        sync = ClockSync(SkewedRedis(1.), interval=0.05, samples=2)
+        sync.start()
+        try:
+            time.sleep(0.2)
+        finally:
+            sync.stop(timeout=2)
+
+        self.assertIsNotNone(sync.estimate)
+        self.assertAlmostEqual(1., sync.estimate.offset, delta=0.01)
+
+
+class WorkerClockTest(unittest.TestCase):
+    redis_resource = RedisResource()
+
+    def setUp(self) -> None:
+        self.redis_resource.setUp()
+        self.rds = self.redis_resource.rds
+        self.ctrl = RedisClusterController(self.rds)
+
+    def tearDown(self) -> None:
+        self.redis_resource.tearDown()
+
+    def test_measure_offset_against_redis(self):
+        offset, rtt = measure_offset(self.rds)
+
+        # the redis server runs on the same host
+        self.assertAlmostEqual(0., offset, delta=0.05)
+        self.assertGreater(rtt, 0)
+
+    def test_update_and_get_worker_clock(self):
+        self.assertIsNone(self.ctrl.get_worker_clock('worker1'))
+
+        estimate = ClockEstimate(offset=0.25, drift=1e-6, rtt=0.001, timestamp=1000.5)
+        self.ctrl.register_worker('worker1')
+        self.ctrl.update_worker_clock('worker1', estimate)
+        self.assertEqual(estimate, self.ctrl.get_worker_clock('worker1'))
+
+        self.ctrl.unregister_worker('worker1')
+        self.assertIsNone(self.ctrl.get_worker_clock('worker1'))
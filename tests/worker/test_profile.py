@@ -0,0 +1,68 @@
+import itertools
+import unittest
+
+from galileo.worker.context import Context
+from galileo.worker.profile import ProfileStore, pack, unpack
+from galileo.worker.random import create_sampler, InvalidDistributionException
+from tests.testutils import RedisResource
+
+
+class ProfileStoreTest(unittest.TestCase):
+    redis_resource = RedisResource()
+
+    def setUp(self) -> None:
+        self.redis_resource.setUp()
+        self.rds = self.redis_resource.rds
+        self.store = ProfileStore(self.rds, chunk_size=4, page_size=2)
+
+    def tearDown(self) -> None:
+        self.redis_resource.tearDown()
+
+    def test_pack_unpack(self):
+        self.assertEqual([0.5, 1.0, 0.25], unpack(pack([0.5, 1.0, 0.25])))
+
+    def test_save_and_info(self):
+        info = self.store.save('p1', [float(i) for i in range(10)])
+
+        self.assertEqual(10, info.length)
+        self.assertEqual(info, self.store.info('p1'))
+        self.assertEqual(3, self.rds.llen('galileo:profile:p1'))
+        self.assertEqual(['p1'], self.store.list_profiles())
+
+    def test_stream_leaves_profile_in_place(self):
+        values = [float(i) for i in range(19)]
+        self.store.save('p1', values)
+
+        self.assertEqual(values, list(self.store.stream('p1')))
+        self.assertEqual(values, list(self.store.stream('p1')))
+
+    def test_stream_with_offset_wraps_around(self):
+        values = [float(i) for i in range(19)]
+        self.store.save('p1', values)
+
+        self.assertEqual(values[5:] + values[:5], list(self.store.stream('p1', offset=5)))
+        self.assertEqual(values[9:] + values[:9], list(self.store.stream('p1', offset=28)))
+
+    def test_stream_with_time_shift(self):
+        self.store.save('p1', [1., 2., 3.])
+
+        self.assertEqual([11., 2., 3.], list(self.store.stream('p1', time_shift=10)))
+
+    def test_stream_unknown_profile(self):
+        self.assertRaises(KeyError, list, self.store.stream('p1'))
+
+    def test_delete(self):
+        self.store.save('p1', [1., 2., 3.])
+        self.store.delete('p1')
+
+        self.assertIsNone(self.store.info('p1'))
+        self.assertEqual(0, self.rds.llen('galileo:profile:p1'))
+
+    def test_profile_sampler(self):
+        ctx = Context({'galileo_redis_host': 'file://' + self.redis_resource.tmpfile})
+        ProfileStore(self.rds).save('p1', [0.5, 0.25, 0.125])
+
+        sampler = create_sampler('profile', ('p1', 1), ctx, client_id='c1')
+        self.assertEqual([0.25, 0.125, 0.5], list(itertools.islice(sampler, 5)))
+
+        self.assertRaises(InvalidDistributionException, create_sampler, 'profile', ('p2',), ctx)
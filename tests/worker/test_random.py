@@ -0,0 +1,106 @@
+import itertools
+import statistics
+import unittest
+
+from galileo.worker.context import Context
+from galileo.worker.random import create_sampler, InvalidDistributionException, block_sampler, python_sampler, \
+    schedule
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def take(gen, n):
+    return list(itertools.islice(gen, n))
+
+
+class RandomTest(unittest.TestCase):
+
+    def test_seeded_sampler_is_reproducible(self):
+        ctx = Context()
+
+        values1 = take(create_sampler('expovariate', (10,), ctx, client_id='c1', seed=42), 100)
+        values2 = take(create_sampler('expovariate', (10,), ctx, client_id='c1', seed=42), 100)
+        values3 = take(create_sampler('expovariate', (10,), ctx, client_id='c2', seed=42), 100)
+
+        self.assertEqual(values1, values2)
+        self.assertNotEqual(values1, values3)
+
+    def test_negative_seed(self):
+        ctx = Context()
+
+        values1 = take(create_sampler('expovariate', (10,), ctx, client_id='c1', seed=-1), 100)
+        values2 = take(create_sampler('expovariate', (10,), ctx, seed=-1), 100)
+
+        self.assertEqual(values1, take(create_sampler('expovariate', (10,), ctx, client_id='c1', seed=-1), 100))
+        self.assertEqual(100, len(values2))
+
+    def test_unknown_distribution(self):
+        self.assertRaises(InvalidDistributionException, create_sampler, 'foo', (1,), Context())
+
+    def test_invalid_parameters(self):
+        self.assertRaises(InvalidDistributionException, create_sampler, 'uniform', (1,), Context())
+
+    def test_schedule_constant(self):
+        # 2 rps in the first second, nothing in the second, 4 rps in the third, 1 rps in the fourth
+        values = list(schedule(1, [2, 0, 4, 1]))
+
+        self.assertEqual([0.5, 0.5, 1.25, 0.25, 0.25, 0.25, 1.0], values)
+
+    def test_schedule_exponential(self):
+        values = list(create_sampler('schedule', (1, [100, 0, 50], 'exponential'), Context(), client_id='c1', seed=1))
+
+        self.assertAlmostEqual(150, len(values), delta=40)
+        self.assertLessEqual(sum(values), 3)
+
+        arrivals = list(itertools.accumulate(values))
+        self.assertFalse([t for t in arrivals if 1 < t < 2], 'expected no arrivals in the idle tick')
+
+    def test_schedule_invalid_parameters(self):
+        self.assertRaises(InvalidDistributionException, create_sampler, 'schedule', (1,), Context())
+        self.assertRaises(InvalidDistributionException, create_sampler, 'schedule', (1, [1], 'foo'), Context())
+        self.assertRaises(InvalidDistributionException, create_sampler, 'schedule', (0, [1]), Context())
+        self.assertRaises(InvalidDistributionException, create_sampler, 'schedule', (1, ['x']), Context())
+        self.assertRaises(InvalidDistributionException, create_sampler, 'schedule', (1, [1, -1]), Context())
+
+    def test_python_sampler(self):
+        values = take(python_sampler('uniform', (1, 2), seed=1), 100)
+
+        self.assertEqual(100, len(values))
+        for value in values:
+            self.assertTrue(1 <= value <= 2)
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_block_sampler_crosses_blocks(self):
+        values = take(block_sampler('uniform', (1, 2), seed=1, size=16), 100)
+
+        self.assertEqual(100, len(values))
+        self.assertEqual(100, len(set(values)))
+        for value in values:
+            self.assertIsInstance(value, float)
+            self.assertTrue(1 <= value <= 2)
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_block_sampler_matches_python_parameterization(self):
+        cases = [
+            ('constant', (0.5,)),
+            ('uniform', (1, 3)),
+            ('triangular', (0, 4, 1)),
+            ('normalvariate', (5, 1)),
+            ('lognormvariate', (0, 0.5)),
+            ('expovariate', (4,)),
+            ('vonmisesvariate', (1, 4)),
+            ('gammavariate', (2, 0.5)),
+            ('gauss', (5, 1)),
+            ('betavariate', (2, 5)),
+            ('paretovariate', (3,)),
+            ('weibullvariate', (2, 1.5)),
+        ]
+
+        for distribution, args in cases:
+            expected = statistics.mean(take(python_sampler(distribution, args, seed=1), 20000))
+            actual = statistics.mean(take(block_sampler(distribution, args, seed=1), 20000))
+
+            self.assertAlmostEqual(expected, actual, delta=0.05 * abs(expected) + 0.01, msg=distribution)
@@ -0,0 +1,127 @@
+import queue
+import unittest
+
+from galileodb.model import RequestTrace
+from galileodb.trace import POISON
+from timeout_decorator import timeout_decorator
+
+from galileo.worker.api import ClockEstimate
+from galileo.worker.clock import SharedClockEstimate
+from galileo.worker.trace import latency, corrected_latency, delay, latency_view, TraceBuffer, TraceBatch, \
+    BatchTraceReader
+
+
+def create_trace(i) -> RequestTrace:
+    return RequestTrace('r%d' % i, 'c1', 'aservice', created=10., sent=10., done=11., status=200, server='ahost')
+
+
+class TraceTest(unittest.TestCase):
+
+    def test_latencies(self):
+        trace = RequestTrace('r1', 'c1', 'aservice', created=10., sent=10.5, done=11., status=200, server='ahost')
+
+        self.assertAlmostEqual(0.5, latency(trace))
+        self.assertAlmostEqual(1., corrected_latency(trace))
+        self.assertAlmostEqual(0.5, delay(trace))
+
+    def test_latencies_of_failed_request(self):
+        trace = RequestTrace('r1', 'c1', 'aservice', created=10., sent=-1, done=11., status=-1)
+
+        self.assertIsNone(latency(trace))
+        self.assertIsNone(delay(trace))
+        self.assertAlmostEqual(1., corrected_latency(trace))
+
+    def test_latency_view(self):
+        traces = [
+            RequestTrace('r1', 'c1', 'aservice', created=10., sent=10., done=10.25, status=200, server='ahost'),
+            RequestTrace('r2', 'c1', 'aservice', created=10.5, sent=11., done=11.25, status=200, server='bhost'),
+        ]
+
+        view = latency_view(traces)
+
+        self.assertEqual(2, len(view))
+        self.assertEqual('r2', view[1].request_id)
+        self.assertEqual('bhost', view[1].server)
+        self.assertAlmostEqual(0.25, view[1].latency)
+        self.assertAlmostEqual(0.75, view[1].corrected_latency)
+        self.assertAlmostEqual(0.5, view[1].delay)
+
+
+class TraceBufferTest(unittest.TestCase):
+
+    def test_sends_batch_when_full(self):
+        q = queue.Queue()
+        buffer = TraceBuffer(q, size=3, max_age=60)
+
+        buffer.put(create_trace(0))
+        buffer.put(create_trace(1))
+        self.assertTrue(q.empty())
+
+        buffer.put(create_trace(2))
+        batch = q.get_nowait()
+
+        self.assertIsInstance(batch, TraceBatch)
+        self.assertEqual([create_trace(i) for i in range(3)], batch.unpack())
+        buffer.close()
+
+    @timeout_decorator.timeout(5)
+    def test_sends_batch_after_max_age(self):
+        q = queue.Queue()
+        buffer = TraceBuffer(q, size=100, max_age=0.2)
+
+        buffer.put(create_trace(0))
+
+        batch = q.get(timeout=2)
+        self.assertEqual([create_trace(0)], batch.unpack())
+        buffer.close()
+
+    def test_close_flushes(self):
+        q = queue.Queue()
+        buffer = TraceBuffer(q, size=100, max_age=60)
+
+        buffer.put(create_trace(0))
+        buffer.close()
+
+        self.assertEqual([create_trace(0)], q.get_nowait().unpack())
+
+    def test_counts_dropped_traces(self):
+        q = queue.Queue(maxsize=1)
+        buffer = TraceBuffer(q, size=2, max_age=60)
+
+        for i in range(6):
+            buffer.put(create_trace(i))
+
+        self.assertEqual(4, buffer.dropped)
+        self.assertEqual(1, q.qsize())
+        buffer.close()
+
+
+class BatchTraceReaderTest(unittest.TestCase):
+
+    def test_unpacks_batches(self):
+        q = queue.Queue()
+        reader = BatchTraceReader(q)
+
+        q.put(TraceBatch.pack([create_trace(0), create_trace(1)]))
+        q.put(TraceBatch([]))
+        q.put(TraceBatch.pack([create_trace(2)]))
+        reader.put(POISON)
+
+        self.assertEqual(create_trace(0), reader.get(timeout=1))
+        self.assertEqual(create_trace(1), reader.get(timeout=1))
+        self.assertEqual(create_trace(2), reader.get(timeout=1))
+        self.assertEqual(POISON, reader.get(timeout=1))
+
+    def test_corrects_timestamps(self):
+        q = queue.Queue()
+        clock = SharedClockEstimate()
+        reader = BatchTraceReader(q, clock)
+
+        q.put(TraceBatch.pack([create_trace(0)]))
+        self.assertEqual(create_trace(0), reader.get(timeout=1))
+
+        clock.set(ClockEstimate(offset=2., drift=0., rtt=0.001, timestamp=10.))
+        q.put(TraceBatch.pack([create_trace(1)]))
+
+        trace = reader.get(timeout=1)
+        self.assertEqual((12., 12., 13.), (trace.created, trace.sent, trace.done))
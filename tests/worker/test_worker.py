@@ -10,10 +10,14 @@ from galileodb.trace import START, PAUSE
 from pymq.provider.redis import RedisConfig
 from timeout_decorator import timeout_decorator
 
-from galileo.worker.api import RegisterWorkerEvent, StartTracingCommand, PauseTracingCommand
+from galileo.routing.shared import SharedMemoryRoutingTable
+from galileo.routing.table import RedisRoutingTable, RoutingRecord
+from galileo.shell.shell import ClientGroup
+from galileo.worker.api import RegisterWorkerEvent, StartTracingCommand, PauseTracingCommand, CreateClientCommand, \
+    ClientConfig
 from galileo.worker.context import Context
 from galileo.worker.daemon import WorkerDaemon
-from tests.testutils import RedisResource
+from tests.testutils import RedisResource, assert_poll
 
 
 class MockQueue:
@@ -73,6 +77,65 @@ class WorkerTest(unittest.TestCase):
 
         worker_thread.join()
 
+    @timeout_decorator.timeout(20)
+    def test_worker_with_process_pool(self):
+        ctx = Context({
+            'galileo_redis_host': 'file://' + self.redis_resource.tmpfile,
+            'galileo_router_type': 'DebugRouter',
+            'galileo_worker_pool_size': '2',
+        })
+
+        worker = WorkerDaemon(ctx, eventbus=self.eventbus)
+        worker_thread = threading.Thread(target=worker.run)
+        worker_thread.start()
+
+        try:
+            assert_poll(lambda: len(worker._pool) == 2, msg='pool was not filled')
+            pooled = list(worker._pool)
+
+            descriptions = worker.create_client(CreateClientCommand(worker.name, ClientConfig('aservice'), 3))
+            self.assertEqual(3, len(descriptions))
+
+            # the idle processes are used first
+            self.assertIs(pooled[0], worker._clients[descriptions[0].client_id])
+            self.assertIs(pooled[1], worker._clients[descriptions[1].client_id])
+            assert_poll(lambda: len(worker._pool) == 2, msg='pool was not refilled')
+
+            assert_poll(lambda: len(ClientGroup(None, []).info()) == 3, msg='clients did not appear')
+
+            worker.close_client(descriptions[0].client_id)
+            assert_poll(lambda: len(ClientGroup(None, []).info()) == 2, msg='client was not closed')
+        finally:
+            worker.close()
+            worker_thread.join()
+
+        self.assertEqual(0, len(worker._pool))
+
+    @timeout_decorator.timeout(10)
+    def test_worker_shares_routing_table(self):
+        ctx = Context({
+            'galileo_redis_host': 'file://' + self.redis_resource.tmpfile,
+            'galileo_router_type': 'CachingSymmetryHostRouter',
+        })
+        rtbl = RedisRoutingTable(self.redis_resource.rds)
+        rtbl.set_routing(RoutingRecord('aservice', ['ahost'], [1.0]))
+
+        worker = WorkerDaemon(ctx, eventbus=self.eventbus)
+        worker_thread = threading.Thread(target=worker.run)
+        worker_thread.start()
+
+        try:
+            shared = SharedMemoryRoutingTable(ctx.routing_segment)
+            assert_poll(lambda: 'aservice' in shared.list_services(), msg='routing table was not shared')
+
+            rtbl.set_routing(RoutingRecord('aservice', ['ahost', 'bhost'], [1.0, 1.0]))
+            assert_poll(lambda: shared.get_routing('aservice').hosts == ['ahost', 'bhost'],
+                        msg='update was not shared')
+        finally:
+            worker.close()
+            worker_thread.join()
+            rtbl.clear()
+
     @timeout_decorator.timeout(5)
     def test_worker_start_logger(self):
         self.assert_msg_in_queue_after_cmd(StartTracingCommand(), START)